@@ -5,7 +5,6 @@ from prospector_io import load_prospector_data, find_all_prospector_results
 from astropy.cosmology import WMAP9
 import brownseds_highz_params as pfile
 from matplotlib.ticker import MaxNLocator, FormatStrFormatter
-from dynesty.plotting import _quantile as weighted_quantile
 from collections import OrderedDict
 
 plt.ioff()
@@ -103,6 +102,7 @@ def do_all(runname='brownseds_highz', outfolder=None, regenerate=False, regenera
               'ylim_vertical_sfr': (-3,3),
               'ylim_vertical_ssfr': (1e-13,1e-9),
               'xlim_t': (1e7,1.4e10),
+              'hist_stack': False,             # stack summed sSFR PDFs instead of sampling the mean
               'show_disp':[0.16,0.84]         # percentile of population distribution to show on plot
              }
 
@@ -231,12 +231,16 @@ def stack_sfh(data, **opts):
             outweight += [weight]
 
         # calculate weighted mean for each SFR bin
-        for i in range(time_per_bin.shape[0]):
-            frac = [f[:,i] for f in outfrac]
-            mean,errup,errdown = calculate_median(frac, outweight)
-            tdict['median'] += [mean]
-            tdict['errup'] += [errup]
-            tdict['errdown'] += [errdown]
+        if opts.get('hist_stack',False):
+            qtiles = calculate_median_hist(outfrac, outweight)
+            tdict['median'], tdict['errup'], tdict['errdown'] = list(qtiles[:,0]), list(qtiles[:,1]), list(qtiles[:,2])
+        else:
+            for i in range(time_per_bin.shape[0]):
+                frac = [f[:,i] for f in outfrac]
+                mean,errup,errdown = calculate_median(frac, outweight)
+                tdict['median'] += [mean]
+                tdict['errup'] += [errup]
+                tdict['errdown'] += [errdown]
 
         # save and dump
         tdict['err'] = prosp_dutils.asym_errors(np.array(tdict['median']),
@@ -279,12 +283,16 @@ def stack_sfh(data, **opts):
             outweight += [weight]
 
         # calculate median of sSFR for each SFR bin
-        for i in range(time_per_bin.shape[0]):
-            frac = [f[:,i] for f in outfrac]
-            mean,errup,errdown = calculate_median(frac, outweight)
-            tdict['median'] += [mean]
-            tdict['errup'] += [errup]
-            tdict['errdown'] += [errdown]
+        if opts.get('hist_stack',False):
+            qtiles = calculate_median_hist(outfrac, outweight)
+            tdict['median'], tdict['errup'], tdict['errdown'] = list(qtiles[:,0]), list(qtiles[:,1]), list(qtiles[:,2])
+        else:
+            for i in range(time_per_bin.shape[0]):
+                frac = [f[:,i] for f in outfrac]
+                mean,errup,errdown = calculate_median(frac, outweight)
+                tdict['median'] += [mean]
+                tdict['errup'] += [errup]
+                tdict['errdown'] += [errdown]
 
         tdict['err'] = prosp_dutils.asym_errors(np.array(tdict['median']),
                                                  np.array(tdict['errup']),
@@ -549,25 +557,16 @@ def calculate_median(frac, weight, ndraw=500000):
 
     return mean, errup, errdown
 
-'''
-def calculate_median(pdf, weight):
-    """given list of N PDFs, sum them
-    and return median + 16th, 84th percentile of sum
-    """
-    ssfrmin, ssfrmax = -13, -8
-    sfrac_arr = 10**np.linspace(ssfrmin,ssfrmax,1001)
-    hist = np.zeros(shape=sfrac_arr.shape[0]-1)
-
-    for i, (f,w) in enumerate(zip(pdf,weight)):
-        g1,_ = np.histogram(np.clip(f,10**ssfrmin,10**ssfrmax), normed=True,weights=w, bins=sfrac_arr)
-        hist += g1
-    median, errup, errdown = weighted_quantile((sfrac_arr[1:]+sfrac_arr[:-1])/2., [0.5,.84,.16],weights=hist)
+def calculate_median_hist(outfrac, outweight, ssfrmin=-13, ssfrmax=-8, nssfr=1001):
+    """sum the (per-galaxy normalized) sSFR PDFs of N galaxies, and return the
+    median, 84th, and 16th percentile of the sum in each time bin.
+    outfrac is a list of N sSFR chains (NSAMPLE,NBINS), outweight the N (NSAMPLE,) weights.
+    every time bin is histogrammed in a single pass over the galaxies.
+    returns (NBINS, 3)
     """
-    nobj = len(pdf)
-    median_array = []
+    sfrac_arr = 10**np.linspace(ssfrmin,ssfrmax,nssfr)
+    chunks = ((f[None,:,:], w[None,:], [0]) for f, w in zip(outfrac, outweight))
+    hist = prosp_dutils.stack_histograms(chunks, sfrac_arr, 1, ncol=outfrac[0].shape[1], normalize=True)
+
+    return prosp_dutils.histogram_quantiles((sfrac_arr[1:]+sfrac_arr[:-1])/2., hist[0], [0.5,.84,.16])
 
-    for i,(f,w) in enumerate(zip(pdf,weight)): median_array += [weighted_quantile(f, np.array([0.5]), weights=w)]
-    median, errup, errdown = np.percentile(median_array, [50,84,16])
-    """
-    return median, errup, errdown
-'''
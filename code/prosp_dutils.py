@@ -4,47 +4,150 @@ from prospect.models import model_setup
 from scipy.interpolate import interp1d
 from scipy.integrate import simps
 from astropy import constants
-from dynesty.plotting import _quantile as wquant
 from scipy.stats import entropy
+from collections import OrderedDict
+
+# top-hat "filters" used for the broad-band luminosities
+_tophat_filters = {
+    'lir': (np.array([8e4-1]+np.linspace(8e4, 1000e4, num=100).tolist()+[1000e4+1]),
+            np.array([0]+np.ones(100).tolist()+[0])),
+    'luv': (np.array([1215]+np.linspace(1216, 3000, num=100).tolist()+[3001]),
+            np.array([0]+np.ones(100).tolist()+[0])),
+    'lmir': (np.array([4e4-1]+np.linspace(4e4, 20e4, num=100).tolist()+[20e4+1]),
+             np.array([0]+np.ones(100).tolist()+[0]))
+}
+
+# integration weights + filter kernels, keyed on the wavelength grid
+_simps_weights, _band_kernels = OrderedDict(), OrderedDict()
+_grid_cache_size = 16
 
 def return_lir(lam,spec,z=None):
     """ returns IR luminosity (8-1000 microns) in erg/s
     input spectrum must be Lsun/Hz, wavelength in \AA
+    spec can be (nwave,) or (ndraw, nwave)
     """
-    lir_filter = [[np.array([8e4-1]+np.linspace(8e4, 1000e4, num=100).tolist()+[1000e4+1])],
-                  [np.array([0]+np.ones(100).tolist()+[0])]]
-
-    # calculate integral
-    _,lir     = integrate_mag(lam,spec,lir_filter, z=z) # comes out in ergs/s
-
-    return lir
+    return band_luminosity(lam, spec, 'lir', z=z)
 
 def return_luv(lam,spec,z=None):
     """ returns UV luminosity (1216-3000 \AA) in erg/s
     input spectrum must be Lsun/Hz, wavelength in \AA
+    spec can be (nwave,) or (ndraw, nwave)
     """
+    return band_luminosity(lam, spec, 'luv', z=z)
 
-    luv_filter = [[np.array([1215]+np.linspace(1216, 3000, num=100).tolist()+[3001])],
-                  [np.array([0]+np.ones(100).tolist()+[0])]]
+def return_lmir(lam,spec,z=None):
+    """ returns MIR luminosity (4-20 microns) in erg/s
+    input spectrum must be Lsun/Hz, wavelength in \AA
+    spec can be (nwave,) or (ndraw, nwave)
+    """
+    return band_luminosity(lam, spec, 'lmir', z=z)
 
-    # calculate integral
-    _,luv     = integrate_mag(lam,spec,luv_filter, z=z) # comes out in ergs/s
+def band_luminosity(lam, spec, bands, z=None):
+    """ luminosity in erg/s in one or more of the top-hat bands in _tophat_filters,
+    using the cached kernels for this wavelength grid.
+    if bands is a list, returns an array with a trailing band axis
+    """
+    single = isinstance(bands, basestring)
+    kernel = np.array([tophat_kernel(lam, band)['lum'] for band in np.atleast_1d(bands)])
+    _, lum = apply_filter_kernel(kernel, None, spec, z=z)
+    return lum[...,0] if single else lum
 
-    return luv
+def _simpson_pairs(h):
+    """ weights of Simpson's rule over consecutive pairs of the (even number of) intervals h
+    """
+    w = np.zeros(h.shape[0]+1)
+    h0, h1 = h[0::2], h[1::2]
+    w[0:-2:2] += (h0+h1)/6. * (2-h1/h0)
+    w[1:-1:2] += (h0+h1)**3/(6.*h0*h1)
+    w[2::2] += (h0+h1)/6. * (2-h0/h1)
+    return w
+
+def simps_weights(x=None, dx=1.0, n=None):
+    """ returns w such that simps(y, x) == np.dot(w, y) for any y on the grid x, or
+    simps(y, dx=dx) for any y of length n if no grid is given.
+    the weights are written down directly: Simpson's rule over each pair of intervals. for an
+    even number of points this is simps' default even='avg', i.e. the mean of Simpson's rule on the
+    first n-1 points + a trapezoid on the last interval, and a trapezoid on the first interval +
+    Simpson's rule on the last n-1 points. cached on the grid.
+    """
+    if x is not None:
+        x = np.asarray(x, dtype=float)
+        key, h = x.tobytes(), np.diff(x)
+    else:
+        key, h = (n, float(dx)), np.zeros(n-1) + dx
+    if key in _simps_weights:
+        _simps_weights[key] = _simps_weights.pop(key)
+        return _simps_weights[key]
+
+    n = h.shape[0]+1
+    w = np.zeros(n)
+    if n % 2 == 1:
+        w += _simpson_pairs(h)
+    else:
+        w[:-1] += _simpson_pairs(h[:-1])/2.
+        w[-2:] += h[-1]/4.
+        w[1:] += _simpson_pairs(h[1:])/2.
+        w[:2] += h[0]/4.
 
+    _simps_weights[key] = w
+    if len(_simps_weights) > _grid_cache_size:
+        _simps_weights.popitem(last=False)
 
-def return_lmir(lam,spec,z=None):
-    """ returns MIR luminosity (4-20 microns) in erg/s
-    input spectrum must be Lsun/Hz, wavelength in \AA
+    return w
+
+def filter_kernel(spec_lam, filter):
+    """ precompute the weight vectors which turn integrate_mag into dot products
+    for a fixed wavelength grid. filter is in the integrate_mag format.
+    returns {'lum': weights giving erg/s, 'lumdens': weights giving erg/s/Hz @ 10pc}
     """
-    botlam, toplam = 4e4-1, 20e4+1
-    lmir_filter = [[np.array([botlam]+np.linspace(botlam+1, toplam-1, num=100).tolist()+[toplam])],
-                  [np.array([0]+np.ones(100).tolist()+[0])]]
+    c, lsun = 2.99E10, 3.839E33
+    pc2cm = 3.08568E18
+
+    spec_lam = np.asarray(spec_lam, dtype=float)
+    w = simps_weights(spec_lam)
+    response_interp_function = interp1d(filter[0][0],filter[1][0], bounds_error = False, fill_value = 0)
+    resp_interp = response_interp_function(spec_lam)
+
+    norm = np.dot(w, resp_interp/spec_lam)
+    kernel = {'lum': w*resp_interp*(c*1e8/(spec_lam**2))*lsun,
+              'lumdens': w*(resp_interp/norm)/spec_lam*lsun/(4.0*np.pi*(pc2cm*10)**2)}
+
+    return kernel
+
+def tophat_kernel(spec_lam, band):
+    """ cached filter_kernel for one of the named bands in _tophat_filters
+    """
+    key = (band, np.asarray(spec_lam, dtype=float).tobytes())
+    if key in _band_kernels:
+        _band_kernels[key] = _band_kernels.pop(key)
+        return _band_kernels[key]
+
+    resp_lam, res = _tophat_filters[band]
+    kernel = filter_kernel(spec_lam, [[resp_lam],[res]])
+    _band_kernels[key] = kernel
+    if len(_band_kernels) > _grid_cache_size*len(_tophat_filters):
+        _band_kernels.popitem(last=False)
+
+    return kernel
+
+def apply_filter_kernel(lum_kernel, lumdens_kernel, spectra, z=None):
+    """ magnitudes and luminosities from filter_kernel weights.
+    kernels can be (nwave,) or stacked into (nfilter, nwave); spectra can be (nwave,) or (ndraw, nwave).
+    output shapes are the spectra's leading axes plus the kernel's leading axes.
+    lumdens_kernel can be None if only luminosities are needed (mag is then None).
+    """
+    spectra = np.asarray(spectra)
+    dfactor = 1.0
+    if z is not None:
+        from astropy.cosmology import WMAP9
+        dfactor = (WMAP9.luminosity_distance(z).value*1e5)**(-2)*(1+z)
 
-    # calculate integral
-    _,lmir     = integrate_mag(lam,spec,lmir_filter, z=z) # comes out in ergs/s
+    luminosity = np.dot(spectra, np.asarray(lum_kernel).T)*dfactor
+    mag = None
+    if lumdens_kernel is not None:
+        mag = -2.5*np.log10(np.dot(spectra, np.asarray(lumdens_kernel).T)*dfactor)-48.60
 
-    return lmir
+    return mag, luminosity
 
 def sfr_uvir(lir,luv):
     """inputs in Lsun. Calculates UV+IR SFR from Whitaker+14
@@ -52,13 +155,19 @@ def sfr_uvir(lir,luv):
     return 1.09e-10*(lir + 2.2*luv)
 
 def smooth_spectrum(lam,spec,sigma,
-                    minlam=0.0,maxlam=1e50):     
+                    minlam=0.0,maxlam=1e50,fast=False):     
 
     '''
     ripped from Charlie Conroy's smoothspec.f90
     the 'fast way'
     integration is truncated at +/-4*sigma
+    fast: apply the same integrals as one cached sparse matrix (see smoothing_matrix) instead
+    of looping over pixels. spec can then also be (nspec, nwave); lam must be increasing.
     '''
+    if fast:
+        spec = np.asarray(spec,dtype=float)
+        return smoothing_matrix(lam,sigma,minlam=minlam,maxlam=maxlam).dot(spec.T).T
+
     c_kms = 2.99e5
     int_trunc=4
     spec_out = copy.copy(spec)
@@ -82,6 +191,54 @@ def smooth_spectrum(lam,spec,sigma,
 
     return spec_out
 
+_smoothing_matrices = OrderedDict()
+_smoothing_cache_size = 8
+
+def smoothing_matrix(lam,sigma,minlam=0.0,maxlam=1e50):
+    '''
+    sparse (nwave, nwave) matrix M such that M.dot(spec) == smooth_spectrum(lam,spec,sigma,minlam,maxlam):
+    row i holds the trapezoidal weights of the normalized gaussian that smooth_spectrum integrates
+    for pixel i (or is the identity, for pixels it leaves alone). lam must be increasing.
+    cached on (lam, sigma, minlam, maxlam), so each spectrum on the grid is one sparse product.
+    '''
+    lam = np.asarray(lam,dtype=float)
+    key = (lam.tobytes(), float(sigma), float(minlam), float(maxlam))
+    if key in _smoothing_matrices:
+        _smoothing_matrices[key] = _smoothing_matrices.pop(key)
+        return _smoothing_matrices[key]
+
+    from scipy.sparse import csr_matrix
+    c_kms = 2.99e5
+    int_trunc = 4
+    nwave = lam.shape[0]
+
+    # the window of each pixel, as in smooth_spectrum: lam-dellam < lam_j < lam+dellam
+    dellam = lam*(int_trunc*sigma/c_kms+1)-lam
+    lo = np.searchsorted(lam,lam-dellam,side='right')
+    hi = np.searchsorted(lam,lam+dellam,side='left')
+    smooth = (lam >= minlam) & (lam <= maxlam) & (hi-lo > 1)
+    count = np.where(smooth, hi-lo, 1)
+    lo = np.where(smooth, lo, np.arange(nwave))
+    rows = np.repeat(np.arange(nwave), count)
+    cols = lo[rows] + np.arange(rows.size) - (np.cumsum(count)-count)[rows]
+
+    # gaussian in velocity, times the trapezoidal weight of each pixel in its window
+    vel = (lam[rows]/lam[cols]-1)*c_kms
+    dx = np.abs(np.diff(vel)) * (rows[1:] == rows[:-1])
+    trap = np.zeros(rows.size)
+    trap[:-1] += dx/2.
+    trap[1:] += dx/2.
+    weights = np.exp(-vel**2/2./sigma**2) * trap
+    norm = np.bincount(rows, weights=weights, minlength=nwave)
+    weights = np.where(smooth[rows], weights/np.where(smooth, norm, 1.0)[rows], 1.0)
+
+    matrix = csr_matrix((weights, (rows, cols)), shape=(nwave, nwave))
+    _smoothing_matrices[key] = matrix
+    if len(_smoothing_matrices) > _smoothing_cache_size:
+        _smoothing_matrices.popitem(last=False)
+
+    return matrix
+
 def asym_errors(center, up, down, log=False):
 
     if log:
@@ -93,6 +250,189 @@ def asym_errors(center, up, down, log=False):
 
     return errarray
 
+def weighted_quantile_columns(x, q, weights):
+    """weighted quantiles of each column of x (ndraw, ncol), all at once.
+    same definition as dynesty's _quantile (interpolating the weighted CDF
+    between sorted samples), which it reproduces to round-off.
+    returns (nq, ncol)
+    """
+    x, q, weights = np.asarray(x, dtype=float), np.atleast_1d(q), np.asarray(weights, dtype=float)
+    if x.ndim == 1:
+        x = x[:,None]
+    nx, cols = x.shape[0], np.arange(x.shape[1])
+    order = np.argsort(x, axis=0)
+    xs = x[order,cols]
+    ws = weights[order]
+
+    # CDF at each sorted sample, starting at zero for the first one
+    cdf = np.zeros_like(ws)
+    cdf[1:] = np.cumsum(ws, axis=0)[:-1]
+    cdf /= cdf[-1]
+
+    # np.interp: the last sample with cdf <= q, and linear interpolation to the next
+    out = np.empty((q.shape[0], x.shape[1]))
+    for i, qq in enumerate(q):
+        lo = np.clip((cdf <= qq).sum(axis=0) - 1, 0, nx-1)
+        hi = np.minimum(lo+1, nx-1)
+        dcdf = cdf[hi,cols] - cdf[lo,cols]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(dcdf > 0, (qq - cdf[lo,cols]) / dcdf, 0.0)
+        out[i] = xs[lo,cols] + np.clip(frac,0,1) * (xs[hi,cols] - xs[lo,cols])
+
+    return out
+
+def grouped_weighted_quantile(group, x, q, weights=None, ngroup=None):
+    """weighted quantiles of x within each group (integer labels 0..ngroup-1), all at once:
+    one sort by (group, x), then cumulative weights within each group.
+    same definition as dynesty's _quantile, or np.percentile if weights is None.
+    labels outside of 0..ngroup-1 are ignored; groups without any weight are NaN.
+    returns (ngroup, nq)
+    """
+    group, x, q = np.asarray(group).astype(int), np.asarray(x, dtype=float), np.atleast_1d(q)
+    weights = np.ones_like(x) if weights is None else np.asarray(weights, dtype=float)
+    if ngroup is None:
+        ngroup = group.max()+1 if group.size else 0
+    keep = (group >= 0) & (group < ngroup)
+    group, x, weights = group[keep], x[keep], weights[keep]
+
+    out = np.full((ngroup, q.shape[0]), np.nan)
+    if x.size == 0:
+        return out
+
+    order = np.lexsort((x, group))
+    g, xs, ws = group[order], x[order], weights[order]
+    count = np.bincount(g, minlength=ngroup)
+    end = np.cumsum(count)
+    start = end - count
+
+    # weight of the samples before each one in its group, normalized by
+    # its value at the last sample in the group (as in _quantile)
+    cw = np.cumsum(ws) - ws
+    cdf = cw - cw[np.minimum(start, x.size-1)][g]
+    last = cdf[np.maximum(end-1, 0)][g]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cdf = np.where(last > 0, cdf / last, 0.0)
+
+    # groups stay in order when searching on 2*group + cdf, since 0 <= cdf <= 1
+    key = 2.*g + cdf
+    total = np.bincount(g, weights=ws, minlength=ngroup)
+    good = np.where(total > 0)[0]
+    for i, qq in enumerate(q):
+        lo = np.searchsorted(key, 2.*good + qq, side='right') - 1
+        lo = np.clip(lo, start[good], end[good]-1)
+        hi = np.minimum(lo+1, end[good]-1)
+        dcdf = cdf[hi] - cdf[lo]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(dcdf > 0, (qq - cdf[lo]) / dcdf, 0.0)
+        out[good,i] = xs[lo] + np.clip(frac,0,1) * (xs[hi] - xs[lo])
+
+    return out
+
+def stack_histograms(chunks, bins, ngroup, ncol=None, normalize=False):
+    """single-pass weighted histograms of posterior samples summed over galaxies, for
+    every (stack, column) at once -- e.g. the sSFR in each time bin, for galaxies in
+    several mass bins.
+    chunks: iterable of (values, weights, group), so that galaxies can be streamed in
+        blocks to bound memory. values is (ngal, nsamp, ncol), weights (ngal, nsamp),
+        group (ngal,) the stack each galaxy goes into (outside 0..ngroup-1 is skipped).
+    values are clipped to the range of bins, digitized once, and the weights accumulated
+    with one bincount over (group, column, bin) per chunk. non-finite values are skipped.
+    ncol only needs to be given if chunks can be empty.
+    normalize=True gives each galaxy unit weight in each column.
+    returns hist (ngroup, ncol, nbins-1)
+    """
+    bins = np.asarray(bins, dtype=float)
+    nb = bins.shape[0]-1
+    hist = None
+    for values, weights, group in chunks:
+        values = np.asarray(values, dtype=float)
+        ncol = values.shape[2]
+        if hist is None:
+            hist = np.zeros(ngroup*ncol*nb)
+        group = np.asarray(group).astype(int)[:,None,None]
+        good = np.isfinite(values) & (group >= 0) & (group < ngroup)
+        w = np.where(good, np.asarray(weights, dtype=float)[:,:,None], 0.0)
+        if normalize:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                w = w / w.sum(axis=1)[:,None,:]
+
+        vidx = np.searchsorted(bins, np.clip(values, bins[0], bins[-1]), side='right') - 1
+        flat = (group*ncol + np.arange(ncol))*nb + np.clip(vidx, 0, nb-1)
+        hist += np.bincount(flat[good], weights=w[good], minlength=hist.shape[0])
+
+    if hist is None:
+        return np.zeros((ngroup, ncol or 0, nb))
+    return hist.reshape(ngroup, ncol, nb)
+
+def histogram_quantiles(centers, hist, q):
+    """weighted quantiles of the (sorted) bin centers, weighted by each histogram in
+    hist (..., nbins), all at once. same definition as dynesty's _quantile.
+    empty histograms give NaN. returns (..., nq)
+    """
+    centers, q = np.asarray(centers, dtype=float), np.atleast_1d(q)
+    shape, nb = hist.shape[:-1], hist.shape[-1]
+    h = np.asarray(hist, dtype=float).reshape(-1, nb)
+    rows = np.arange(h.shape[0])
+
+    # CDF at each bin center, starting at zero for the first one
+    cdf = np.zeros_like(h)
+    cdf[:,1:] = np.cumsum(h, axis=1)[:,:-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cdf /= cdf[:,-1:]
+
+    out = np.empty((h.shape[0], q.shape[0]))
+    for i, qq in enumerate(q):
+        lo = np.clip((cdf <= qq).sum(axis=1) - 1, 0, nb-1)
+        hi = np.minimum(lo+1, nb-1)
+        dcdf = cdf[rows,hi] - cdf[rows,lo]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(dcdf > 0, (qq - cdf[rows,lo]) / dcdf, 0.0)
+        out[:,i] = centers[lo] + np.clip(frac,0,1)*(centers[hi]-centers[lo])
+    out[~np.isfinite(cdf[:,-1])] = np.nan
+
+    return out.reshape(shape+(q.shape[0],))
+
+class LogHistQuantiles(object):
+    """streaming weighted quantiles for many positive quantities at once (e.g. the
+    model flux at each wavelength), without holding every draw in memory.
+
+    each column gets a fixed histogram in log10(value), +/- span dex around a reference
+    (the first draw added, by default), in bins of dlog dex. values beyond the span fall
+    into the edge bins. quantiles are interpolated within bins, so they are good to
+    ~dlog/2 (0.005 dex, ~1%, for the defaults) as long as they lie inside the span.
+    hist and ref are plain arrays, so they can be checkpointed and restored.
+    """
+    def __init__(self, ncol, span=2.0, dlog=0.01):
+        self.span, self.dlog = span, dlog
+        self.nbin = int(np.ceil(2*span/dlog))
+        self.hist = np.zeros((self.nbin, ncol))
+        self.ref = np.full(ncol, np.nan)
+        self._cols = np.arange(ncol)
+
+    def add(self, values, weight=1.0):
+        logv = np.log10(np.clip(values, 1e-300, np.inf))
+        if np.isnan(self.ref).all():
+            self.ref[:] = logv
+        idx = np.floor((logv - self.ref)/self.dlog + self.nbin/2.).astype(int)
+        self.hist[np.clip(idx, 0, self.nbin-1), self._cols] += weight
+
+    def quantiles(self, q):
+        """returns (nq, ncol)
+        """
+        q = np.atleast_1d(q)
+        cdf = np.cumsum(self.hist, axis=0)
+        cdf /= cdf[-1]
+        out = np.empty((q.shape[0], self.hist.shape[1]))
+        for i, qq in enumerate(q):
+            # first bin where the CDF reaches q, and how far through it we get
+            j = np.clip((cdf < qq).sum(axis=0), 0, self.nbin-1)
+            below = np.where(j > 0, cdf[j-1,self._cols], 0.0)
+            inbin = cdf[j,self._cols] - below
+            with np.errstate(invalid='ignore', divide='ignore'):
+                frac = np.where(inbin > 0, (qq - below) / inbin, 0.5)
+            out[i] = self.ref + (j - self.nbin/2. + frac)*self.dlog
+        return 10**out
+
 def running_sigma(x,y,nbins=10,bins=None):
 
     if bins is None:
@@ -103,11 +443,10 @@ def running_sigma(x,y,nbins=10,bins=None):
     idx  = np.digitize(x,bins)
 
     # RUNNING SIGMA
-    siglow, sighigh = np.empty(nbins), np.empty(nbins)
-    for k in range(nbins): siglow[k], sighigh[k] = np.percentile(y[idx-1==k],[16,84])
+    siglow, sighigh = grouped_weighted_quantile(idx-1, y, np.array([0.16,0.84]), ngroup=nbins).T
     outbins = (bins[:-1]+bins[1:])/2.
 
-    return outbins,np.array(siglow),np.array(sighigh)
+    return outbins,siglow,sighigh
 
 def running_median(x,y,nbins=10,avg=False,weights=None,bins=None,return_bincount=False):
 
@@ -117,42 +456,30 @@ def running_median(x,y,nbins=10,avg=False,weights=None,bins=None,return_bincount
         nbins = len(bins)-1
         
     idx  = np.digitize(x,bins)
+    inbin = (idx >= 1) & (idx <= nbins)
+    count = np.bincount(idx[inbin]-1, minlength=nbins)
 
     # median
     if not avg:
 
         if weights is None:
-            running_median = np.array([np.median(y[idx-1==k]) for k in range(nbins)])
+            running_median = grouped_weighted_quantile(idx-1, y, np.array([0.5]), ngroup=nbins)[:,0]
         else:
-            running_median = []
-            for k in range(nbins): 
-                index = (idx-1==k)
-                if index.sum() == 0:
-                    running_median += [[0.0,0.0,0.0]]
-                elif index.sum() == 1:
-                    running_median += [[y[index][0],y[index][0],y[index][0]]]
-                else:
-                    weight = weights[index] / weights[index].sum()
-                    running_median += [wquant(y[index],np.array([0.5, 0.84, 0.16]),weights=weight)]
-            running_median = np.array(running_median)
+            running_median = grouped_weighted_quantile(idx-1, y, np.array([0.5, 0.84, 0.16]),
+                                                       weights=weights, ngroup=nbins)
+            running_median[count == 0] = 0.0
 
     # average
     if avg: 
-        running_median= []
-        for k in range(nbins): # for loop because we can't pass an empty array to np.average!
-            if (idx-1==k).sum() == 0:
-                running_median.append(0.0)
-            else:
-                if weights is None:
-                    weight = None
-                else:
-                    weight = weights[idx-1==k]
-                running_median.append(np.average(y[idx-1==k],weights=weight))
-        running_median = np.array(running_median)
+        weight = np.ones_like(y, dtype=float) if weights is None else weights
+        wsum = np.bincount(idx[inbin]-1, weights=weight[inbin], minlength=nbins)
+        ysum = np.bincount(idx[inbin]-1, weights=(weight*y)[inbin], minlength=nbins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            running_median = np.where(count > 0, ysum/wsum, 0.0)
     outbins = (bins[:-1]+bins[1:])/2.
 
     if return_bincount:
-        return outbins,running_median, np.array([(idx-1 == i).sum() for i in range(nbins)])
+        return outbins,running_median, count
     return outbins,running_median
 
 def get_cmap(N,cmap='nipy_spectral'):
@@ -620,7 +947,13 @@ def massweighted_age(sfh_params):
     mwa = (sfh_params['mass_fraction'] * avg_age_per_bin).sum()/1e9
     return mwa
 
-def halfmass_assembly_time(sfh_params):
+def halfmass_assembly_time(sfh_params,c=0.5):
+    """ lookback time [Gyr] at which a fraction c of the total mass had formed
+    """
+
+    # closed form for nonparametric SFHs
+    if (sfh_params['sfh'] == 0) | (sfh_params['sfh'] == 3):
+        return batch_mass_assembly_time(sfh_params['mass_fraction'], sfh_params['agebins'], frac=c)[0]
 
     from scipy.optimize import brentq
 
@@ -628,7 +961,7 @@ def halfmass_assembly_time(sfh_params):
     # c = 0.5 if half-mass assembly time occurs before burst
     try:
         half_time = brentq(sfh_half_time, 0,14,
-                           args=(sfh_params,0.5),
+                           args=(sfh_params,c),
                            rtol=1.48e-08, maxiter=1000)
     except ValueError:
         # big problem
@@ -713,8 +1046,9 @@ def generate_basenames(runname,ancilname=None):
     else:
 
         # read file names directly from the results folder
+        from prospector_io import results_dir_index
         results_dir = os.getenv('APPS')+"/prospector_alpha/results/"+runname
-        all_ids = ["_".join(f.split('_')[:-2]) for f in os.listdir(results_dir)]
+        all_ids = ["_".join(f.split('_')[:-2]) for f in results_dir_index(results_dir)['files']]
         ids = list(set(all_ids))
 
         # construct outputs
@@ -818,55 +1152,118 @@ def integrate_mag(spec_lam,spectra,filter, z=None):
         SPEC_LAM: must be in angstroms. this will NOT BE corrected for reddening even if redshift is specified. this
         allows you to calculate magnitudes in rest or observed frame.
         SPECTRA: must be in Lsun/Hz (FSPS standard). if redshift is specified, the normalization will be taken care of.
+            can be (nwave,) or (ndraw, nwave)
     OUTPUT:
         MAG: comes out as absolute magnitude
         LUMINOSITY: comes out in erg/s
             NOTE: if redshift is specified, INSTEAD RETURN apparent magnitude and flux [erg/s/cm^2]
     '''
 
-    resp_lam = filter[0][0]
-    res      = filter[1][0]
+    kernel = filter_kernel(spec_lam, filter)
+    mag, luminosity = apply_filter_kernel(kernel['lum'], kernel['lumdens'], spectra, z=z)
 
-    # physical units, in CGS
-    pc2cm = 3.08568E18
-    lsun  = 3.839E33
-    c     = 2.99E10
+    return mag, luminosity
 
-    # interpolate filter response onto spectral lambda array
-    # when interpolating, set response outside wavelength range to be zero.
-    response_interp_function = interp1d(resp_lam,res, bounds_error = False, fill_value = 0)
-    resp_interp = response_interp_function(spec_lam)
-    
-    # integrate spectrum over filter response
-    # first calculate luminosity: convert to flambda (factor of c/lam^2, with c converted to AA/s)
-    # then integrate over flambda [Lsun/AA] to get Lsun
-    spec_flam = spectra*(c*1e8/(spec_lam**2))
-    luminosity = simps(spec_flam*resp_interp,spec_lam)
-    
-    # now calculate luminosity density [erg/s/Hz] in filter
-    # this involves normalizing the filter response by integrating over wavelength
-    norm = simps(resp_interp/spec_lam,spec_lam)
-    luminosity_density = simps(spectra*(resp_interp/norm)/spec_lam,spec_lam)
+# filter response files are parsed once into {headers, offsets, lam, res} and saved in the user
+# cache directory (see prospector_io.user_cache_filename). individual curves are then kept in a
+# small in-process LRU. both are checked against the modification time of the file.
+_filter_files = {}
+_filter_lru = OrderedDict()
+_filter_lru_size = 512
 
-    # if redshift is specified, convert to flux and apparent magnitude
-    if z is not None:
-        from astropy.cosmology import WMAP9
+def _parse_fsps_filters(filename):
+    """ allfilters.dat: a '#' header line for each filter, followed by (lambda, response) lines
+    """
+    headers, lam, res, offsets = [], [], [], [0]
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.find('#') != -1:
+                if len(headers): offsets.append(len(lam))
+                headers.append(line.strip())
+                continue
+            data = line.split()
+            if len(data) < 2 or not len(headers): continue
+            lam.append(float(data[0]))
+            res.append(float(data[1]))
+    offsets.append(len(lam))
+    return headers, offsets, lam, res
+
+def _parse_eazy_filters(filename):
+    """ FILTER.RES: a header line starting with the number of lines N for each filter,
+    followed by N lines of (index, lambda, response)
+    """
+    headers, lam, res, offsets = [], [], [], [0]
+    with open(filename, 'r') as f:
+        line = f.readline()
+        while line.strip():
+            headers.append(line.strip())
+            for kk in xrange(int(line.split()[0])):
+                data = f.readline().split()
+                lam.append(float(data[1]))
+                res.append(float(data[2]))
+            offsets.append(len(lam))
+            line = f.readline()
+    return headers, offsets, lam, res
+
+def load_filter_file(filename, fmt='fsps'):
+    """ returns {'headers','offsets','lam','res'} for a whole filter response file,
+    where filter i is lam[offsets[i]:offsets[i+1]]. fmt is 'fsps' or 'eazy'.
+    """
+    from prospector_io import user_cache_filename
 
-        dfactor = (WMAP9.luminosity_distance(z).value*1e5)**(-2)*(1+z)
-        luminosity = luminosity*dfactor
-        luminosity_density = luminosity_density*dfactor
+    mtime = os.path.getmtime(filename)
+    if ((filename,fmt) in _filter_files) and (_filter_files[(filename,fmt)][0] == mtime):
+        return _filter_files[(filename,fmt)][1]
 
-    # convert luminosity density to flux density
-    # the units of the spectra are Lsun/Hz; convert to
-    # erg/s/cm^2/Hz, at 10pc for absolute mags
-    flux_density = luminosity_density*lsun/(4.0*np.pi*(pc2cm*10)**2)
-    luminosity   = luminosity*lsun
+    cachename = user_cache_filename(filename, '.'+fmt+'.npz')
+    if (cachename is not None) and os.path.isfile(cachename) and (os.path.getmtime(cachename) >= mtime):
+        with np.load(cachename) as npz:
+            reg = {key: npz[key] for key in npz.files}
+    else:
+        parser = {'fsps': _parse_fsps_filters, 'eazy': _parse_eazy_filters}[fmt]
+        headers, offsets, lam, res = parser(filename)
+        reg = {'headers': np.array(headers), 'offsets': np.array(offsets,dtype=int),
+               'lam': np.array(lam), 'res': np.array(res)}
+        if cachename is not None:
+            try:
+                with open(cachename, 'wb') as f:
+                    np.savez(f, **reg)
+            except (IOError, OSError):
+                pass
+
+    reg['headers_lower'] = np.array([h.lower() for h in reg['headers']])
+    _filter_files[(filename,fmt)] = (mtime, reg)
+    return reg
+
+def filter_registry(filename, key, fmt='fsps'):
+    """ returns (lam, res) for one filter in a filter response file.
+    key is a (sub)string of the filter name, matched case-insensitively if it is lower-case,
+    or (if an integer) the 1-indexed filter number.
+    returns (None, None) if the filter is not in the file.
+    """
+    lkey = (filename, key, fmt)
+    if (lkey in _filter_lru) and (_filter_lru[lkey][0] == os.path.getmtime(filename)):
+        _filter_lru[lkey] = _filter_lru.pop(lkey)
+        _, lam, res = _filter_lru[lkey]
+        return lam.copy(), res.copy()
+
+    reg = load_filter_file(filename, fmt=fmt)
+    if isinstance(key, (int, np.integer)):
+        idx = key-1 if (0 < key <= len(reg['headers'])) else None
+    else:
+        headers = reg['headers_lower'] if (key.lower() == key) else reg['headers']
+        match = [i for i, h in enumerate(headers) if h.find(key) != -1]
+        idx = match[0] if len(match) else None
+    if idx is None:
+        return None, None
 
-    # convert flux density to magnitudes in AB system
-    mag = -2.5*np.log10(flux_density)-48.60
+    lo, hi = reg['offsets'][idx], reg['offsets'][idx+1]
+    _filter_lru.pop(lkey, None)
+    _filter_lru[lkey] = (_filter_files[(filename,fmt)][0], reg['lam'][lo:hi], reg['res'][lo:hi])
+    if len(_filter_lru) > _filter_lru_size:
+        _filter_lru.popitem(last=False)
 
-    #print 'maggies: {0}'.format(10**(-0.4*mag)*1e10)
-    return mag, luminosity
+    return reg['lam'][lo:hi].copy(), reg['res'][lo:hi].copy()
 
 def load_filter_response(filter, alt_file=None):
     '''READS FILTER RESPONSE CURVES FOR FSPS'''
@@ -876,35 +1273,9 @@ def load_filter_response(filter, alt_file=None):
     else:
         filter_response_curve = alt_file
 
-    # initialize output arrays
-    lam,res = (np.zeros(0) for i in range(2))
-
-    # upper case?
-    if filter.lower() == filter:
-        lower_case = True
-    else:
-        lower_case = False
+    lam, res = filter_registry(filter_response_curve, filter, fmt='fsps')
 
-    # open file
-    with open(filter_response_curve, 'r') as f:
-        # Skips text until we find the correct filter
-        for line in f:
-            if lower_case:
-                if line.lower().find(filter) != -1:
-                    break
-            else:
-                if line.find(filter) != -1:
-                    break
-        # Reads text until we hit the next filter
-        for line in f:  # This keeps reading the file
-            if line.find('#') != -1:
-                break
-            # read line, extract data
-            data = line.split()
-            lam = np.append(lam,float(data[0]))
-            res = np.append(res,float(data[1]))
-
-    if len(lam) == 0:
+    if (lam is None) or (len(lam) == 0):
         print "Couldn't find filter " + filter + ': STOPPING'
         print 1/0
 
@@ -919,6 +1290,20 @@ def return_full_sfh(t, sfh_params,**kwargs):
 
     deltat=1e-8 # Gyr
 
+    # nonparametric SFHs have a closed form
+    if (sfh_params['sfh'] == 0) | (sfh_params['sfh'] == 3):
+        tage = np.max(10**sfh_params['agebins'])/1e9
+        tcalc = t[t < tage]
+        mformed = sfh_params['mformed'].sum()
+        minsfr = kwargs.get('minsfr', None)
+        if minsfr is None:
+            minsfr = mformed / (tage*1e9*10000)
+        sfr = np.zeros(len(t))
+        sfr[:len(tcalc)] = batch_return_full_sfh(tcalc, sfh_params['mass_fraction']*mformed,
+                                                 sfh_params['agebins'], deltat=deltat,
+                                                 minsfr=minsfr, maxsfr=kwargs.get('maxsfr', None))[0]
+        return sfr
+
     # calculate new time vector such that
     # the spacing from tage back to zero
     # is identical for each SFH model
@@ -971,14 +1356,132 @@ def calculate_sfr(sfh_params, timescale, tcalc = None,
 
     return sfr
 
+def nonpar_bin_overlap(t1, t2, agebins):
+    """ time overlap [Gyr] between lookback-time windows [t1,t2] (in Gyr)
+    and each nonparametric SFH bin. t1 and t2 broadcast against each other;
+    output has an extra trailing axis of length nbin.
+    """
+    edges = 10**np.atleast_2d(agebins)/1e9
+    t1 = np.asarray(t1, dtype=float)[...,None]
+    t2 = np.asarray(t2, dtype=float)[...,None]
+    return np.clip(np.minimum(t2, edges[:,1]) - np.maximum(t1, edges[:,0]), 0.0, np.inf)
+
+def batch_sfr_windows(mass, agebins, t1, t2):
+    """ vectorized average SFR of nonparametric SFHs in arbitrary lookback-time windows.
+
+    MASS: (ndraw, nbin) mass formed in each bin
+    T1, T2: (nwin,) start and end of each window, LOOKBACK time in Gyr (t1 < t2)
+
+    returns (ndraw, nwin) in [Msun/yr]
+    """
+    t1, t2 = np.broadcast_arrays(np.atleast_1d(t1).astype(float), np.atleast_1d(t2).astype(float))
+    dt = np.diff(10**np.atleast_2d(agebins)/1e9, axis=1).squeeze(axis=1)
+    weights = nonpar_bin_overlap(t1, t2, agebins) / dt # (nwin, nbin)
+    return np.dot(np.atleast_2d(mass), weights.T) / ((t2-t1)*1e9)
+
+def batch_integrate_sfh(t1, t2, mass, agebins):
+    """ vectorized integrate_sfh for nonparametric SFHs: fraction of the total mass
+    formed between t1 and t2, which are FORWARD times in Gyr from the start of the oldest
+    bin, as in integrate_sfh. times outside of the SFH are clipped to it.
+
+    returns (ndraw,) for scalar t1, t2, else (ndraw, nt)
+    """
+    tmax = np.max(10**np.atleast_2d(agebins)/1e9)
+    scalar = (np.ndim(t1) == 0) & (np.ndim(t2) == 0)
+    t1, t2 = np.broadcast_arrays(np.atleast_1d(t1).astype(float), np.atleast_1d(t2).astype(float))
+
+    mass = np.atleast_2d(mass)
+    dt = np.diff(10**np.atleast_2d(agebins)/1e9, axis=1).squeeze(axis=1)
+    weights = nonpar_bin_overlap(tmax-t2, tmax-t1, agebins) / dt
+    out = np.dot(mass / mass.sum(axis=1)[:,None], weights.T)
+
+    return out[:,0] if scalar else out
+
+def batch_calculate_sfr(mass, agebins, timescale, tcalc=0.0):
+    """ vectorized SFR for nonparametric SFHs, matching calculate_sfr with
+    minsfr=-np.inf and maxsfr=np.inf.
+
+    MASS: (ndraw, nbin) mass formed in each bin
+    TIMESCALE: averaging timescale in Gyr
+    TCALC: LOOKBACK time in Gyr at which the window ends (0 = time of observation)
+
+    returns (ndraw,) in [Msun/yr]
+    """
+    return batch_sfr_windows(mass, agebins, tcalc, tcalc+timescale)[:,0]
+
+def batch_return_full_sfh(t, mass, agebins, deltat=1e-8, minsfr=None, maxsfr=None):
+    """ vectorized version of return_full_sfh for nonparametric SFHs.
+    T is a vector of lookback times in Gyr; returns (ndraw, nt) in [Msun/yr]
+    as in return_full_sfh, the SFR is zero before the SFH starts and is clipped to [minsfr, maxsfr]
+    after that. by default minsfr is 0.01% of each draw's average SFR over the age of the galaxy.
+    """
+    t = np.atleast_1d(t)
+    mass = np.atleast_2d(mass)
+    tage = np.max(10**np.atleast_2d(agebins))/1e9
+    if minsfr is None:
+        minsfr = mass.sum(axis=1)[:,None] / (tage*1e9*10000)
+    if maxsfr is None:
+        maxsfr = np.inf
+    sfr = np.clip(batch_sfr_windows(mass, agebins, t, t+deltat), minsfr, maxsfr)
+    return np.where(t < tage, sfr, 0.0)
+
+def batch_mass_assembly_time(mass, agebins, frac=0.5):
+    """ vectorized, closed-form version of halfmass_assembly_time for nonparametric SFHs.
+    the cumulative mass is piecewise-linear in time, so we can invert it exactly
+    instead of root-finding. assumes contiguous agebins.
+
+    FRAC can be a scalar or a vector (e.g. [0.1,0.5,0.9] for t_10, t_50, t_90).
+    returns the LOOKBACK time [Gyr] at which FRAC of the total mass had formed,
+    shape (ndraw,) for scalar FRAC, else (ndraw, nfrac)
+    """
+    mass = np.atleast_2d(mass)
+    scalar = np.ndim(frac) == 0
+    frac = np.atleast_1d(frac).astype(float)[None,:]
+    edges = 10**np.atleast_2d(agebins)/1e9
+    order = np.argsort(edges[:,1])[::-1] # oldest bin first
+    lo, hi = edges[order,0], edges[order,1]
+
+    # cumulative mass fraction at the (young) edge of each bin
+    mfrac = mass[:,order] / mass.sum(axis=1)[:,None]
+    cumfrac = np.cumsum(mfrac, axis=1)
+
+    # first bin in which the cumulative fraction crosses FRAC
+    idx = np.clip((cumfrac[:,None,:] < frac[:,:,None]).sum(axis=2), 0, mass.shape[1]-1) # (ndraw, nfrac)
+    draw = np.arange(mass.shape[0])[:,None]
+    before = cumfrac[draw,idx] - mfrac[draw,idx]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.clip((frac - before) / mfrac[draw,idx], 0.0, 1.0)
+    out = hi[idx] - x*(hi[idx]-lo[idx])
+
+    return out[:,0] if scalar else out
+
+def batch_sfh_quantities(t, mass, agebins, mfrac):
+    """ all SFH-derived quantities used in post-processing, calculated
+    at once for a set of nonparametric SFH posterior draws.
+
+    T: time vector for the full SFH (lookback time, Gyr)
+    MASS: (ndraw, nbin) mass formed in each bin
+    MFRAC: (ndraw,) surviving stellar mass fraction from the SPS
+
+    returns a dictionary of (ndraw,) arrays, plus the (ndraw, nt) SFH
+    """
+    mass = np.atleast_2d(mass)
+    out = {'stellar_mass': mass.sum(axis=1) * mfrac}
+    for tstr, timescale in zip(['30','100','300'],[0.03, 0.1, 0.3]):
+        out['sfr_'+tstr] = batch_calculate_sfr(mass, agebins, timescale)
+        out['ssfr_'+tstr] = out['sfr_'+tstr] / out['stellar_mass']
+    out['half_time'] = batch_mass_assembly_time(mass, agebins, frac=0.5)
+    out['sfh'] = batch_return_full_sfh(t, mass, agebins)
+
+    return out
+
 def transform_zfraction_to_sfrfraction(zfraction):
     '''vectorized and without I/O keywords
     '''
     if zfraction.ndim == 1:
         zfraction = np.atleast_2d(zfraction).transpose()
-    sfr_fraction = np.zeros_like(zfraction)
-    sfr_fraction[:,0] = 1-zfraction[:,0]
-    for i in xrange(1,sfr_fraction.shape[1]): sfr_fraction[:,i] = np.prod(zfraction[:,:i],axis=1)*(1-zfraction[:,i])
+    zprod = np.concatenate((np.ones((zfraction.shape[0],1)), np.cumprod(zfraction[:,:-1],axis=1)),axis=1)
+    sfr_fraction = zprod*(1-zfraction)
     #sfr_fraction[:,-1] = np.prod(zfraction,axis=1)  #### THIS IS SET IMPLICITLY
     return sfr_fraction
 
@@ -1095,55 +1598,7 @@ def integrate_sfh(t1,t2,sfh_params):
         if ('agebins' not in sfh_params):
             sys.exit('missing parameters!')
 
-        ### put bins in proper units
-        to_linear_bins = 10**sfh_params['agebins']/1e9
-        time_per_bin = to_linear_bins[:,1] - to_linear_bins[:,0]
-        time_bins = np.max(to_linear_bins) - to_linear_bins
-
-        ### if it's outside the SFH bins, clip it
-        t1 = np.clip(t1,np.min(time_bins),np.max(time_bins))
-        t2 = np.clip(t2,np.min(time_bins),np.max(time_bins))
-
-        # annoying edge cases
-        if t1 == t2:
-            return 0.0
-        if (t2 > time_bins[0,0]) & (t1 > time_bins[0,0]): 
-            sys.exit('SFR is undefined in this time region, outside youngest bin!')
-
-        ### which bins to integrate?
-        in_range = (time_bins >= t1) & (time_bins <= t2)
-        bin_ids = in_range.sum(axis=1)
-
-        ### this doesn't work if we're fully inside a single bin...
-        if in_range.sum() == 0:
-            bin_ids = (time_bins[:,1] <= t1) & (time_bins[:,0] >= t2)
-
-        ### weights
-        weights = np.zeros(sfh_params['mass_fraction'].shape)
-        # if we're all in one bin
-        if np.sum(bin_ids) == 1:
-            weights[bin_ids == 1] = t2-t1
-        # else do the whole thing
-        else:
-            for i in xrange(bin_ids.shape[0]):
-                if bin_ids[i] == 2: # bins that are entirely in t1,t2.
-                    weights[i] = time_per_bin[i]
-                if bin_ids[i] == 1: # edge cases
-                    if t2 < time_bins[i,0]: # this is the most recent edge
-                        weights[i] = t2 - time_bins[i,1]
-                    else: # this is the oldest edge
-                        weights[i] = time_bins[i,0]-t1
-                if bin_ids[i] == 0: # no contribution
-                    continue
-
-        ### bug catch
-        try:
-            np.testing.assert_approx_equal(np.sum(weights),t2-t1,significant=5)
-        except AssertionError:
-            print 1/0
-            sys.exit('weights do not sum to 1')
-
-        tot_mformed = np.sum((weights/time_per_bin)*sfh_params['mass_fraction'])
+        tot_mformed = batch_integrate_sfh(t1, t2, sfh_params['mass_fraction'], sfh_params['agebins'])[0]
 
     return tot_mformed
 
@@ -1158,11 +1613,13 @@ def measure_lbol(sps,mass):
     # two options due to very different meanings of ssp.log_lbol when using
     # tabular or "regular" SSPs
     # THIRD OPTION: access csp
+    # (sps.log_lbol is also right when the spectrum was composed from cached bin spectra)
     try:
-        if np.isscalar(sps.ssp.log_lbol):
-            weighted_lbol = 10**sps.ssp.log_lbol
+        log_lbol = sps.log_lbol if hasattr(sps, 'log_lbol') else sps.ssp.log_lbol
+        if np.isscalar(log_lbol):
+            weighted_lbol = 10**log_lbol
         else:
-            ssp_lbol = np.insert(10**sps.ssp.log_lbol, 0, 10**sps.ssp.log_lbol[0])
+            ssp_lbol = np.insert(10**log_lbol, 0, 10**log_lbol[0])
             weights = sps.all_ssp_weights
             weighted_lbol = (ssp_lbol * weights).sum() / weights.sum() * mass
     except AttributeError:
@@ -1180,11 +1637,12 @@ def measure_agn_luminosity(fagn,sps,mass):
     ## get SPS lbol, weighted by SSP weights
     # two options due to very different meanings of ssp.log_lbol when using
     # tabular or "regular" SSPs
-    if np.isscalar(sps.ssp.log_lbol):
-        weighted_lbol = 10**sps.ssp.log_lbol
+    log_lbol = sps.log_lbol if hasattr(sps, 'log_lbol') else sps.ssp.log_lbol
+    if np.isscalar(log_lbol):
+        weighted_lbol = 10**log_lbol
         lagn = weighted_lbol*float(fagn)*constants.L_sun.cgs.value
     else:
-        ssp_lbol = np.insert(10**sps.ssp.log_lbol, 0, 10**sps.ssp.log_lbol[0])
+        ssp_lbol = np.insert(10**log_lbol, 0, 10**log_lbol[0])
         weights = sps.all_ssp_weights
         weighted_lbol = (ssp_lbol * weights).sum() / weights.sum()
 
@@ -1263,7 +1721,7 @@ def measure_restframe_properties(sps, model = None, thetas = None, emlines = Fal
 
     ##### do we need a smooth spectrum?
     if (abslines):
-        smooth_spec = smooth_spectrum(w,spec_flam,250.0,minlam=3e3,maxlam=7e3)
+        smooth_spec = smooth_spectrum(w,spec_flam,250.0,minlam=3e3,maxlam=7e3,fast=True)
         out['abslines'] = measure_abslines(w,smooth_spec) # comes out in Lsun and rest-frame EQW
 
     ##### measure emission lines
@@ -1,6 +1,6 @@
 import pickle
 import numpy as np
-import os, glob
+import os, time
 from prospect.io import read_results
 
 #### where do alldata pickle files go?
@@ -44,13 +44,95 @@ def return_agn_str(idx, string=False):
     else:
         return sfing, composite, agn
 
+def user_cache_filename(path, suffix):
+    """filename for data cached from path in the user cache directory ($PROSP_CACHE_DIR, or
+    $XDG_CACHE_HOME/prospector_dutils, or ~/.cache/prospector_dutils), since path may be
+    in a read-only or shared directory. returns None if the cache directory can't be made.
+    """
+    import hashlib
+
+    cachedir = os.environ.get('PROSP_CACHE_DIR',
+               os.path.join(os.environ.get('XDG_CACHE_HOME',os.path.expanduser('~/.cache')),'prospector_dutils'))
+    try:
+        os.makedirs(cachedir)
+    except OSError:
+        if not os.path.isdir(cachedir):
+            return None
+    path = os.path.abspath(path)
+    return os.path.join(cachedir, os.path.basename(path)+'.'+hashlib.md5(path).hexdigest()[:12]+suffix)
+
+# in-process copy of the results folder indexes, {folder: index}
+_dir_index = {}
+
+def results_dir_index(folder):
+    """one-pass index of a results folder, cached in memory and on disk (in the user cache directory,
+    see user_cache_filename). the index is rebuilt whenever the modification time of the folder changes,
+    i.e. when files are added, removed, or renamed.
+    returns a dictionary with
+        'files': all filenames in the folder
+        'latest': {objname: {'h5': latest timestamped sampling file, 'post': latest timestamped post-processing file}}
+    """
+    folder = folder.rstrip('/')
+    mtime = os.stat(folder).st_mtime
+
+    # check memory, then disk.
+    # the folder mtime has finite resolution, so an index made within a couple of seconds
+    # of the last change to the folder may have missed files: it is never reused.
+    if (folder in _dir_index) and (_dir_index[folder]['mtime'] == mtime) and _dir_index[folder]['settled']:
+        return _dir_index[folder]
+    cachename = user_cache_filename(folder, '.prosp_index.pickle')
+    if cachename is not None:
+        try:
+            with open(cachename, "rb") as f:
+                index = pickle.load(f)
+            if index['mtime'] == mtime:
+                _dir_index[folder] = index
+                return index
+        except (IOError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+
+    # build index: for timestamped files objname_time_mcmc.h5 / objname_time_post,
+    # keep the most recent of each type
+    settled = (time.time() - mtime) > 2
+    files = [f for f in os.listdir(folder) if f != '.prosp_index.pickle']
+    latest, times = {}, {}
+    for f in files:
+        if (f[-2:] == 'h5') and ('_checkpoint' not in f):
+            ftype = 'h5'
+        elif f[-4:] == 'post':
+            ftype = 'post'
+        else:
+            continue
+        try:
+            ftime = float(f.split('_')[-2])
+        except (ValueError, IndexError):
+            continue
+        objname = "_".join(f.split('_')[:-2])
+        if ftime > times.get((objname,ftype),-np.inf):
+            times[(objname,ftype)] = ftime
+            latest.setdefault(objname,{})[ftype] = f
+    index = {'mtime': mtime, 'settled': settled, 'files': files, 'latest': latest}
+    _dir_index[folder] = index
+
+    # only save settled indexes to disk, renaming into place so that readers never see a partial file
+    if settled and (cachename is not None):
+        try:
+            tmpname = cachename+'.'+str(os.getpid())
+            with open(tmpname, "wb") as f:
+                pickle.dump(index, f)
+            os.rename(tmpname, cachename)
+        except (IOError, OSError):
+            pass
+
+    return index
+
 def find_all_prospector_results(runname):
     """ returns basenames for all h5 files in results folder "runname"
     """
 
     # find all h5 files 
     folder = os.getenv('APPS')+'/prospector_alpha/results/'+runname+'/'
-    files = glob.glob(folder+'*h5')
+    files = [folder+f for f in results_dir_index(folder)['files'] if (f[-2:] == 'h5') & (f[0] != '.') & ('_checkpoint' not in f)]
     objnames = [f.split('/')[0].split('_')[0] for f in files]
     basenames = ["_".join(f.split('_')[:-2]) for f in files]
     if (len("".join(objnames)) == 0): # if we don't find any 'old-style' Prospector outputs
@@ -58,11 +140,117 @@ def find_all_prospector_results(runname):
 
     return np.unique(basenames)
 
-def load_prospector_data(filebase,objname=None,runname=None,hdf5=True,postprocessing=False):
+class LazyResults(object):
+    """read-only, dictionary-like view of a Prospector HDF5 output file.
+    nothing is read until it is asked for, and the model is never reconstructed.
+    keys are the datasets in the 'sampling' group (chain, weights, lnprobability, ...),
+    plus 'theta_labels', 'run_params' and 'obs'.
+    use take() to read only the posterior draws at sample_idx.
+    close() it when done, or use it in a with statement.
+    """
+
+    def __init__(self, filename):
+        import h5py
+        self.filename = filename
+        self.hf = h5py.File(filename, 'r')
+        self._cache = {}
+
+    def _attr(self, key):
+        import json
+        for attrs in [self.hf['sampling'].attrs, self.hf.attrs]:
+            if key in attrs:
+                return json.loads(attrs[key])
+        raise KeyError(key)
+
+    def _obs(self):
+        """the arrays in the 'obs' group plus its (JSON) attributes. filters are
+        stored by name, so these are also returned as filternames.
+        """
+        import json
+        obs = {key: self.hf['obs'][key][:] for key in self.hf['obs'].keys()}
+        for key, val in self.hf['obs'].attrs.items():
+            try:
+                obs[key] = json.loads(val)
+            except (TypeError, ValueError):
+                continue
+        if ('filternames' not in obs) and ('filters' in obs):
+            obs['filternames'] = obs['filters']
+        return obs
+
+    def keys(self):
+        return list(self.hf['sampling'].keys()) + ['theta_labels','run_params','obs']
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            if key in self.hf['sampling']:
+                self._cache[key] = self.hf['sampling'][key][:]
+            elif key == 'obs':
+                self._cache[key] = self._obs()
+            else:
+                self._cache[key] = self._attr(key)
+        return self._cache[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def take(self, key, sample_idx):
+        """rows sample_idx of dataset key, in the order of sample_idx
+        """
+        if key in self._cache:
+            return self._cache[key][sample_idx]
+        uniq, inv = np.unique(sample_idx, return_inverse=True)
+        return self.hf['sampling'][key][uniq.tolist()][inv]
+
+    def close(self):
+        self.hf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class LazyExtra(object):
+    """dictionary-like view of a post-processing (hickle) file, which is only
+    loaded the first time one of its keys is accessed
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._data = None
+
+    def _load(self):
+        if self._data is None:
+            import hickle
+            with open(self.filename, "r") as f:
+                self._data = hickle.load(f)
+        return self._data
+
+    def keys(self):
+        return self._load().keys()
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def get(self, key, default=None):
+        return self._load().get(key, default)
+
+def load_prospector_data(filebase,objname=None,runname=None,hdf5=True,postprocessing=False,lazy=False):
     """loads Prospector results
     filebase: string describing the location + objname. automatically finds 
     no_sample_results: only load the Powell results and the model
     objname and runname: if both of these are supplied, don't need to supply filebase
+    lazy: return a LazyResults and LazyExtra instead, which read from disk only what is
+    accessed and do not reconstruct the model. the powell results and the model are None.
     returns sample results, powell results, model, extra output
     """
 
@@ -77,6 +265,17 @@ def load_prospector_data(filebase,objname=None,runname=None,hdf5=True,postproces
     if not hdf5:
         mcmc_filename = mcmc_filename[-3:]
 
+    if lazy:
+        extra_output = None
+        if (not postprocessing) and os.path.isfile(extra_name):
+            extra_output = LazyExtra(extra_name)
+        try:
+            sample_results = LazyResults(mcmc_filename)
+        except (IOError, KeyError):
+            print 'failed to load '+str(mcmc_filename)+' for object '+filebase.split('/')[-1]
+            sample_results = None
+        return sample_results, None, None, extra_output
+
     extra_output = None
     if not postprocessing:
         extra_output = load_prospector_extra(filebase,postprocessing=postprocessing)
@@ -122,19 +321,13 @@ def create_prosp_filename(filebase,postprocessing=False):
     filename = filebase.split("/")[-1]
 
     # if it's for postprocessing, find the latest h5 file
-    if postprocessing:
-        files = [f for f in os.listdir(folder) if ((filename == ("_".join(f.split('_')[:-2]))) & (f[-2:] == 'h5'))]
     # otherwise, find the latest h5 with postprocessing files
-    else:
-        files = [f for f in os.listdir(folder) if ((filename == ("_".join(f.split('_')[:-2]))) & (f[-4:] == 'post'))]
-
-    # take the oldest
     # if we found no files, skip this object
-    times = [f.split('_')[-2] for f in files]
-    if len(times) == 0:
+    latest = results_dir_index(folder)['latest'].get(filename,{})
+    fbase = latest.get('h5' if postprocessing else 'post', None)
+    if fbase is None:
         print 'Failed to find any files to extract times in ' + folder + ' of form ' + filename
         return None,None
-    fbase = files[np.array(times).astype(float).argmax()]
 
     # generate output
     mcmc_filename = "/".join(filebase.split('/')[:-1])+'/'+"_".join(fbase.split('_')[:-1])+'_mcmc.h5'
@@ -439,6 +632,132 @@ def gather_offset(offset_in):
 
     return offset
 
+xray_dir = '/Users/joel/code/python/prospector_alpha/data/brownseds_data/photometry/xray/'
+xray_tables = {
+               'CSC': ('csc_table.dat', ['S40','S40','S40','S40','f16','f16','f16','f16','f16','f16','f16','f16','f16','S40','f16','f16','f16','f16','S40']),
+               'CXO': ('cxoxassist_table.dat', ['S40','S40','S40','S40','S40','f16','f16','f16','f16','S40','f16','f16','S40']),
+               'CHNG': ('chngpscliu_table.dat', ['S40','S40','S40','S40','S40','f16','f16','f16','f16','f16','S40','S40']),
+               'MASTER': ('xray_mastercat.dat', ['S40','S40','S40','S40','f16','f16','f16','S40','S40','S40','S40','S40','S40','S40'])
+              }
+_xray_trees = {}
+
+def read_heasarc_table(location, formats):
+    '''
+    read a HEASARC query table, with string columns stripped of whitespace,
+    plus the search offset (arcmin) and ra, dec in degrees
+    '''
+    from numpy.lib import recfunctions
+    import xmatch
+
+    #### extract headers
+    with open(location, 'r') as f:
+        for line in f:
+            if line[:5] != '|name':
+                continue
+            else:
+                hdr = line
+                hdr = hdr.replace(' ', '').split('|')[:-1]
+                break
+
+    #### load
+    dat = np.genfromtxt(location, comments = '#', delimiter='|',skip_header=5,
+                        dtype = {'names':([str(n) for n in hdr]),'formats':formats})
+    for name in dat.dtype.names:
+        if dat.dtype[name].kind == 'S':
+            dat[name] = np.core.defchararray.strip(dat[name])
+
+    return recfunctions.append_fields(dat, ['offset','ra_deg','dec_deg'],
+                                      data=[gather_offset(dat['_Search_Offset']),
+                                            xmatch.parse_coordinate(dat['ra'],hours=True),
+                                            xmatch.parse_coordinate(dat['dec'])],
+                                      usemask=False)
+
+def load_xray_table(name):
+    '''
+    one of the X-ray tables in xray_tables (CSC, CXO, CHNG, MASTER), parsed once
+    and cached in binary form
+    '''
+    import xmatch
+
+    filename, formats = xray_tables[name]
+    return xmatch.cached_table(xray_dir+filename, lambda loc: read_heasarc_table(loc, formats))
+
+def xray_tree(name, good):
+    '''
+    sky KD-tree of the entries of X-ray table `name` selected by the boolean array good.
+    rebuilt if the selection changes, or if the table is re-read because it was edited
+    '''
+    import xmatch
+
+    dat = load_xray_table(name)
+    if (name not in _xray_trees) or (_xray_trees[name][0] is not dat) or \
+       (not np.array_equal(_xray_trees[name][1], good)):
+        _xray_trees[name] = (dat, np.array(good), xmatch.SkyTree(dat['ra_deg'][good], dat['dec_deg'][good]))
+    return _xray_trees[name][2]
+
+def xray_match_brightest(name, good, fluxkey, ra, dec, maxradius):
+    '''
+    for each position, the index into X-ray table `name` of the brightest selected source
+    within maxradius (arcsec), or -1
+    '''
+    import xmatch
+
+    dat = load_xray_table(name)
+    idx_in, idx_cat, sep = xray_tree(name, good).query_radius(ra, dec, maxradius)
+    idx_cat = np.where(good)[0][idx_cat]
+
+    return xmatch.brightest_match(idx_in, idx_cat, dat[fluxkey], np.size(ra))
+
+def xray_xmatch(ra, dec, maxradius=60.):
+    '''
+    returns flux in (erg/cm^2/s), corrected to 0.5-8 keV, for any list of positions (degrees)
+    uses the brightest point source within maxradius (arcsec), from three large catalogs
+    PREFER CXO > CSC > CHNG
+    '''
+    import xmatch
+
+    ra, dec = np.atleast_1d(ra), np.atleast_1d(dec)
+    nin = ra.shape[0]
+
+    ### select nonzero flux, point sources
+    csc, cxo, chng = load_xray_table('CSC'), load_xray_table('CXO'), load_xray_table('CHNG')
+    best = [xray_match_brightest('CXO', (cxo['flux'] > 0.0) & (cxo['extent_flag'] == 'F'), 'flux', ra, dec, maxradius),
+            xray_match_brightest('CSC', (csc['fb_flux_ap'] > 0.0) & (csc['extent_flag'] == 'F'), 'fb_flux_ap', ra, dec, maxradius),
+            xray_match_brightest('CHNG', chng['flux'] > 0.0, 'flux', ra, dec, maxradius)]
+    which, index = xmatch.prioritized_match(best)
+
+    ### if no detections, give it a dummy number
+    flux, flux_err = np.full(nin, -99.), np.zeros(nin)
+    hardness, hardness_err = np.array([None]*nin), np.array([None]*nin)
+    database = np.array(['no match']*nin, dtype='S8')
+
+    idx = index[which == 0]
+    fac = correct_for_window('CXOXASSIST', targlow = 0.5, targhigh = 8)
+    flux[which == 0] = cxo['flux'][idx]*fac
+    flux_err[which == 0] = fac*cxo['flux'][idx] * (cxo['counts_error'][idx]/cxo['counts'][idx])
+    database[which == 0] = 'CXO'
+
+    idx = index[which == 1]
+    fac = correct_for_window('CSC', targlow = 0.5, targhigh = 8)
+    S = csc['sb_flux_ap'][idx] + csc['mb_flux_ap'][idx]
+    H = csc['hb_flux_ap'][idx]
+    hardness[which == 1] = list((H-S)/(H+S))
+    flux[which == 1] = csc['fb_flux_ap'][idx]*fac
+    flux_err[which == 1] = (csc['fb_flux_ap_upper'][idx]-csc['fb_flux_ap_lower'][idx])/2.*fac
+    database[which == 1] = 'CSC'
+
+    idx = index[which == 2]
+    fac = correct_for_window('CHNGPSCLIU', targlow = 0.5, targhigh = 8)
+    flux[which == 2] = chng['flux'][idx]*fac
+    database[which == 2] = 'CHNG'
+
+    out = {'flux':flux,
+           'flux_err':flux_err,
+           'hardness':hardness,
+           'hardness_err':hardness_err,
+           'database':database}
+    return out
+
 def load_xray_cat(xmatch = True,maxradius=30):
 
     '''
@@ -447,90 +766,18 @@ def load_xray_cat(xmatch = True,maxradius=30):
     '''
 
     ### get brown coordinates
-    ra, dec, objname = load_coordinates(dec_in_string=True)
-    bcoords = []
-    for r, d in zip(ra,dec): bcoords.append(str(r)+', '+d)
-
-    ### load up each catalog
-    csc = load_csc(bcoords,objname)
-    cxo = load_cxo(bcoords,objname)
-    chng = load_chng(bcoords,objname)
+    ra, dec, objname = load_coordinates()
 
-    #### match based on query string
+    #### match on position
     if xmatch == True:
-        
-        #### load Brown positional data
-        #### mock up as query parameters
-
-        ### take brightest X-ray detection per object
-        flux, flux_err, hardness, hardness_err, database = [], [], [], [], []
-        for i, name in enumerate(objname):
-
-            ### find matches in the query with nonzero flux entries within MAXIMUM radius in arcseconds (max is 1')
-            idx_csc = (csc['match'] == name) & \
-                      (csc['fb_flux_ap'] > 0.0) & \
-                      (csc['offset'] < maxradius/30.) & \
-                      (np.core.defchararray.strip(csc['extent_flag']) == 'F')
-            
-            idx_cxo = (cxo['match'] == name) & \
-                      (cxo['flux'] > 0.0) & \
-                      (cxo['offset'] < maxradius/30.) & \
-                      (np.core.defchararray.strip(cxo['extent_flag']) == 'F')
-
-            idx_chng = (chng['match'] == name) & \
-                       (chng['flux'] > 0.0) & \
-                       (chng['offset'] < maxradius/30.)
-
-            ### PREFER CXO > CSC > CHNG
-            if idx_cxo.sum() > 0:
-                ### take brightest
-                idx = cxo['flux'][idx_cxo].argmax()
-                fac = correct_for_window('CXOXASSIST', targlow = 0.5, targhigh = 8)
-                #hardness.append(cxo['hardness_ratio'][idx_cxo][idx])
-                #hardness_err.append(cxo['hardness_ratio_error'][idx_cxo][idx])
-                hardness.append(None)
-                hardness_err.append(None)
-
-                flux.append(cxo['flux'][idx_cxo][idx]*fac)
-                flux_err.append(fac*cxo['flux'][idx_cxo][idx] * (cxo['counts_error'][idx_cxo][idx]/cxo['counts'][idx_cxo][idx]))
-                database.append('CXO')
-            elif idx_csc.sum() > 0:
-                ### take brightest
-                idx = csc['fb_flux_ap'][idx_csc].argmax()
-                fac = correct_for_window('CSC', targlow = 0.5, targhigh = 8)
-                S = csc['sb_flux_ap'][idx_csc][idx] + csc['mb_flux_ap'][idx_csc][idx]
-                H = csc['hb_flux_ap'][idx_csc][idx]
-                hardness.append((H-S)/(H+S))
-                hardness_err.append(None)               
-                flux.append(csc['fb_flux_ap'][idx_csc][idx]*fac)
-                flux_err.append((csc['fb_flux_ap_upper'][idx_csc][idx]-csc['fb_flux_ap_lower'][idx_csc][idx])/2.*fac)
-                database.append('CSC')
-            elif idx_chng.sum() > 0:
-                idx = chng['flux'][idx_chng].argmax()
-                fac = correct_for_window('CHNGPSCLIU', targlow = 0.5, targhigh = 8)
-                hardness.append(None)
-                hardness_err.append(None)
-                flux.append(chng['flux'][idx_chng][idx]*fac)
-                flux_err.append(0.0)
-                database.append('CHNG')
-            ### if no detections, give it a dummy number
-            else:
-                flux.append(-99)
-                flux_err.append(0.0)
-                hardness.append(None)
-                hardness_err.append(None)               
-                database.append('no match')
-                continue 
 
-        out = {'objname':objname,
-               'flux':np.array(flux),
-               'flux_err':np.array(flux_err),
-               'hardness':np.array(hardness),
-               'hardness_err':np.array(hardness_err),
-               'database':np.array(database)}
+        ### take brightest X-ray detection per object, within MAXIMUM radius
+        ### the search offsets were cut at maxradius/30 arcminutes, i.e. 2*maxradius arcseconds (max is 1')
+        out = xray_xmatch(ra, dec, maxradius=2*maxradius)
+        out['objname'] = objname
         return out
     else:
-        return dat
+        return {name: load_xray_table(name) for name in ['CSC','CXO','CHNG']}
 
 def load_xray_mastercat(xmatch = True,maxradius=30):
 
@@ -544,102 +791,44 @@ def load_xray_mastercat(xmatch = True,maxradius=30):
         if we could translate COUNT_RATE into FLUX for ARBITRARY TELESCOPE AND DATA TABLE then we could include many more sources
     '''
 
-    location = '/Users/joel/code/python/prospector_alpha/data/brownseds_data/photometry/xray/xray_mastercat.dat'
-
-    #### extract headers
-    with open(location, 'r') as f:
-        for line in f:
-            if line[:5] != '|name':
-                continue
-            else:
-                hdr = line
-                hdr = hdr.replace(' ', '').split('|')[:-1]
-                break
-
-    #### load
     # names = ('', 'name', 'ra', 'dec', 'count_rate', 'count_rate_error', 'flux', 'database_table', 'observatory','error_radius', 'exposure', 'class', '_Search_Offset')
-    dat = np.loadtxt(location, comments = '#', delimiter='|',skiprows=5,
-                     dtype = {'names':([str(n) for n in hdr]),\
-                              'formats':(['S40','S40','S40','S40','f16','f16','f16','S40','S40','S40','S40','S40','S40','S40'])})
+    dat = load_xray_table('MASTER')
 
-    ### remove whitespace from strings
-    for i in xrange(dat.shape[0]):
-        dat['database_table'][i] = str(np.core.defchararray.strip(dat['database_table'][i]))
-        dat['observatory'][i] = str(np.core.defchararray.strip(dat['observatory'][i]))
-
-    #### match based on query string
+    #### match on position
     if xmatch == True:
         
         #### load Brown positional data
-        #### mock up as query parameters
-        ra, dec, objname = load_coordinates(dec_in_string=True)
-        bcoords = []
-        for r, d in zip(ra,dec):
-            bcoords.append(str(r)+', '+d)
-        match, offset = [], []
-        for query in dat['_Search_Offset']:
-            match_str = (query.split('('))[1].split(')')[0]
-            match.append(objname[bcoords.index(match_str)]) 
-
-            n = 0
-            offset_float = None
-            while offset_float == None:
-                try: 
-                    offset_float = float(query.split(' ')[n])
-                except ValueError:
-                    n+=1
-            offset.append(offset_float)
-
-        offset = np.array(offset)
-
-        ### take brightest X-ray detection per object
-        flux, flux_err, observatory, database = [], [], [], []
-        count = 0
-        for i, name in enumerate(objname):
-
-            ### find matches in the query with nonzero flux entries within MAXIMUM radius in arcseconds (max is 1')
-            # forbidden datatables either use bandpasses above 10 keV or flux definition is unclear
-            # SFGALHMXB is removed because it's a high-mass x-ray binary catalog!
-            idx = (np.array(match) == name) & (dat['flux'] != 0.0) & (offset < maxradius/60.) & \
-                  (dat['database_table'] != 'INTAGNCAT') & (dat['database_table'] != 'INTIBISAGN') & \
-                  (dat['database_table'] != 'BMWHRICAT') & (dat['database_table'] != 'IBISCAT4') & \
-                  (dat['database_table'] != 'INTIBISASS') & (dat['database_table'] != 'ULXRBCAT') & \
-                  (dat['database_table'] != 'SFGALHMXB')
-            ### if no detections, give it a dummy number
-            if idx.sum() == 0: #or 'CHANDRA' not in dat['observatory'][idx]:
-                print dat['observatory'][idx]
-                flux.append(-99)
-                flux_err.append(0.0)
-                observatory.append('no match')
-                database.append('no match')
-                continue 
-
-            ### choose the detection to keep
-            # prefer chandra
-            # of chandra, take the observation closest to centere
-            ch_idx = np.core.defchararray.strip(dat['observatory'][idx]) == 'CHANDRA'
-            if ch_idx.sum() > 0:
-                idx_keep = np.where((offset[idx] == offset[idx][ch_idx].min()) & \
-                                    (np.core.defchararray.strip(dat['observatory'][idx]) == 'CHANDRA'))[0][0]
-            else:
-                idx_keep = dat['flux'][idx].argmax()
-            idx_keep = dat['flux'][idx].argmax()
-
-            ### fill out data
-            cfactor = correct_for_window(dat['database_table'][idx][idx_keep])
-            flux.append(dat['flux'][idx][idx_keep]*cfactor)
-            fractional_count_err = dat['count_rate_error'][idx][idx_keep]/dat['count_rate'][idx][idx_keep]
-            if np.isnan(fractional_count_err):
-                fractional_count_err = 0.0
-            flux_err.append(flux[-1] * fractional_count_err)
-            observatory.append(dat['observatory'][idx][idx_keep])
-            database.append(dat['database_table'][idx][idx_keep])
-        print count
+        ra, dec, objname = load_coordinates()
+
+        ### take brightest X-ray detection per object within MAXIMUM radius in arcseconds (max is 1')
+        # forbidden datatables either use bandpasses above 10 keV or flux definition is unclear
+        # SFGALHMXB is removed because it's a high-mass x-ray binary catalog!
+        forbidden = ['INTAGNCAT','INTIBISAGN','BMWHRICAT','IBISCAT4','INTIBISASS','ULXRBCAT','SFGALHMXB']
+        good = (dat['flux'] != 0.0) & ~np.in1d(dat['database_table'], forbidden)
+        best = xray_match_brightest('MASTER', good, 'flux', ra, dec, maxradius)
+
+        ### if no detections, give it a dummy number
+        matched = best >= 0
+        flux, flux_err = np.full(ra.shape[0], -99.), np.zeros(ra.shape[0])
+        observatory = np.array(['no match']*ra.shape[0], dtype='S40')
+        database = np.array(['no match']*ra.shape[0], dtype='S40')
+
+        ### fill out data
+        idx_keep = best[matched]
+        cfactor = np.array([correct_for_window(table) for table in dat['database_table'][idx_keep]])
+        flux[matched] = dat['flux'][idx_keep]*cfactor
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fractional_count_err = dat['count_rate_error'][idx_keep]/dat['count_rate'][idx_keep]
+        fractional_count_err[np.isnan(fractional_count_err)] = 0.0
+        flux_err[matched] = flux[matched] * fractional_count_err
+        observatory[matched] = dat['observatory'][idx_keep]
+        database[matched] = dat['database_table'][idx_keep]
+
         out = {'objname':objname,
-               'flux':np.array(flux),
-               'flux_err':np.array(flux_err),
-               'observatory':np.array(observatory),
-               'database':np.array(database)}
+               'flux':flux,
+               'flux_err':flux_err,
+               'observatory':observatory,
+               'database':database}
         return out
     else:
         return dat
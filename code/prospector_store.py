@@ -0,0 +1,258 @@
+"""
+consolidated, column-oriented HDF5 store for all post-processed objects in a run.
+each quantity is a separate (chunked, resizable) dataset with one row per object, so
+aggregation scripts can read just the columns they need instead of re-opening thousands
+of _mcmc.h5 + _post files.
+
+layout:
+    objname, zred, post_mtime                           (nobj,)
+    thetas/<par>/q50,q84,q16, extras/<par>/q50,q84,q16   (nobj,)
+    chains/thetas/<par>, chains/extras/<par>            (nobj, ncalc)
+    weights, sample_idx                                 (nobj, ncalc)
+    obs/mips_mags                                       (nobj, ncalc)
+    obs/mips_sn                                         (nobj,)
+    sfh/t, sfh/q50,q84,q16                              (nobj, nt)
+    sfh/sfh                                             (nobj, ncalc, nt), only with full_sfh
+
+rows with a shorter ncalc or nt than the widest object are padded with NaN (-1 for sample_idx),
+and quantities missing for an object are NaN. obs/mips_mags is the model MIPS 24um flux (maggies)
+for each draw, and obs/mips_sn the observed MIPS S/N (0 if it is unobserved or masked).
+
+ingest new (or re-post-processed) objects with:
+    python prospector_store.py td_delta
+(add --force to re-ingest every object, e.g. after new columns are added here, and
+--full_sfh to also store the SFH of every draw, which the SFH stacks need but which
+makes the store ~ncalc times larger)
+"""
+import numpy as np
+import os, argparse
+import prosp_dutils
+from prospector_io import load_prospector_data, create_prosp_filename
+
+qtiles = ['q50','q84','q16']
+
+def store_filename(runname):
+    return os.getenv('APPS')+'/prospector_alpha/results/'+runname+'_store.h5'
+
+def store_row(res, eout, full_sfh=False):
+    """flatten the sampling results + post-processing output for one object
+    into {dataset path: value}. the SFH is stored as weighted quantiles at each time,
+    plus the SFH of every draw if full_sfh.
+    """
+    row = {
+           'zred': eout['zred'],
+           'weights': eout['weights'],
+           'sample_idx': eout['sample_idx'],
+           'sfh/t': eout['sfh']['t']
+          }
+    sfh_q = prosp_dutils.weighted_quantile_columns(eout['sfh']['sfh'], np.array([0.5, 0.84, 0.16]), eout['weights'])
+    for q, val in zip(qtiles, sfh_q): row['sfh/'+q] = val
+    if full_sfh:
+        row['sfh/sfh'] = eout['sfh']['sfh']
+    for key in ['thetas','extras']:
+        for par in eout[key].keys():
+            for q in qtiles: row[key+'/'+par+'/'+q] = eout[key][par][q]
+    if hasattr(res,'take'):
+        chain = res.take('chain', eout['sample_idx'])
+    else:
+        chain = res['chain'][eout['sample_idx']]
+    for i, par in enumerate(res['theta_labels']):
+        row['chains/thetas/'+par] = chain[:,i]
+    for par in eout['extras'].keys():
+        row['chains/extras/'+par] = eout['extras'][par]['chain']
+
+    # MIPS 24um
+    obs = res['obs']
+    filternames = obs.get('filternames')
+    if filternames is None:
+        filternames = [f.name for f in obs['filters']]
+    midx = np.array(['mips' in f for f in filternames],dtype=bool)
+    row['obs/mips_sn'] = 0.
+    if midx.sum() > 0:
+        row['obs/mips_mags'] = eout['obs']['mags'][:,midx][:,0]
+        if obs.get('phot_mask',np.ones(midx.size,dtype=bool))[midx][0]:
+            row['obs/mips_sn'] = obs['maggies'][midx][0] / obs['maggies_unc'][midx][0]
+
+    return row
+
+def row_quantiles(store, irow):
+    """the quantiles for row irow of a loaded store, in the post-processing layout,
+    i.e. {'thetas': {par: {'q50':...}}, 'extras': {...}}. quantities which are missing
+    for this object are left out.
+    """
+    out = {'thetas': {}, 'extras': {}}
+    for key in store.keys():
+        path = key.split('/')
+        if (path[0] not in out) or (len(path) != 3):
+            continue
+        val = store[key][irow]
+        if np.isfinite(val):
+            out[path[0]].setdefault(path[1],{})[path[2]] = val
+
+    return out
+
+def _fillvalue(dtype):
+    if np.issubdtype(dtype, np.integer):
+        return -1
+    return np.nan
+
+def _write_row(f, key, value, irow, nrow):
+    """write value into row irow of dataset key, creating or growing the dataset as necessary
+    """
+    value = np.asarray(value)
+    if value.dtype.kind == 'f':
+        value = value.astype(np.float64)
+    fill = _fillvalue(value.dtype)
+
+    if key not in f:
+        chunkrows = int(np.clip(2**16 // max(value.size,1), 1, 1024))
+        f.create_dataset(key, shape=(nrow,)+value.shape, maxshape=(None,)*(value.ndim+1),
+                         dtype=value.dtype, chunks=(chunkrows,)+value.shape, fillvalue=fill)
+    dset = f[key]
+
+    # grow to fit
+    shape = (max(dset.shape[0],nrow),) + tuple(np.maximum(dset.shape[1:],value.shape).astype(int))
+    if shape != dset.shape:
+        dset.resize(shape)
+
+    # pad to the full row width
+    if value.shape != dset.shape[1:]:
+        padded = np.full(dset.shape[1:], fill, dtype=dset.dtype)
+        padded[tuple(slice(0,n) for n in value.shape)] = value
+        value = padded
+    dset[irow] = value
+
+def _clear_row(f, key, irow):
+    """reset row irow of dataset key to its fill value (datasets shorter than
+    irow are padded with their fill value at the end of ingest_run)
+    """
+    dset = f[key]
+    if irow < dset.shape[0]:
+        dset[irow] = np.full(dset.shape[1:], dset.fillvalue, dtype=dset.dtype)
+
+def _all_datasets(f):
+    names = []
+    f.visit(lambda name: names.append(name) if hasattr(f[name],'shape') else None)
+    return names
+
+def ingest_run(runname, storename=None, nobj=None, force=False, full_sfh=False):
+    """add every post-processed object in runname which is not yet in the store,
+    or whose _post file has changed since it was ingested (or every object, if force).
+    columns which are no longer produced for a re-ingested object are cleared in its row, and
+    after a full forced re-ingest, columns which no object has any more are deleted.
+    an object's post_mtime is only updated once all of its columns are written, so
+    objects which fail part-way are retried on the next ingest.
+    full_sfh: also store the SFH of every draw (see store_row)
+    """
+    import h5py
+
+    if storename is None:
+        storename = store_filename(runname)
+    basenames, _, _ = prosp_dutils.generate_basenames(runname)
+    if nobj is not None:
+        basenames = basenames[:nobj]
+
+    with h5py.File(storename, 'a') as f:
+        if 'objname' not in f:
+            f.create_dataset('objname', shape=(0,), maxshape=(None,), dtype=h5py.special_dtype(vlen=str), chunks=(1024,))
+            f.create_dataset('post_mtime', shape=(0,), maxshape=(None,), dtype=float, chunks=(1024,))
+        rowidx = {name: i for i, name in enumerate(f['objname'][:])}
+        post_mtime = f['post_mtime'][:]
+        nrow = len(rowidx)
+
+        nadded, nupdated = 0, 0
+        written = set(['objname','post_mtime'])
+        for name in basenames:
+
+            # is it new or updated?
+            objname = name.split('/')[-1]
+            _, postname = create_prosp_filename(name)
+            if (postname is None) or (not os.path.isfile(postname)):
+                continue
+            mtime = os.path.getmtime(postname)
+            if (objname in rowidx) and (post_mtime[rowidx[objname]] >= mtime) and (not force):
+                continue
+
+            # load output from fit
+            try:
+                res, _, _, eout = load_prospector_data(name, lazy=True)
+            except:
+                print name.split('/')[-1]+' failed to load. skipping.'
+                continue
+            if res is None:
+                continue
+            with res:
+                if eout is None:
+                    continue
+                row = store_row(res, eout, full_sfh=full_sfh)
+
+            # new objects go at the end
+            if objname in rowidx:
+                irow = rowidx[objname]
+                for key in _all_datasets(f):
+                    if (key not in row) and (key not in ['objname','post_mtime']):
+                        _clear_row(f, key, irow)
+                nupdated += 1
+            else:
+                irow = nrow
+                nrow += 1
+                rowidx[objname] = irow
+                f['objname'].resize((nrow,))
+                f['post_mtime'].resize((nrow,))
+                f['objname'][irow] = objname
+                nadded += 1
+
+            for key in row.keys(): _write_row(f, key, row[key], irow, nrow)
+            written.update(row.keys())
+            f['post_mtime'][irow] = mtime
+
+        # after a full re-ingest, drop columns which no object has any more
+        if force and (nobj is None):
+            for key in _all_datasets(f):
+                if key not in written:
+                    del f[key]
+
+        # make sure all columns cover all rows
+        for key in _all_datasets(f):
+            if f[key].shape[0] < nrow:
+                f[key].resize((nrow,)+f[key].shape[1:])
+
+    print 'added {0} and updated {1} objects in {2}'.format(nadded,nupdated,storename)
+
+def load_run_store(runname=None, storename=None, columns=None, lazy=False):
+    """load columns from the run store.
+    columns: list of dataset paths, or group prefixes (e.g. 'extras/sfr_100' or 'chains/thetas').
+        defaults to all of the quantiles. objname is always returned.
+    lazy: if True, return h5py datasets instead of arrays, so that only the rows
+        which are sliced out are ever read from disk.
+    returns {dataset path: array}
+    """
+    import h5py
+
+    if storename is None:
+        storename = store_filename(runname)
+    if columns is None:
+        columns = ['thetas','extras','zred']
+
+    f = h5py.File(storename, 'r')
+    keys = [key for key in _all_datasets(f) if
+            np.any([(key == c) or key.startswith(c.rstrip('/')+'/') for c in columns])]
+    out = {'objname': f['objname'][:]}
+    for key in keys:
+        out[key] = f[key] if lazy else f[key][:]
+    if not lazy:
+        f.close()
+
+    return out
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('runname', type=str)
+    parser.add_argument('--storename', type=str, default=None)
+    parser.add_argument('--nobj', type=int, default=None)
+    parser.add_argument('--force', action='store_true')
+    parser.add_argument('--full_sfh', action='store_true')
+    args = parser.parse_args()
+
+    ingest_run(args.runname, storename=args.storename, nobj=args.nobj, force=args.force, full_sfh=args.full_sfh)
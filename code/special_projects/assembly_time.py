@@ -1,37 +1,9 @@
 import numpy as np
-from scipy.optimize import brentq
-from prosp_dutils import integrate_sfh, chop_chain, find_sfh_params
+from prosp_dutils import chop_chain, find_sfh_params, halfmass_assembly_time
 from prospector_io import load_prospector_data
 from prospect.models import model_setup
 import os, copy
 
-def sfh_half_time(x,sfh_params,c):
-
-    '''
-    wrapper for use with halfmass assembly time
-    '''
-    # check for nonparametric
-    sf_start = sfh_params['sf_start']
-    if sfh_params['sf_start'].shape[0] == 0:
-        sf_start = 0.0
-    return integrate_sfh(sf_start,x,sfh_params)-c
-
-def halfmass_assembly_time(sfh_params,c=0.5):
-
-    try:
-        half_time = brentq(sfh_half_time, 0, 14, args=(sfh_params,c), rtol=1.48e-08, maxiter=1000)
-    except ValueError:
-        # big problem
-        warnings.warn("You've passed SFH parameters that don't allow t_half to be calculated. Check for bugs.", UserWarning)
-        half_time = np.nan
-
-    # define age of galaxy
-    tgal = sfh_params['tage']
-    if tgal.shape[0] == 0:
-        tgal = np.max(10**sfh_params['agebins']/1e9)
-
-    return tgal-half_time
-
 def sample_posterior(param_name=None):
 
     # I/O
@@ -2,6 +2,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os, hickle, td_io, copy
 from prospector_io import load_prospector_data
+from prospector_store import load_run_store, row_quantiles
 from prosp_dutils import generate_basenames, asym_errors, get_cmap
 from matplotlib.ticker import MaxNLocator, FormatStrFormatter
 from dynesty.plotting import _quantile as weighted_quantile
@@ -81,9 +82,10 @@ def agn_table(stack, outtable):
     formats['z'] = str
     ascii.write(odat, outtable, format='aastex',overwrite=True, formats=formats)
 
-def collate_data(runname, runname_sample=None, filename=None, regenerate=False, **opts):
+def collate_data(runname, runname_sample=None, filename=None, regenerate=False, from_store=False, **opts):
     """ pull out all of the necessary information from the individual data files
     this takes awhile, so this data is saved to disk.
+    from_store: read from the run store (see prospector_store.py) instead of the individual files
     """
 
     '''
@@ -110,11 +112,16 @@ def collate_data(runname, runname_sample=None, filename=None, regenerate=False,
         runname_sample = runname
 
     # we want MASS, SFR_100, F_AGN, F_MIR CHAIN, for each galaxy
-    basenames, _, _ = generate_basenames(runname)
-    for i, name in enumerate(basenames):
+    if from_store:
+        store = load_run_store(runname, columns=['thetas/fagn','obs/mips_sn']+['extras/'+v for v in outvar if v != 'fagn'])
+        chains = load_run_store(runname, columns=['weights','chains/thetas/fagn','chains/extras/fmir'], lazy=True)
+        objnames = list(store['objname'])
+    else:
+        basenames, _, _ = generate_basenames(runname)
+        objnames = [name.split('/')[-1] for name in basenames]
+    for i, objname in enumerate(objnames):
 
         # load. do we keep it? check redshift
-        objname = name.split('/')[-1]
         datdir = os.getenv('APPS')+'/prospector_alpha/data/3dhst/'
         datname = datdir + objname.split('_')[0] + '_' + runname_sample + '.dat'
         dat = ascii.read(datname)
@@ -124,23 +131,39 @@ def collate_data(runname, runname_sample=None, filename=None, regenerate=False,
             print 'zred={0} for '.format(zred)+objname+', skipping'
             continue
 
-        # load output from fit
-        try:
-            res, _, _, prosp = load_prospector_data(name)
-        except:
-            print name.split('/')[-1]+' failed to load. skipping.'
-            continue
-        if (res is None) or (prosp is None):
-            continue
+        if from_store:
+            weights = chains['weights'][i]
+            good = np.isfinite(weights)
+            fagn_chain, fmir_chain = chains['chains/thetas/fagn'][i][good], chains['chains/extras/fmir'][i][good]
+            prosp = row_quantiles(store, i)
+            prosp['weights'] = weights[good]
+            mips_sn = store['obs/mips_sn'][i]
+        else:
+            # load output from fit
+            try:
+                res, _, _, prosp = load_prospector_data(basenames[i])
+            except:
+                print objname+' failed to load. skipping.'
+                continue
+            if (res is None) or (prosp is None):
+                continue
+            fidx = res['theta_labels'].index(u'fagn')
+            fagn_chain, fmir_chain = res['chain'][prosp['sample_idx'], fidx], prosp['extras']['fmir']['chain']
+
+            # mips
+            midx = np.array(['mips' in f.name for f in res['obs']['filters']],dtype=bool)
+            if (midx.sum() == 0) | (res['obs']['phot_mask'][midx] == False):
+                mips_sn = 0
+            else:
+                mips_sn = (res['obs']['maggies'][midx] / res['obs']['maggies_unc'][midx])[0]
 
         outdict['zred'] += [zred]
         outdict['objname'] += [objname]
         print 'loaded ' + objname
 
         # load up chains
-        fidx = res['theta_labels'].index(u'fagn')
-        outdict['fagn_chain'] += [res['chain'][prosp['sample_idx'], fidx]]
-        outdict['fmir_chain'] += [prosp['extras']['fmir']['chain']]
+        outdict['fagn_chain'] += [fagn_chain]
+        outdict['fmir_chain'] += [fmir_chain]
         outdict['weights'] += [prosp['weights'].tolist()]
 
         # extra variables
@@ -150,14 +173,10 @@ def collate_data(runname, runname_sample=None, filename=None, regenerate=False,
                     outdict[v][f] += [prosp['thetas'][v][f]]
                 else:
                     outdict[v][f] += [prosp['extras'][v][f]]
-        
-        # mips
-        midx = np.array(['mips' in f.name for f in res['obs']['filters']],dtype=bool)
-        if (midx.sum() == 0) | (res['obs']['phot_mask'][midx] == False):
+
+        if mips_sn == 0:
             print 'no MIPS data!'
-            outdict['mips_sn'] += [0]
-        else:
-            outdict['mips_sn'] += (res['obs']['maggies'][midx] / res['obs']['maggies_unc'][midx]).tolist()
+        outdict['mips_sn'] += [mips_sn]
 
     # dump files and return
     hickle.dump(outdict,open(filename, "w"))
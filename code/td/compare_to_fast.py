@@ -3,7 +3,7 @@ import matplotlib.pyplot as plt
 import os, hickle, pickle, td_io, prosp_dutils
 from matplotlib.ticker import FormatStrFormatter
 from prospector_io import load_prospector_data
-from astropy.cosmology import WMAP9
+from cosmo_tables import age_of_universe
 from dynesty.plotting import _quantile as weighted_quantile
 from fix_ir_sed import mips_to_lir
 import copy
@@ -201,6 +201,9 @@ def collate_data(runname, runname_fast, runname_sample='td_new', filename=None,
 
     nobj, int:
         only load X number of objects. useful for re-making catalog for testing purposes.
+
+    this reads the individual files, not the run store: it needs the full (unresampled) chain
+    for the KLD, the FAST-run results and model, and it post-processes objects on the fly.
     """
     
     ### if it's already made, load it and give it back
@@ -1194,7 +1197,7 @@ def prospector_versus_z(data,outname,popts):
         if par == 'avg_age':
             n = 50
             zred = np.linspace(zred.min(),zred.max(),n)
-            tuniv = WMAP9.age(zred).value
+            tuniv = age_of_universe(zred)
             axes[i].plot(zred,tuniv,'--',lw=2,zorder=-1, color=red)
             axes[i].text(zred[n/2]*1.1,tuniv[n/2]*1.1, r't$_{\mathrm{univ}}$',rotation=-50,color=red,weight='bold')
 
@@ -1557,7 +1560,7 @@ def mass_met_age_z(data,outfolder,outtable,popts):
 
             # max tuniv label
             if 'age' in opt['ytitle']:
-                tuniv = WMAP9.age(zbins[i]).value
+                tuniv = age_of_universe(zbins[i])
                 axes[i].text(9.02,tuniv*1.11,'t$_{\mathrm{univ}}$',ha='left', fontsize=7.5,color='red')
                 axes[i].axhline(tuniv,linestyle=':',color='red',lw=1,zorder=-1,alpha=0.9)
                 
@@ -2,7 +2,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os, hickle, td_io, prosp_dutils
 from prospector_io import load_prospector_extra
-from astropy.cosmology import WMAP9
+from cosmo_tables import luminosity_distance
 from astropy import units as u
 from scipy.interpolate import interp2d
 
@@ -85,7 +85,7 @@ def collate_data(runname, runname_sample, filename=None, regenerate=False, **opt
         zred = ancil[fidx]['z_best'][oidx][0]
         mass = np.log10(prosp['extras']['stellar_mass']['q50'])
         nii_correction = float(1-nii_ha_fnc(mass,zred))
-        lumdist = WMAP9.luminosity_distance(zred).value
+        lumdist = luminosity_distance(zred)
         dfactor = 4*np.pi*(u.Mpc.to(u.cm) * lumdist)**2
 
         # fill in and march on
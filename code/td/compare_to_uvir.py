@@ -2,6 +2,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os, hickle, td_io, prosp_dutils, copy
 from prospector_io import load_prospector_data, load_prospector_extra
+from prospector_store import load_run_store, row_quantiles
 from astropy.cosmology import WMAP9
 from prospect.models import sedmodel
 from matplotlib.ticker import MaxNLocator, FormatStrFormatter
@@ -26,11 +27,49 @@ medopts = {'marker':' ','alpha':0.95,'ms': 7,'mec':'k','zorder':5,'lw':2} # 'col
 popts = {'fmt':'o', 'capthick':.05,'elinewidth':.05,'alpha':0.1,'color':'k','ms':0.5}
 nbin_min = 10
 
-def collate_data(runname, filename=None, regenerate=False, nobj=None, **opts):
+heating_chains = ['lir_agn', 'luv_agn', 'lir', 'luv', 'lir_young', 'luv_young']
+
+def load_objects(runname, nobj=None, from_store=False):
+    """ yields (objname, prosp) for every post-processed object in runname, where prosp has
+    zred, weights, thetas and extras (quantiles, and chains for the extras used here), and
+    mips_mags, the model MIPS flux (maggies) for each draw
+    from_store: read from the run store (see prospector_store.py) instead of the individual files
+    """
+    if from_store:
+        store = load_run_store(runname, columns=['zred','thetas','extras'])
+        chains = load_run_store(runname, columns=['weights','obs/mips_mags']+['chains/extras/'+c for c in heating_chains], lazy=True)
+        for i, objname in enumerate(store['objname'][:nobj]):
+            weights = chains['weights'][i]
+            good = np.isfinite(weights)
+            prosp = row_quantiles(store, i)
+            prosp.update(zred=store['zred'][i], weights=weights[good], mips_mags=chains['obs/mips_mags'][i][good])
+            for c in heating_chains:
+                prosp['extras'].setdefault(c,{})['chain'] = chains['chains/extras/'+c][i][good]
+            yield objname, prosp
+        return
+
+    basenames, _, _ = prosp_dutils.generate_basenames(runname)
+    for name in basenames[:nobj]:
+
+        # load output from fit
+        try:
+            res, _, _, prosp = load_prospector_data(name)
+        except:
+            #print name.split('/')[-1]+' failed to load. skipping.'
+            continue
+        if (prosp == None) or (res == None):
+            continue
+
+        midx = np.array(['mips' in u for u in res['obs']['filternames']],dtype=bool)
+        prosp['mips_mags'] = prosp['obs']['mags'][:,midx].squeeze()
+        yield name.split('/')[-1], prosp
+
+def collate_data(runname, filename=None, regenerate=False, nobj=None, from_store=False, **opts):
     """must rewrite this such that NO CHAINS are saved!
     want to return AGN_FRAC and OLD_FRAC
     which is (SFR_AGN) / (SFR_UVIR_LIR_PROSP), (SFR_OLD) / (SFR_UVIR_LIR_PROSP)
     also compare (SFR_UVIR_PROSP) to (SFR_PROSP)
+    from_store: read from the run store (see prospector_store.py) instead of the individual files
     """
 
     ### if it's already made, load it and give it back
@@ -51,40 +90,22 @@ def collate_data(runname, filename=None, regenerate=False, nobj=None, **opts):
         for q in qvals: out[par][q] = []
     for par in ['sfr_uvir_obs','objname','zred']: out[par] = []
 
-    ### fill output containers
-    basenames, _, _ = prosp_dutils.generate_basenames(runname)
-    if nobj is not None:
-        basenames = basenames[:nobj]
-    field = [name.split('/')[-1].split('_')[0] for name in basenames]
-
     ### load necessary information
-    uvirlist = []
-    allfields = np.unique(field).tolist()
-    for f in allfields:
-        uvirlist.append(td_io.load_mips_data(f))
+    uvirlist = {}
 
     ### iterate over items
-    for i, name in enumerate(basenames):
-
-        # load output from fit
-        try:
-            res, _, _, prosp = load_prospector_data(name)
-        except:
-            #print name.split('/')[-1]+' failed to load. skipping.'
-            continue
-        if (prosp == None) or (res == None):
-            continue
+    for i, (objname, prosp) in enumerate(load_objects(runname, nobj=nobj, from_store=from_store)):
 
         if 'sfr_30' not in prosp['extras'].keys():
-            print name.split('/')[-1] + ' extra output must be deleted'
+            print objname + ' extra output must be deleted'
             continue
 
-        out['objname'] += [name.split('/')[-1]]
+        out['objname'] += [objname]
         out['zred'] += [prosp['zred']]
 
         #print 'loaded ' + out['objname'][-1]
         if i % 1000 == 0:
-            print float(i)/len(basenames)
+            print '{0} objects loaded'.format(i)
 
         # Variable model parameters
 
@@ -102,8 +123,11 @@ def collate_data(runname, filename=None, regenerate=False, nobj=None, **opts):
 
         # observed UV+IR SFRs
         # find correct field, find ID match
-        u_idx = uvirlist[allfields.index(field[i])]['id'].astype(int) == int(out['objname'][-1].split('_')[-1])
-        out['sfr_uvir_obs'] += [uvirlist[allfields.index(field[i])]['sfr'][u_idx][0]]
+        field = objname.split('_')[0]
+        if field not in uvirlist:
+            uvirlist[field] = td_io.load_mips_data(field)
+        u_idx = uvirlist[field]['id'].astype(int) == int(objname.split('_')[-1])
+        out['sfr_uvir_obs'] += [uvirlist[field]['sfr'][u_idx][0]]
 
         # pull out relevant quantities
         # "AGN" luminosities are old+young stars, NO AGN
@@ -118,8 +142,7 @@ def collate_data(runname, filename=None, regenerate=False, nobj=None, **opts):
         # (b) L_IR estimated from the model MIPS flux using DH02 templates
         sfr_uvir_truelir_prosp = prosp_dutils.sfr_uvir(lir_tot,luv_tot)
 
-        midx = np.array(['mips' in u for u in res['obs']['filternames']],dtype=bool)
-        mips_flux = prosp['obs']['mags'][:,midx].squeeze() * 3631 * 1e3 # input for this LIR must be in janskies
+        mips_flux = prosp['mips_mags'] * 3631 * 1e3 # input for this LIR must be in janskies
         lir = mips_to_lir(mips_flux, prosp['zred'])
         sfr_uvir_lirfrommips_prosp = prosp_dutils.sfr_uvir(lir,prosp['extras']['luv']['chain'])
 
@@ -134,7 +157,7 @@ def collate_data(runname, filename=None, regenerate=False, nobj=None, **opts):
         vals = [agn_heating_fraction, old_star_heating_fraction, young_star_heating_fraction, \
                 sfr_uvir_truelir_prosp, sfr_uvir_lirfrommips_prosp]
         for p, v in zip(pars,vals):
-            mid, up, down = weighted_quantile(v, np.array([0.5, 0.84, 0.16]), weights=res['weights'][prosp['sample_idx']])
+            mid, up, down = weighted_quantile(v, np.array([0.5, 0.84, 0.16]), weights=prosp['weights'])
             out[p]['q50'] += [mid]
             out[p]['q84'] += [up]
             out[p]['q16'] += [down]
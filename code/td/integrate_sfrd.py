@@ -1,6 +1,6 @@
 import numpy as np
-from scipy.integrate import simps
-from astropy.cosmology import WMAP9
+from prosp_dutils import simps_weights
+from cosmo_tables import age_of_universe
 import matplotlib.pyplot as plt
 from scipy.interpolate import interp1d, interp2d, RectBivariateSpline
 import hickle, os, glob
@@ -113,13 +113,14 @@ def sfr_ms12(z,logm):
 def mf_phi(spars,logm, cumulative=False):
     """ returns the number density of galaxies, per dex per Mpc^-3
     requires spars input dictionary from return_mf_par
+    (or mf_parameter_grid, which gives (nz, nmass))
     """
     phi = np.log(10)*np.exp(-10**(logm-spars['log_mstar'])) * \
           (10**spars['log_phi1']*10**((spars['alpha1']+1)*(logm-spars['log_mstar'])) + \
            10**spars['log_phi2']*10**((spars['alpha2']+1)*(logm-spars['log_mstar'])))
 
     if cumulative:
-        phi = np.cumsum(phi[::-1])[::-1]
+        phi = np.cumsum(phi[...,::-1],axis=-1)[...,::-1]
 
     return phi
 
@@ -203,68 +204,101 @@ def mf_parameters(z,sf=False,qu=False):
 
     return spars
 
+def mf_parameter_grid(z,sf=False,qu=False):
+    """ mf_parameters for an array of redshifts, as (nz,1) columns so that
+    mf_phi(spars, logm) broadcasts to (nz, nmass)
+    """
+    z = np.atleast_1d(np.asarray(z, dtype=float))
+    spars = mf_parameters(z[:,None],sf=sf,qu=qu)
+    return {k: np.zeros((z.shape[0],1)) + v for k, v in spars.items()}
+
+def mass_grid(nz, logm_min=9, logm_max=13, dm=0.01):
+    """ the centers of the mass bins in [logm_min, logm_max) at each of nz redshifts,
+    and the simps weights over them. logm_min can vary with redshift, in which case
+    the grids have different lengths; the extra bins get zero weight.
+    returns logm (nz, nmass), weights (nz, nmass), and the mask of bins in use
+    """
+    lmin = np.zeros(nz) + logm_min
+    ulmin, inverse = np.unique(lmin, return_inverse=True)
+    nmass = np.array([np.arange(l,logm_max,dm).shape[0] for l in ulmin])[inverse]
+    logm = lmin[:,None] + np.arange(nmass.max())*dm + (dm/2.)
+    weights = np.zeros_like(logm)
+    for n in np.unique(nmass):
+        weights[nmass == n, :n] = simps_weights(n=n, dx=dm)
+    inuse = np.arange(nmass.max()) < nmass[:,None]
+
+    return logm, weights, inuse
+
 def measure_sfrd(z,logm_min=9, logm_max=13, dm=0.01,
          apply_pcorrections=False,use_avg=False,fixed=False,**kwargs):
     """ calculates SFRD from analytic mass function
     plus the Whitaker+14 star-forming sequence
+    z can be a scalar or an array, in which case the (nz, nmass) integrand is
+    evaluated at once; logm_min can also be an array (one per redshift).
+    returns sfrd (nz,), SFR / Mpc^-3 / dex (nz, nmass) and logm (nz, nmass),
+    with bins outside of [logm_min, logm_max) set to NaN (without the nz axis for scalar z)
     """
 
     # generate stellar mass array
     # this represents the CENTER of each `bin`
-    logm = np.arange(logm_min,logm_max,dm)+(dm/2.)
+    zarr = np.atleast_1d(np.asarray(z, dtype=float))
+    logm, weights, inuse = mass_grid(zarr.shape[0], logm_min=logm_min, logm_max=logm_max, dm=dm)
+    zgrid = np.zeros_like(logm) + zarr[:,None]
 
     # first, get <SFR(M)>
     # use Prospector SFRs or UV+IR SFRs
     #sfr = sfr_ms(z,logm)
     if use_avg:
-        sfr = sfr_fnc_uvir(logm,z).squeeze()
-        if apply_pcorrections:
-            sfr = sfr_fnc(logm,z).squeeze()
+        sfr_fnc_use = sfr_fnc if apply_pcorrections else sfr_fnc_uvir
     elif fixed:
-        sfr = uvir_fit_fixed_fnc(logm,z).squeeze()
-        if apply_pcorrections:
-            sfr = prosp_fit_fixed_fnc(logm,z).squeeze()
+        sfr_fnc_use = prosp_fit_fixed_fnc if apply_pcorrections else uvir_fit_fixed_fnc
     else:
-        sfr = uvir_fit_fnc(logm,z).squeeze()
-        if apply_pcorrections:
-            sfr = prosp_fit_fnc(logm,z).squeeze()
+        sfr_fnc_use = prosp_fit_fnc if apply_pcorrections else uvir_fit_fnc
+    sfr = sfr_fnc_use(logm, zgrid, grid=False)
 
     # multiply n(M) by SFR(M) to get SFR / Mpc^-3 / dex
-    numdens = mf_phi(mf_parameters(z),logm)
+    numdens = mf_phi(mf_parameter_grid(zarr),logm)
     starforming_function = sfr * numdens
 
     # integrate over stellar mass to get SFRD
-    sfrd = simps(starforming_function,dx=dm)
+    sfrd = (weights*np.where(inuse,starforming_function,0.0)).sum(axis=-1)
+    starforming_function[~inuse], logm[~inuse] = np.nan, np.nan
 
+    if np.ndim(z) == 0:
+        return sfrd[0], starforming_function[0], logm[0]
     return sfrd, starforming_function, logm
 
 def drho_dt(z, logm_min=9, logm_max=12, dm=0.01, dz=0.0001, 
            massloss_correction=False, apply_pcorrections=False, **kwargs):
     """ calculates d(rho)/dt from evolution of stellar mass function
     this is a numerical approximation in redshift AND mass
+    z (and logm_min) can be arrays, in which case all redshifts are done at once
     """
 
     # generate stellar mass array
     # this represents the CENTER of each `bin`
-    logm = np.arange(logm_min,logm_max,dm)+(dm/2.)
+    zarr = np.atleast_1d(np.asarray(z, dtype=float))
+    logm, weights, inuse = mass_grid(zarr.shape[0], logm_min=logm_min, logm_max=logm_max, dm=dm)
 
     # generate delta(phi[z])
     # if we apply the Prospector M(M) corrections, do that here
-    spars, spars_dz = mf_parameters(z), mf_parameters(z+dz)
+    spars, spars_dz = mf_parameter_grid(zarr), mf_parameter_grid(zarr+dz)
     phi_dz = mf_phi(spars,logm) - mf_phi(spars_dz,logm)
     if apply_pcorrections:
-        logm += mass_fnc(logm,z)[:,0]
+        logm = logm + mass_fnc(logm, np.zeros_like(logm) + zarr[:,None], grid=False)
 
     # now get mass_formed
-    mass_formed = simps(phi_dz*10**logm,dx=dm)
+    mass_formed = (weights*np.where(inuse,phi_dz*10**logm,0.0)).sum(axis=-1)
 
     # divide by delta t + mass-loss to get sfrd
-    delta_t = (WMAP9.age(z).value - WMAP9.age(z+dz).value)*1e9
+    delta_t = (age_of_universe(zarr) - age_of_universe(zarr+dz))*1e9
     sfrd = (mass_formed/delta_t)
 
     if massloss_correction:
         sfrd = sfrd / 0.64
 
+    if np.ndim(z) == 0:
+        return sfrd[0]
     return sfrd
 
 def zfourge_rhostar(z):
@@ -273,49 +307,56 @@ def zfourge_rhostar(z):
     a, b = -0.33, 8.75
     return (a*(1+z)+b)
 
-def zfourge_param_rhostar(z, massloss_correction=False, apply_pcorrections=False, **opts):
+def zfourge_param_rhostar(z, massloss_correction=False, apply_pcorrections=False, dz=0.005, **opts):
     """using equation (5) in Tomczak et al. 2014 instead of calculating directly from evolution of mass function
     this removes the "bump" at z~1.5 which is likely erroneous!
     applies for 9 < log(M) < 13
+    dz is the width of the finite difference in redshift
     """
 
     # turn into rhodot
-    nz, dz = len(z), 0.005
-    rhodot = np.zeros(nz)
-    for i in range(nz):
-        upz, downz = z[i]+dz/2., z[i]-dz/2.
-        logrho_down = zfourge_rhostar(downz)
-        logrho_up = zfourge_rhostar(upz)
-        if apply_pcorrections:
-            logm_increase = np.log10(drho_dt(z[i],massloss_correction=massloss_correction,apply_pcorrections=True,**opts))-\
-                            np.log10(drho_dt(z[i],massloss_correction=massloss_correction,apply_pcorrections=False,**opts))
-            logrho_down += logm_increase
-            logrho_up += logm_increase
-        delta_rho = 10**logrho_down - 10**logrho_up
-        delta_t = (WMAP9.age(downz).value - WMAP9.age(upz).value)*1e9
-        rhodot[i] = delta_rho/delta_t
+    z = np.atleast_1d(np.asarray(z, dtype=float))
+    upz, downz = z+dz/2., z-dz/2.
+    logrho_down = zfourge_rhostar(downz)
+    logrho_up = zfourge_rhostar(upz)
+    if apply_pcorrections:
+        # the mass-loss correction cancels in the ratio
+        logm_increase = np.log10(drho_dt(z,apply_pcorrections=True,**opts))-\
+                        np.log10(drho_dt(z,apply_pcorrections=False,**opts))
+        logrho_down = logrho_down + logm_increase
+        logrho_up = logrho_up + logm_increase
+    delta_rho = 10**logrho_down - 10**logrho_up
+    delta_t = (age_of_universe(downz) - age_of_universe(upz))*1e9
+    rhodot = delta_rho/delta_t
 
     if massloss_correction:
         rhodot /= 0.64
 
     return np.log10(rhodot)
 
-def generate_evolving_mcut(z_in,logm_at_zstart=9.):
+def generate_evolving_mcut(z_in,logm_at_zstart=9.,logm_max=12,dm=0.01):
+    """ the minimum mass at each redshift in z_in which keeps the cumulative number density
+    fixed at its value at logm_at_zstart at the highest redshift
+    """
 
-    # generate mass vector, accurate to 0.01 dex
-    logm = np.arange(logm_at_zstart,12,0.01)
+    # generate mass vector, accurate to dm dex
+    z_in = np.atleast_1d(np.asarray(z_in, dtype=float))
+    logm = np.arange(logm_at_zstart,logm_max,dm)
 
     # figure out appropriate number density
-    numdens = mf_phi(mf_parameters(z_in.max()),logm,cumulative=True)
-    nd_target = np.interp(logm_at_zstart,logm,numdens)
-    logm_min = []
-    for z in z_in:
-        numdens = mf_phi(mf_parameters(z),logm,cumulative=True)
-
+    numdens = mf_phi(mf_parameter_grid(z_in),logm,cumulative=True)
+    nd_target = np.interp(logm_at_zstart,logm,numdens[z_in.argmax()])
 
-        logm_min += [np.interp(nd_target,numdens[::-1],logm[::-1])]
+    # cumulative number density decreases with mass: interpolate in each row
+    # (same as np.interp(nd_target,numdens[::-1],logm[::-1]), clamped to the grid)
+    nlogm = logm.shape[0]
+    hi = np.clip((numdens >= nd_target).sum(axis=1), 1, nlogm-1)
+    rows = np.arange(z_in.shape[0])
+    n_lo, n_hi = numdens[rows,hi-1], numdens[rows,hi]
+    frac = np.clip((n_lo - nd_target) / (n_lo - n_hi), 0, 1)
+    logm_min = logm[hi-1] + frac*(logm[hi]-logm[hi-1])
 
-    return logm_min
+    return list(logm_min)
 
 def mass_vs_sfrd(true_values=False,mloss=0.64):
 
@@ -366,7 +407,7 @@ def mass_vs_sfrd(true_values=False,mloss=0.64):
     plt.show()
     print 1/0
 
-def plot_sfrd_new(logm_min=9.,logm_max=13,dm=0.01,
+def plot_sfrd_new(logm_min=9.,logm_max=13,dm=0.01,dz=0.05,
                   massloss_correction=True,use_avg=True,fixed=False,
                   mcmc=False):
     """ compare SFRD from mass function(z) versus observed SFR
@@ -396,7 +437,6 @@ def plot_sfrd_new(logm_min=9.,logm_max=13,dm=0.01,
     if massloss_correction: mloss_corr = 0.64
 
     # redshift array
-    dz = 0.05
     zrange = np.arange(0.75, 2.25+dz, dz)
     opts = {
             'logm_min': logm_min,
@@ -407,18 +447,13 @@ def plot_sfrd_new(logm_min=9.,logm_max=13,dm=0.01,
             'fixed': fixed
            }
 
-    # calculate SFRD
-    sfrd_uvir, sfrd_prosp = [], [] 
+    # calculate SFRD from star formation for both UV+IR SFRs and Prospector
+    sfrd_uvir, _, _ = measure_sfrd(zrange,**opts)
+    sfrd_prosp, _, _ = measure_sfrd(zrange,apply_pcorrections=True,**opts)
+
+    # calculate expected ratio of mass to SFR
     bratio, bsfrd, bdrho, bsfrd_all, bdrho_all = [], [], [], [], []
     for i, z in enumerate(zrange):
-
-        # calculate SFRD from star formation for both UV+IR SFRs and Prospector
-        sfrd, rhosfr, logm = measure_sfrd(z,**opts)
-        sfrd_uvir += [sfrd]
-        sfrd, rhosfr, logm = measure_sfrd(z,apply_pcorrections=True,**opts)
-        sfrd_prosp += [sfrd]
-
-        # calculate expected ratio of mass to SFR
         mdiff, sfdiff = csfh.behroozi_offsets(z)
         bdrho += [float(10**csfh.behroozi_rhodot(z,logm_min-mdiff,true_mass=True)/mloss_corr)]
         dat = csfh.behroozi_sfrd(z,logm_min-mdiff,true_mass=True,true_sfr=True)
@@ -488,7 +523,7 @@ def plot_sfrd_new(logm_min=9.,logm_max=13,dm=0.01,
 
     print 1/0
 
-def plot_sfrd(logm_min=9.,logm_max=12,dm=0.01,
+def plot_sfrd(logm_min=9.,logm_max=12,dm=0.01,dz=0.1,
               massloss_correction=True,use_avg=True,fixed=False,
               true_mass=False, true_sfr=False, mcmc=False, ndens=True):
     """ compare SFRD from mass function(z) versus observed SFR
@@ -521,7 +556,6 @@ def plot_sfrd(logm_min=9.,logm_max=12,dm=0.01,
         bkey, blabel = 'true_csfr', 'UM true CSFR'
 
     # generate z-array + numerical options
-    dz = 0.1
     zrange = np.arange(0.75, 2.35, dz)
     opts = {
             'logm_min': logm_min,
@@ -537,28 +571,17 @@ def plot_sfrd(logm_min=9.,logm_max=12,dm=0.01,
     # otherwise, use Tomczak+14 eqn 5 (logm_min=9 ONLY)
     mmin = generate_evolving_mcut(zrange)
     if ndens:
-        mf_sfrd, mf_sfrd_prosp = [], []
-        for i, z in enumerate(zrange):
-            #opts['logm_min'] = mmin[i]
-            mf_sfrd += [np.log10(drho_dt(z, **opts))]
-            mf_sfrd_prosp += [np.log10(drho_dt(z, apply_pcorrections=True, **opts))]
+        mf_sfrd = np.log10(drho_dt(zrange, **opts))
+        mf_sfrd_prosp = np.log10(drho_dt(zrange, apply_pcorrections=True, **opts))
     else:
         mf_sfrd = zfourge_param_rhostar(zrange, **opts)
         mf_sfrd_prosp = zfourge_param_rhostar(zrange, apply_pcorrections=True, **opts)
 
     # calculate star formation rate density
-    sfrd_uvir, sfrd_prosp, rhosfr_uvir, rhosfr_prosp  = [], [], [], []
-    for i, z in enumerate(zrange):
-
-        if ndens:
-            opts['logm_min'] = mmin[i]
-        sfrd, rhosfr, logm = measure_sfrd(z,**opts)
-        sfrd_uvir += [sfrd]
-        rhosfr_uvir += [rhosfr]
-
-        sfrd, rhosfr, logm = measure_sfrd(z,apply_pcorrections=True,**opts)
-        sfrd_prosp += [sfrd]
-        rhosfr_prosp += [rhosfr]
+    if ndens:
+        opts['logm_min'] = np.array(mmin)
+    sfrd_uvir, rhosfr_uvir, logm = measure_sfrd(zrange,**opts)
+    sfrd_prosp, rhosfr_prosp, logm = measure_sfrd(zrange,apply_pcorrections=True,**opts)
 
     # Plot1: change in SFRD
     fig, ax = plt.subplots(1,2, figsize=(7, 3.5))
@@ -672,15 +695,15 @@ def plot_sfrd(logm_min=9.,logm_max=12,dm=0.01,
     zbins = np.linspace(0.5,2.5,5)
     nbins = len(zbins)-1
     zlabels = ['$'+"{0:.1f}".format(zbins[i])+'<z<'+"{0:.1f}".format(zbins[i+1])+'$' for i in range(nbins)]
-    delm = logm[1]-logm[0]
+    delm = dm
 
     # loop
     for i in range(nbins):
 
         idx = np.abs(zrange-(zbins[i]+zbins[i+1])/2.).argmin()
 
-        ax[i].plot(logm, rhosfr_uvir[idx]/delm, '-', color=old_color, **popts)
-        ax[i].plot(logm, rhosfr_prosp[idx]/delm, '-', color=new_color, **popts)
+        ax[i].plot(logm[idx], rhosfr_uvir[idx]/delm, '-', color=old_color, **popts)
+        ax[i].plot(logm[idx], rhosfr_prosp[idx]/delm, '-', color=new_color, **popts)
 
         # labels
         ax[i].set_ylim(ylim)
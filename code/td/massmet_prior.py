@@ -0,0 +1,65 @@
+""" Gallazzi et al. 2005 mass--metallicity prior, shared by the MassMet
+priors in the parameter files.
+
+the table is read once per process (on first use), and the truncated-normal
+quantile function and density are evaluated in closed form with ndtr / ndtri,
+vectorized over any number of points, instead of through truncnorm.
+"""
+import numpy as np
+import os
+from scipy.special import ndtr, ndtri
+
+_massmet = {}
+
+def load_massmet(filename=None):
+    """ returns the Gallazzi+05 table as (mass, P50, P84-P16), read once per process
+    """
+    if filename is None:
+        filename = os.getenv('APPS')+'/prospector_alpha/data/gallazzi_05_massmet.txt'
+    if filename not in _massmet:
+        dat = np.loadtxt(filename)
+        _massmet[filename] = (dat[:,0], dat[:,1], dat[:,3]-dat[:,2])
+    return _massmet[filename]
+
+def massmet_loc_scale(mass):
+    """ center and width of the metallicity prior at a given stellar mass
+    """
+    mgrid, p50, width = load_massmet()
+    return np.interp(mass, mgrid, p50), np.interp(mass, mgrid, width)
+
+def massmet_args(mass, z_mini, z_maxi):
+    """ loc, scale and the standardized truncation limits a, b
+    """
+    loc, scale = massmet_loc_scale(mass)
+    return loc, scale, (z_mini - loc) / scale, (z_maxi - loc) / scale
+
+def massmet_lnpdf(mass, met, z_mini, z_maxi):
+    """ vectorized ln(truncnorm.pdf) of metallicity given mass
+    (-inf outside of [z_mini, z_maxi])
+    """
+    loc, scale, a, b = massmet_args(mass, z_mini, z_maxi)
+    x = (np.asarray(met) - loc) / scale
+    lnp = -0.5*x**2 - 0.5*np.log(2*np.pi) - np.log(scale*(ndtr(b)-ndtr(a)))
+    return np.where((met >= z_mini) & (met <= z_maxi), lnp, -np.inf)
+
+def massmet_ppf(mass, u, z_mini, z_maxi):
+    """ vectorized truncnorm.ppf of metallicity given mass.
+    the quantile function of a normal truncated to [a,b] is
+    ndtri(ndtr(a) + u*(ndtr(b)-ndtr(a))); when the whole interval is in the
+    upper tail we use the mirrored form, which keeps full precision there.
+    """
+    loc, scale, a, b = massmet_args(mass, z_mini, z_maxi)
+    u = np.asarray(u, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lower = ndtri(ndtr(a) + u*(ndtr(b)-ndtr(a)))
+        upper = -ndtri(ndtr(-a) - u*(ndtr(-a)-ndtr(-b)))
+    x = np.where(a > 0, upper, lower)
+    return np.clip(loc + scale*x, z_mini, z_maxi)
+
+def massmet_unit_transform(x, mass_mini, mass_maxi, z_mini, z_maxi):
+    """ unit cube -> (mass, metallicity). x is (2,) or (npoint, 2)
+    """
+    x = np.asarray(x, dtype=float)
+    mass = x[...,0]*(mass_maxi - mass_mini) + mass_mini
+    met = massmet_ppf(mass, x[...,1], z_mini, z_maxi)
+    return np.stack((mass, met), axis=-1)
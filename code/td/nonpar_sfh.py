@@ -0,0 +1,82 @@
+""" shared transforms for the nonparametric (Dirichlet / z_fraction) SFH.
+used as `depends_on` functions by the parameter files, and to convert whole chains at once.
+
+every function takes either a single parameter vector, or a block of draws with
+the bins along the LAST axis, e.g. z_fraction with shape (ndraw, nbin-1).
+"""
+import numpy as np
+from cosmo_tables import age_of_universe
+
+def zfrac_to_sfrac(z_fraction=None, **extras):
+    """This transforms from latent, independent `z` variables to sfr
+    fractions. The transformation is such that sfr fractions are drawn from a
+    Dirichlet prior.  See Betancourt et al. 2010
+
+    sfr_fraction[i] = prod(z_fraction[:i]) * (1 - z_fraction[i]), and the last
+    bin gets the remainder, prod(z_fraction)
+    """
+    z_fraction = np.asarray(z_fraction, dtype=float)
+    ones = np.ones(z_fraction.shape[:-1]+(1,))
+    zprod = np.concatenate((ones, np.cumprod(z_fraction, axis=-1)), axis=-1)
+
+    return zprod * np.concatenate((1.0 - z_fraction, ones), axis=-1)
+
+def zfrac_to_masses(logmass=None, z_fraction=None, agebins=None, **extras):
+    """This transforms from latent, independent `z` variables to sfr fractions
+    and then to bin mass fractions. The transformation is such that sfr
+    fractions are drawn from a Dirichlet prior.  See Betancourt et al. 2010
+    :returns masses:
+        The stellar mass formed in each age bin.
+        (nbin,) for a single draw, or (ndraw, nbin) if z_fraction is (ndraw, nbin-1)
+    """
+    # sfr fractions (e.g. Leja 2017)
+    sfr_fraction = zfrac_to_sfrac(z_fraction)
+    # convert to mass fractions
+    time_per_bin = np.diff(10**np.asarray(agebins), axis=-1)[...,0]
+    mass_fraction = sfr_fraction * time_per_bin
+    mass_fraction /= mass_fraction.sum(axis=-1)[...,None]
+
+    logmass = np.asarray(logmass, dtype=float)
+    if mass_fraction.ndim > 1:
+        logmass = logmass.reshape(-1,1)
+    masses = 10**logmass * mass_fraction
+
+    return masses
+
+def masses_to_zfrac(mass=None, agebins=None, **extras):
+    """The inverse of zfrac_to_masses, for setting mock parameters based on
+    real bin masses. returns (total_mass, z_fraction)
+    """
+    mass = np.asarray(mass, dtype=float)
+    total_mass = mass.sum(axis=-1)
+    time_per_bin = np.diff(10**np.asarray(agebins), axis=-1)[...,0]
+    sfr_fraction = mass / time_per_bin
+    sfr_fraction /= sfr_fraction.sum(axis=-1)[...,None]
+
+    # prod(z_fraction[:i]) is the sfr fraction left over for bins >= i,
+    # so z_fraction[i] = (left over for bins > i) / (left over for bins >= i)
+    remaining = np.cumsum(sfr_fraction[...,::-1], axis=-1)[...,::-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z_fraction = remaining[...,1:] / remaining[...,:-1]
+
+    return total_mass, z_fraction
+
+def agebins_from_redshift(zred, agelims, nbins_sfh):
+    """The redshift-dependent age bins used in load_model: the first two bins
+    are fixed by agelims[:3], the last bin is the oldest 15% of the age of the
+    universe, and the remaining nbins_sfh-3 bins are spaced evenly in log(age)
+    in between. Bins are in log(yr).
+    :returns agebins:
+        (nbins_sfh, 2) for a single redshift, or (nz, nbins_sfh, 2) for an array
+    """
+    zred = np.asarray(zred, dtype=float)
+    logtuniv = np.log10(age_of_universe(zred)*1e9)[...,None]
+    logtbinmax = logtuniv + np.log10(0.85)
+
+    frac = np.linspace(0, 1, nbins_sfh-2)
+    middle = agelims[2] + (logtbinmax - agelims[2])*frac
+    middle[...,-1:] = logtbinmax
+    fixed = np.zeros(middle.shape[:-1]+(2,)) + np.array(agelims[:2], dtype=float)
+    lims = np.concatenate((fixed, middle, logtuniv), axis=-1)
+
+    return np.stack((lims[...,:-1], lims[...,1:]), axis=-1)
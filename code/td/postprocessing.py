@@ -5,7 +5,6 @@ import argparse
 from copy import deepcopy
 from prospector_io import load_prospector_data, create_prosp_filename
 import prosp_dynesty_plots
-from dynesty.plotting import _quantile as weighted_quantile
 from prospect.models import sedmodel
 
 def set_sfh_time_vector(chain,model):
@@ -28,12 +27,107 @@ def set_sfh_time_vector(chain,model):
         sys.exit('ERROR: not sure how to set up the time array here!')
     return t
 
+def checkpoint_arrays(eout, ncalc, path=''):
+    """returns {path: array} for every array in the (nested) dictionary eout
+    which is filled one posterior draw at a time, i.e. has a leading dimension of ncalc
+    """
+    out = {}
+    for key in eout.keys():
+        if type(eout[key]) == dict:
+            out.update(checkpoint_arrays(eout[key], ncalc, path=path+key+'/'))
+        elif (type(eout[key]) == type(np.array([]))) and (eout[key].ndim > 0) and (eout[key].shape[0] == ncalc):
+            out[path+key] = eout[key]
+    return out
+
+def write_checkpoint(filename, arrays, start, stop, ncomplete=None, state=None, attrs=None):
+    """flush rows start:stop of each array to the HDF5 checkpoint file,
+    and record that the first `stop` draws (or ncomplete, if passed) are complete.
+    arrays in `state` which are not one row per draw (e.g. streaming histograms) are written in full.
+    attrs (e.g. the settings the checkpoint was made with) are stored as file attributes.
+    """
+    import h5py
+    with h5py.File(filename, 'a') as f:
+        for key in arrays.keys():
+            if key not in f:
+                f.create_dataset(key, shape=arrays[key].shape, dtype=arrays[key].dtype,
+                                 chunks=(min(arrays[key].shape[0],100),)+arrays[key].shape[1:])
+            f[key][start:stop] = arrays[key][start:stop]
+        for key in (state or {}).keys():
+            if key not in f:
+                f.create_dataset(key, shape=state[key].shape, dtype=state[key].dtype)
+            f[key][...] = state[key]
+        for key in (attrs or {}).keys():
+            f.attrs[key] = attrs[key]
+        f.attrs['ncomplete'] = stop if ncomplete is None else ncomplete
+
+def read_checkpoint(filename, arrays, state=None):
+    """fill arrays with the completed draws in the HDF5 checkpoint file
+    (and the arrays in `state` in full). returns the number of completed draws
+    """
+    import h5py
+    with h5py.File(filename, 'r') as f:
+        ncomplete = int(f.attrs['ncomplete'])
+        for key in arrays.keys():
+            if key in f:
+                arrays[key][:ncomplete] = f[key][:ncomplete]
+        for key in (state or {}).keys():
+            if key in f:
+                state[key][...] = f[key][...]
+    return ncomplete
+
+def checkpoint_settings(res, sps, obs, ncalc, **settings):
+    """everything which determines the draws and how they are computed, as checkpoint attributes:
+    ncalc, the keywords in settings, and fingerprints of the sampling results (chain, weights,
+    run_params), the observations and the sps. a checkpoint is only resumed if all of these match.
+    """
+    import hashlib
+
+    def fingerprint(*items):
+        md5 = hashlib.md5()
+        for item in items:
+            if isinstance(item, np.ndarray):
+                md5.update(np.ascontiguousarray(item).tobytes())
+            else:
+                md5.update(repr(item))
+        return md5.hexdigest()
+
+    def obs_fingerprint(o):
+        keys = sorted(key for key in o.keys() if key != 'filters')
+        filternames = [getattr(f,'name',f) for f in (o.get('filters') or [])]
+        return fingerprint(filternames, *[o[key] if isinstance(o[key], np.ndarray) else repr(o[key]) for key in keys])
+
+    out = {key: repr(settings[key]) for key in settings.keys()}
+    out['ncalc'] = int(ncalc)
+    out['res'] = fingerprint(res['chain'], res['weights'], sorted(res['run_params'].items()))
+    out['obs'] = fingerprint(obs_fingerprint(res['obs']), obs_fingerprint(obs))
+    out['sps'] = type(sps).__module__+'.'+type(sps).__name__
+
+    return out
+
 def calc_extra_quantities(res, sps, obs, noise=None,ncalc=3000, shorten_spec=True, measure_abslines=False,
-                          measure_herschel=False,measure_restframe_properties=True,**kwargs):
+                          measure_herschel=False,measure_restframe_properties=True,batch_sfh=False,
+                          checkpoint=None,checkpoint_interval=50,cache_spectra=True,cache_bins=False,
+                          stream_spec=False,**kwargs):
     """calculate extra quantities: star formation history, stellar mass, spectra, photometry, etc
     shorten_spec: if on, return only the 50th / 84th / 16th percentiles. else return all spectra.
+    stream_spec: if on (with shorten_spec), accumulate the spectral percentiles in a log-flux histogram
+    at each wavelength as the draws are made, instead of holding all (ncalc, nwave) spectra.
+    percentiles are good to ~0.005 dex.
+    batch_sfh: if on (and the SFH is nonparametric), store the bin masses for each draw and calculate
+    the SFH-derived quantities for all draws at once after the loop, instead of one draw at a time.
+    checkpoint: if a filename is passed, completed draws are flushed to this HDF5 file every
+    checkpoint_interval draws. if the file already exists, we resume from the last completed draw,
+    unless it was made from other sampling results or with other settings (see checkpoint_settings).
+    cache_spectra: if on (and the sps supports it), memoize restframe spectra, so that the repeated
+    model calls for each draw (e.g. Herschel photometry, rest-frame properties) only call FSPS once.
+    cache_bins: if on (and the sps supports it), compose nonparametric spectra from cached spectra of
+    each age bin. only faster when many draws share the non-SFH parameters, e.g. fixed dust + metallicity.
     """
 
+    if hasattr(sps, 'cache_spectra'):
+        sps.cache_spectra = cache_spectra
+        sps.cache_bins = cache_bins
+
     # calculate maxprob
     # and ensure that maxprob stored is the same as calculated now 
     # don't recalculate lnprobability after we fix MassMet
@@ -55,6 +149,28 @@ def calc_extra_quantities(res, sps, obs, noise=None,ncalc=3000, shorten_spec=Tru
     if amax in sample_idx:
         sample_idx[sample_idx == amax] = sample_idx[0]
     sample_idx[0] = amax
+
+    # if we're resuming, use the same draws as the first attempt.
+    # a checkpoint made from other sampling results or with other settings holds draws
+    # computed a different way, so start over
+    if checkpoint is not None:
+        settings = checkpoint_settings(res, sps, obs, ncalc, noise=noise is not None,
+                                       shorten_spec=shorten_spec, stream_spec=stream_spec and shorten_spec,
+                                       measure_abslines=measure_abslines, measure_herschel=measure_herschel,
+                                       measure_restframe_properties=measure_restframe_properties,
+                                       batch_sfh=batch_sfh, cache_bins=cache_bins)
+    resume = (checkpoint is not None) and os.path.isfile(checkpoint)
+    if resume:
+        import h5py
+        with h5py.File(checkpoint, 'r') as f:
+            resume = np.all([f.attrs.get(key,None) == settings[key] for key in settings.keys()])
+            if resume:
+                sample_idx = f['sample_idx'][:]
+        if resume:
+            ncalc = sample_idx.shape[0]
+        else:
+            print 'checkpoint {0} was made from other results or settings, starting over'.format(checkpoint)
+            os.remove(checkpoint)
     print "we are measuring {0}% of the weights".format(res['weights'][sample_idx].sum()/res['weights'].sum()*100)
 
     # compact creation of outputs
@@ -71,9 +187,9 @@ def calc_extra_quantities(res, sps, obs, noise=None,ncalc=3000, shorten_spec=Tru
 
     # thetas
     parnames = res['model'].theta_labels()
+    theta_q = prosp_dutils.weighted_quantile_columns(res['chain'], np.array([0.5, 0.16, 0.84]), res['weights'])
     for i, p in enumerate(parnames):  
-        q50, q16, q84 = weighted_quantile(res['chain'][:,i], np.array([0.5, 0.16, 0.84]), weights=res['weights'])
-        eout['thetas'][p] = {'q50': q50, 'q16': q16, 'q84': q84}
+        eout['thetas'][p] = {'q50': theta_q[0,i], 'q16': theta_q[1,i], 'q84': theta_q[2,i]}
 
     # extras
     extra_parnames = ['avg_age','lwa_rband','lwa_lbol','half_time','sfr_100','ssfr_100','ssfr_30','sfr_30','sfr_300', 'ssfr_300',\
@@ -87,11 +203,25 @@ def calc_extra_quantities(res, sps, obs, noise=None,ncalc=3000, shorten_spec=Tru
     eout['sfh']['t'] = tvec
     eout['sfh']['sfh'] = np.zeros(shape=(ncalc,tvec.shape[0]))
 
+    # batch mode only works for nonparametric SFHs
+    if batch_sfh & ('agebins' not in res['model'].params):
+        print 'batch_sfh requires a nonparametric SFH, calculating SFH quantities draw-by-draw'
+        batch_sfh = False
+    if batch_sfh:
+        mass_bins = np.zeros(shape=(ncalc,res['model'].params['agebins'].shape[0]))
+        mfrac = np.zeros(ncalc)
+
     # observables
     eout['obs']['lam_obs'] = sps.wavelengths
     if res['obs'].get('wavelength',None) is not None:
         eout['obs']['lam_obs'] = res['obs']['wavelength']
-    eout['obs']['spec'] = np.zeros(shape=(ncalc,eout['obs']['lam_obs'].shape[0]))
+    if stream_spec and not shorten_spec:
+        print 'stream_spec requires shorten_spec, keeping all spectra'
+        stream_spec = False
+    if stream_spec:
+        spec_stream = prosp_dutils.LogHistQuantiles(eout['obs']['lam_obs'].shape[0])
+    else:
+        eout['obs']['spec'] = np.zeros(shape=(ncalc,eout['obs']['lam_obs'].shape[0]))
     eout['obs']['mags'] = np.zeros(shape=(ncalc,len(res['obs']['filters'])))
     eout['obs']['uvj'] = np.zeros(shape=(ncalc,3))
     eout['obs']['rf'] = np.zeros(shape=(ncalc,3))
@@ -126,14 +256,36 @@ def calc_extra_quantities(res, sps, obs, noise=None,ncalc=3000, shorten_spec=Tru
     filters = ['wfc3_uvis_f275w','wfc3_uvis_f336w','wfc3_uvis_f606w'] #throw in F275W because we have z~2.4 sources for whom LyC is in F275W
     fobs = {'filters': load_filters(filters), 'wavelength': None}
     '''
+    # set up checkpointing
+    ncomplete = 0
+    if checkpoint is not None:
+        arrays = checkpoint_arrays(eout, ncalc)
+        if batch_sfh:
+            arrays['batch_sfh/mass_bins'] = mass_bins
+            arrays['batch_sfh/mfrac'] = mfrac
+        state = {}
+        if stream_spec:
+            state = {'spec_stream/hist': spec_stream.hist, 'spec_stream/ref': spec_stream.ref}
+        if resume:
+            ncomplete = read_checkpoint(checkpoint, arrays, state=state)
+            print 'resuming from checkpoint {0} at draw {1}'.format(checkpoint,ncomplete)
+        else:
+            write_checkpoint(checkpoint, {'sample_idx': sample_idx}, 0, ncalc, ncomplete=0, attrs=settings)
+
     # sample in the posterior
     for jj,sidx in enumerate(sample_idx):
 
         # bookkeepping
+        if jj < ncomplete:
+            continue
         t1 = time.time()
 
         thetas = res['chain'][sidx,:]
-        eout['obs']['spec'][jj,:],eout['obs']['mags'][jj,:],sm = res['model'].mean_model(thetas, res['obs'], sps=sps, sigma=sigma)
+        spec,eout['obs']['mags'][jj,:],sm = res['model'].mean_model(thetas, res['obs'], sps=sps, sigma=sigma)
+        if stream_spec:
+            spec_stream.add(spec, eout['weights'][jj])
+        else:
+            eout['obs']['spec'][jj,:] = spec
 
         '''
         import matplotlib.pyplot as plt
@@ -166,23 +318,30 @@ def calc_extra_quantities(res, sps, obs, noise=None,ncalc=3000, shorten_spec=Tru
         #eout['obs']['spec'][jj,:] = np.interp(sps.wavelengths, sps.wavelengths*(1+res['model'].params['zred']), spec)
 
         # calculate SFH-based quantities
-        sfh_params = prosp_dutils.find_sfh_params(res['model'],thetas,res['obs'],sps,sm=sm)
-        eout['extras']['stellar_mass']['chain'][jj] = sfh_params['mass']
-        eout['sfh']['sfh'][jj,:] = prosp_dutils.return_full_sfh(eout['sfh']['t'], sfh_params)
-        eout['extras']['half_time']['chain'][jj] = prosp_dutils.halfmass_assembly_time(sfh_params)
-        eout['extras']['sfr_100']['chain'][jj] = prosp_dutils.calculate_sfr(sfh_params, 0.1,  minsfr=-np.inf, maxsfr=np.inf)
-        eout['extras']['ssfr_100']['chain'][jj] = eout['extras']['sfr_100']['chain'][jj].squeeze() / eout['extras']['stellar_mass']['chain'][jj].squeeze()
-        eout['extras']['sfr_30']['chain'][jj] = prosp_dutils.calculate_sfr(sfh_params, 0.03,  minsfr=-np.inf, maxsfr=np.inf)
-        eout['extras']['ssfr_30']['chain'][jj] = eout['extras']['sfr_30']['chain'][jj].squeeze() / eout['extras']['stellar_mass']['chain'][jj].squeeze()
-        eout['extras']['sfr_300']['chain'][jj] = prosp_dutils.calculate_sfr(sfh_params, 0.3,  minsfr=-np.inf, maxsfr=np.inf)
-        eout['extras']['ssfr_300']['chain'][jj] = eout['extras']['sfr_300']['chain'][jj].squeeze() / eout['extras']['stellar_mass']['chain'][jj].squeeze()
+        # in batch mode, save the SFH for later (mean_model has already set the parameters)
+        if batch_sfh:
+            mass_bins[jj,:] = res['model'].params['mass']
+            mfrac[jj] = sm
+            mformed = mass_bins[jj,:].sum()
+        else:
+            sfh_params = prosp_dutils.find_sfh_params(res['model'],thetas,res['obs'],sps,sm=sm)
+            mformed = sfh_params['mformed']
+            eout['extras']['stellar_mass']['chain'][jj] = sfh_params['mass']
+            eout['sfh']['sfh'][jj,:] = prosp_dutils.return_full_sfh(eout['sfh']['t'], sfh_params)
+            eout['extras']['half_time']['chain'][jj] = prosp_dutils.halfmass_assembly_time(sfh_params)
+            eout['extras']['sfr_100']['chain'][jj] = prosp_dutils.calculate_sfr(sfh_params, 0.1,  minsfr=-np.inf, maxsfr=np.inf)
+            eout['extras']['ssfr_100']['chain'][jj] = eout['extras']['sfr_100']['chain'][jj].squeeze() / eout['extras']['stellar_mass']['chain'][jj].squeeze()
+            eout['extras']['sfr_30']['chain'][jj] = prosp_dutils.calculate_sfr(sfh_params, 0.03,  minsfr=-np.inf, maxsfr=np.inf)
+            eout['extras']['ssfr_30']['chain'][jj] = eout['extras']['sfr_30']['chain'][jj].squeeze() / eout['extras']['stellar_mass']['chain'][jj].squeeze()
+            eout['extras']['sfr_300']['chain'][jj] = prosp_dutils.calculate_sfr(sfh_params, 0.3,  minsfr=-np.inf, maxsfr=np.inf)
+            eout['extras']['ssfr_300']['chain'][jj] = eout['extras']['sfr_300']['chain'][jj].squeeze() / eout['extras']['stellar_mass']['chain'][jj].squeeze()
 
         # calculate AGN parameters if necessary
         if 'fagn' in parnames:
-            eout['extras']['l_agn']['chain'][jj] = prosp_dutils.measure_agn_luminosity(thetas[parnames.index('fagn')],sps,sfh_params['mformed'])
+            eout['extras']['l_agn']['chain'][jj] = prosp_dutils.measure_agn_luminosity(thetas[parnames.index('fagn')],sps,mformed)
 
         # lbol
-        eout['extras']['lbol']['chain'][jj] = prosp_dutils.measure_lbol(sps,sfh_params['mformed'])
+        eout['extras']['lbol']['chain'][jj] = prosp_dutils.measure_lbol(sps,mformed)
 
         # measure from rest-frame spectrum
         t2 = time.time()
@@ -245,37 +404,43 @@ def calc_extra_quantities(res, sps, obs, noise=None,ncalc=3000, shorten_spec=Tru
         t3 = time.time()
         print('loop {0} took {1}s ({2}s for absorption+emission)'.format(jj,t3 - t1,t3 - t2))
 
-    # calculate percentiles from chain
-    for p in eout['extras'].keys():
-        q50, q16, q84 = weighted_quantile(eout['extras'][p]['chain'], np.array([0.5, 0.16, 0.84]), weights=eout['weights'])
-        for q,qstr in zip([q50,q16,q84],['q50','q16','q84']): eout['extras'][p][qstr] = q
-    
-    q50, q16, q84 = weighted_quantile(eout['obs']['dn4000']['chain'], np.array([0.5, 0.16, 0.84]), weights=eout['weights'])
-    for q,qstr in zip([q50,q16,q84],['q50','q16','q84']): eout['obs']['dn4000'][qstr] = q
+        # flush completed draws to disk
+        if (checkpoint is not None) and (((jj+1) % checkpoint_interval == 0) or (jj == ncalc-1)):
+            write_checkpoint(checkpoint, arrays, ncomplete, jj+1, state=state)
+            ncomplete = jj+1
 
-    for key1 in eout['obs']['elines'].keys():
-        for key2 in ['ew','flux']:
-            q50, q16, q84 = weighted_quantile(eout['obs']['elines'][key1][key2]['chain'], np.array([0.5, 0.16, 0.84]), weights=eout['weights'])
-            for q,qstr in zip([q50,q16,q84],['q50','q16','q84']): eout['obs']['elines'][key1][key2][qstr] = q
+    if hasattr(sps, 'cache_stats'):
+        print 'spectrum cache: {hits} hits, {misses} misses'.format(**sps.cache_stats)
+
+    # SFH-derived quantities for all draws at once
+    if batch_sfh:
+        sfh_out = prosp_dutils.batch_sfh_quantities(eout['sfh']['t'], mass_bins, res['model'].params['agebins'], mfrac)
+        eout['sfh']['sfh'] = sfh_out.pop('sfh')
+        for key in sfh_out.keys(): eout['extras'][key]['chain'] = sfh_out[key]
 
+    # calculate percentiles from chain, for every quantity at once
+    qdicts = [eout['extras'][p] for p in eout['extras'].keys()] + [eout['obs']['dn4000']]
+    for key1 in eout['obs']['elines'].keys():
+        qdicts += [eout['obs']['elines'][key1][key2] for key2 in ['ew','flux']]
     if measure_abslines:
-        for key in eout['obs']['abslines'].keys():
-            q50, q16, q84 = weighted_quantile(eout['obs']['abslines'][key]['chain'], np.array([0.5, 0.16, 0.84]), weights=eout['weights'])
-            for q,qstr in zip([q50,q16,q84],['q50','q16','q84']): eout['obs']['abslines'][key][qstr] = q
+        qdicts += [eout['obs']['abslines'][key] for key in eout['obs']['abslines'].keys()]
+    qvals = prosp_dutils.weighted_quantile_columns(np.array([d['chain'] for d in qdicts]).T,
+                                                   np.array([0.5, 0.16, 0.84]), eout['weights'])
+    for i, d in enumerate(qdicts):
+        for q,qstr in zip(qvals[:,i],['q50','q16','q84']): d[qstr] = q
 
     if measure_herschel:
-        nfilts = eout['obs']['herschel']['mags'].shape[1]
         qtiles = ['q50','q16','q84','q02.5','q97.5']
-        for quant in qtiles: eout['obs']['herschel'][quant] = np.zeros(nfilts)
-        for i in range(nfilts):
-            for q in qtiles: 
-                eout['obs']['herschel'][q][i] = weighted_quantile(eout['obs']['herschel']['mags'][:,i], \
-                                                    np.array([float(q[1:])/100]), weights=eout['weights'])[0]
+        qvals = prosp_dutils.weighted_quantile_columns(eout['obs']['herschel']['mags'],
+                                                       np.array([float(q[1:])/100 for q in qtiles]), eout['weights'])
+        for i, q in enumerate(qtiles): eout['obs']['herschel'][q] = qvals[i]
     # for storage purposes
     if shorten_spec:
-        spec_pdf = np.zeros(shape=(eout['obs']['lam_obs'].shape[0],3))
-        for jj in xrange(spec_pdf.shape[0]): spec_pdf[jj,:] = weighted_quantile(eout['obs']['spec'][:,jj], np.array([0.5, 0.16, 0.84]), weights=eout['weights'])
-        eout['obs']['spec'] = {'q50':spec_pdf[:,0],'q16':spec_pdf[:,1],'q84':spec_pdf[:,2]}
+        if stream_spec:
+            spec_pdf = spec_stream.quantiles(np.array([0.5, 0.16, 0.84]))
+        else:
+            spec_pdf = prosp_dutils.weighted_quantile_columns(eout['obs']['spec'], np.array([0.5, 0.16, 0.84]), eout['weights'])
+        eout['obs']['spec'] = {'q50':spec_pdf[0],'q16':spec_pdf[1],'q84':spec_pdf[2]}
 
     return eout
 
@@ -295,10 +460,10 @@ def pprocessing_new(param_name, outfile, plot_outfolder=None, plot=True, sps=Non
     # catch exceptions
     if res is None:
         print 'there are no sampling results! returning.'
-        return
+        return 'failed', 'no sampling results'
     if (not overwrite) & (eout is not None):
         print 'post-processing file already exists! returning.'
-        return
+        return 'skipped', 'post-processing file already exists'
 
     # make filenames local...
     objname = outfile.split('/')[-1]
@@ -334,30 +499,49 @@ def pprocessing_new(param_name, outfile, plot_outfolder=None, plot=True, sps=Non
         prosp_dynesty_plots.make_all_plots(filebase=outfile,outfolder=plot_outfolder)
 
 
+def find_obj_outfile(run_outfile, objname, runname=None):
+    """returns the output file base for objname, given the outfile in the
+    run_params of the parameter file. if runname is specified, use the outputs at location runname
+    """
+    if runname is None:
+        runname = run_outfile.split('/')[-2]
+        obj_outfile = "/".join(run_outfile.split('/')[:-1]) + '/' + objname
+    else:
+        obj_outfile = "/".join(run_outfile.split('/')[:-2]) + '/' + runname + '/' + objname
+
+    # account for unique td_huge storage situation
+    if (runname == 'td_huge') | (runname == 'td_new') | (runname == 'td_delta'):
+        field = obj_outfile.split('/')[-1].split('_')[0]
+        obj_outfile = "/".join(obj_outfile.split('/')[:-1])+'/'+field+'/'+obj_outfile.split('/')[-1]
+
+    return obj_outfile
+
+def localize_run_params(run_params):
+    """point the prospector_alpha paths in run_params at this machine's $APPS (in place)
+    """
+    for key in run_params:
+        if type(run_params[key]) == unicode:
+            if 'prospector_alpha' in run_params[key]:
+                run_params[key] = os.getenv('APPS')+'/prospector_alpha'+run_params[key].split('prospector_alpha')[-1]
+    return run_params
+
 def post_processing(param_name, objname=None, runname = None, overwrite=True, obj_outfile=None,
-                    plot_outfolder=None, plot=True, sps=None, **kwargs):
+                    plot_outfolder=None, plot=True, sps=None, checkpoint=False, **kwargs):
     """Driver. Loads output, runs post-processing routine.
     overwrite=False will return immediately if post-processing file already exists.
+    checkpoint=True will periodically save progress next to the post-processing file, and
+    resume from there if the job is restarted.
     if runname is specified, we can pass in parameter file for run with outputs at location runname
     kwargs are passed to calc_extra_quantities
+    returns (status, message), where status is 'success', 'skipped' or 'failed'
     """
 
     # bookkeeping: where are we coming from and where are we going?
     pfile = model_setup.import_module_from_file(param_name)
-    run_outfile = pfile.run_params['outfile']
-
     if obj_outfile is None:
         if runname is None:
-            runname = run_outfile.split('/')[-2]
-            obj_outfile = "/".join(run_outfile.split('/')[:-1]) + '/' + objname
-        else:
-            obj_outfile = "/".join(run_outfile.split('/')[:-2]) + '/' + runname + '/' + objname
-
-        # account for unique td_huge storage situation
-        if (runname == 'td_huge') | (runname == 'td_new') | (runname == 'td_delta'):
-            field = obj_outfile.split('/')[-1].split('_')[0]
-            obj_outfile = "/".join(obj_outfile.split('/')[:-1])+'/'+field+'/'+obj_outfile.split('/')[-1]  
-
+            runname = pfile.run_params['outfile'].split('/')[-2]
+        obj_outfile = find_obj_outfile(pfile.run_params['outfile'], objname, runname=runname)
     if runname is None:
         runname = obj_outfile.split('/')[-2]
 
@@ -373,17 +557,14 @@ def post_processing(param_name, objname=None, runname = None, overwrite=True, ob
 
     if res is None:
         print 'there are no sampling results! returning.'
-        return
+        return 'failed', 'no sampling results'
     if (not overwrite) & (eout is not None):
         print 'post-processing file already exists! returning.'
-        return
+        return 'skipped', 'post-processing file already exists'
 
     # make filenames local...
     print 'Performing post-processing on ' + objname
-    for key in res['run_params']:
-        if type(res['run_params'][key]) == unicode:
-            if 'prospector_alpha' in res['run_params'][key]:
-                res['run_params'][key] = os.getenv('APPS')+'/prospector_alpha'+res['run_params'][key].split('prospector_alpha')[-1]
+    localize_run_params(res['run_params'])
     if sps is None:
         sps = pfile.load_sps(**res['run_params'])
     obs = res['obs']
@@ -399,26 +580,119 @@ def post_processing(param_name, objname=None, runname = None, overwrite=True, ob
     res['weights'] = res['weights'] / res['weights'].sum()
 
     # sample from chain
+    _, extra_filename = create_prosp_filename(obj_outfile,postprocessing=True)
+    if checkpoint:
+        kwargs['checkpoint'] = extra_filename+'.ckpt'
     extra_output = calc_extra_quantities(res,sps,obs,**kwargs)
 
-    # create post-processing name, dump info
-    _, extra_filename = create_prosp_filename(obj_outfile,postprocessing=True)
+    # dump info, clean up checkpoint
     hickle.dump(extra_output,open(extra_filename, "w"))
+    if checkpoint:
+        os.remove(kwargs['checkpoint'])
 
     # make standard plots
     if plot:
         prosp_dynesty_plots.make_all_plots(filebase=obj_outfile,outfolder=plot_outfolder)
 
+    return 'success', ''
 
-def do_all(param_name=None,runname=None,ids=None,**kwargs):
+def load_ids(runname):
+    """returns the list of object names for runname, either from the .ids file
+    or from the h5 files in the results folder
+    """
     try:
         ids = np.genfromtxt('/Users/joel/code/python/prospector_alpha/data/3dhst/'+runname+'.ids',dtype=str)
     except:
         import glob
         ids = [f.split('/')[-1].split('_')[0] for f in glob.glob('/Users/joel/code/python/prospector_alpha/results/'+runname+'/*h5')]
+    return ids
+
+def do_all(param_name=None,runname=None,ids=None,**kwargs):
+    ids = load_ids(runname)
     for id in ids:
         post_processing(param_name, objname=id, **kwargs)
-        
+
+def post_processing_is_current(obj_outfile):
+    """True if the post-processing file exists and is newer than the sampling file
+    """
+    mcmc_filename, postname = create_prosp_filename(obj_outfile,postprocessing=True)
+    if (mcmc_filename is None) or (not os.path.isfile(postname)):
+        return False
+    return os.path.getmtime(postname) >= os.path.getmtime(mcmc_filename)
+
+# each worker keeps one SPS per parameter file + SPS settings of the fits, so FSPS is only
+# initialized once per process
+_worker_sps = {}
+_sps_run_params = ['zcontinuous', 'compute_vega_mags', 'vactoair_flag', 'interp_type', 'reserved_params']
+
+def worker_sps(param_name, pfile, obj_outfile):
+    """the SPS for this object, built from the run_params of the fit (as post_processing does)
+    the first time these SPS settings are seen, and reused after that
+    """
+    res, _, _, _ = load_prospector_data(obj_outfile, postprocessing=True, lazy=True)
+    if res is None:
+        return None
+    run_params = localize_run_params(res['run_params'])
+    res.close()
+
+    key = (param_name,) + tuple(repr(run_params.get(par)) for par in _sps_run_params)
+    if key not in _worker_sps:
+        _worker_sps[key] = pfile.load_sps(**run_params)
+    return _worker_sps[key]
+
+def _pprocess_one(args):
+    """worker for do_all_parallel. returns (objname, status, runtime, message)
+    """
+    param_name, objname, kwargs = args
+    t1 = time.time()
+    try:
+        pfile = model_setup.import_module_from_file(param_name)
+        obj_outfile = find_obj_outfile(pfile.run_params['outfile'], objname, runname=kwargs.get('runname',None))
+        if (not kwargs.get('overwrite_current',False)) and post_processing_is_current(obj_outfile):
+            return objname, 'skipped', time.time()-t1, 'post-processing file is newer than sampling file'
+        sps = worker_sps(param_name, pfile, obj_outfile)
+        status, message = post_processing(param_name, objname=objname, obj_outfile=obj_outfile, sps=sps,
+                                           **{key: kwargs[key] for key in kwargs if key != 'overwrite_current'})
+    except Exception as e:
+        return objname, 'failed', time.time()-t1, repr(e).replace('\n',' ')
+    return objname, status, time.time()-t1, message
+
+def do_all_parallel(param_name=None,runname=None,ids=None,nproc=None,manifest=None,overwrite_current=False,**kwargs):
+    """post-process many objects with a pool of nproc worker processes (default: all cores).
+    each worker builds one SPS per parameter file (and SPS settings of the fits) and reuses it
+    for all of its objects.
+    objects whose post-processing file is newer than the sampling file are skipped,
+    unless overwrite_current is set.
+    a manifest of (objname, status, runtime, message) is written to manifest, one line per object
+    as they complete, so it is useful even if the job dies.
+    kwargs are passed to post_processing
+    """
+    from multiprocessing import Pool
+
+    if runname is None:
+        pfile = model_setup.import_module_from_file(param_name)
+        runname = pfile.run_params['outfile'].split('/')[-2]
+    if ids is None:
+        ids = load_ids(runname)
+    if manifest is None:
+        manifest = os.getenv('APPS')+'/prospector_alpha/results/'+runname+'_postprocessing_manifest.txt'
+    kwargs['runname'] = runname
+    kwargs['overwrite_current'] = overwrite_current
+    kwargs['plot'] = kwargs.get('plot',False)
+
+    pool = Pool(processes=nproc)
+    tasks = [(param_name, id, kwargs) for id in ids]
+    nfail = 0
+    with open(manifest, 'w') as f:
+        f.write('# objname status runtime message\n')
+        for objname, status, runtime, message in pool.imap_unordered(_pprocess_one, tasks):
+            f.write('{0} {1} {2:.1f} {3}\n'.format(objname, status, runtime, message))
+            f.flush()
+            nfail += (status == 'failed')
+    pool.close()
+    pool.join()
+    print 'finished {0} objects, {1} failures. manifest in {2}'.format(len(tasks),nfail,manifest)
+
 def str2bool(v):
     if v.lower() in ('yes', 'true', 't', 'y', '1'):
         return True
@@ -434,19 +708,28 @@ if __name__ == "__main__":
     parser.add_argument('--ncalc',type=int)
     parser.add_argument('--overwrite',type=str2bool)
     parser.add_argument('--shorten_spec',type=str2bool)
+    parser.add_argument('--stream_spec',type=str2bool)
     parser.add_argument('--runname', type=str)
     parser.add_argument('--obj_outfile', type=str)
     parser.add_argument('--plot',type=str2bool)
     parser.add_argument('--measure_herschel',type=str2bool)
     parser.add_argument('--measure_abslines',type=str2bool)
     parser.add_argument('--new_prosp',type=str2bool)
+    parser.add_argument('--batch_sfh',type=str2bool)
+    parser.add_argument('--checkpoint',type=str2bool)
+    parser.add_argument('--checkpoint_interval',type=int)
+    parser.add_argument('--do_all',type=str2bool)
+    parser.add_argument('--nproc',type=int)
+    parser.add_argument('--manifest', type=str)
 
     args = vars(parser.parse_args())
     kwargs = {}
     for key in args.keys(): kwargs[key] = args[key]
 
     print kwargs
-    if kwargs.get('new_prosp',False):
+    if kwargs.pop('do_all',False):
+        do_all_parallel(kwargs.pop('parfile'),**kwargs)
+    elif kwargs.get('new_prosp',False):
         pprocessing_new(kwargs['parfile'], kwargs['obj_outfile'],**kwargs)
     else:
         post_processing(kwargs['parfile'],**kwargs)
@@ -0,0 +1,224 @@
+""" caches for quantities which are fixed over a fit (filters, redshift),
+used inside the SPS objects defined in the parameter files
+"""
+import numpy as np
+from collections import OrderedDict
+
+_nebline_matrices = OrderedDict()
+_nebline_cache_size = 32
+
+def nebline_filter_matrix(filters, emline_wavelengths, z):
+    """ (nfilter, nline) matrix of filter transmission * observed wavelength / ab_zero_counts
+    at each emission line, so that the line contribution to the photometry is
+    np.dot(matrix, line luminosities). cached on (filter names, zred, line list).
+    """
+    emline_wavelengths = np.asarray(emline_wavelengths, dtype=float)
+    key = (tuple(filt.name for filt in filters), float(np.squeeze(z)), emline_wavelengths.tobytes())
+    if key in _nebline_matrices:
+        _nebline_matrices[key] = _nebline_matrices.pop(key)
+        return _nebline_matrices[key]
+
+    emlams = emline_wavelengths * (1+float(np.squeeze(z)))
+    matrix = np.zeros((len(filters), emlams.shape[0]))
+    for i,filt in enumerate(filters):
+        trans = np.interp(emlams, filt.wavelength, filt.transmission, left=0., right=0.)
+        matrix[i,:] = trans*emlams/filt.ab_zero_counts
+
+    _nebline_matrices[key] = matrix
+    if len(_nebline_matrices) > _nebline_cache_size:
+        _nebline_matrices.popitem(last=False)
+
+    return matrix
+
+_phot_matrices = OrderedDict()
+_phot_cache_size = 32
+
+def photometry_matrix(filters, wave):
+    """ sparse (nfilter, nwave) operator which takes an observed-frame spectrum
+    (erg/s/cm^2/AA, on wave) to maggies, so that the photometry is one mat-vec.
+    each row holds the trapezoidal weights * wave * transmission / ab_zero_counts,
+    i.e. exactly the sum done in sedpy's Filter.obj_counts.
+    filters which do not overlap wave have an empty row, and are flagged in
+    matrix.no_overlap (getSED returns NaN for these).
+    cached on (filter names, wavelength grid); since wave is the redshifted grid,
+    this is fixed over a fit.
+    """
+    wave = np.asarray(wave, dtype=float)
+    key = (tuple(filt.name for filt in filters), wave.shape[0], hash(wave.tobytes()))
+    if key in _phot_matrices:
+        _phot_matrices[key] = _phot_matrices.pop(key)
+        return _phot_matrices[key]
+
+    from scipy.sparse import csr_matrix
+
+    # trapezoidal weights
+    dw = np.diff(wave)
+    weights = np.zeros_like(wave)
+    weights[:-1] += dw/2.
+    weights[1:] += dw/2.
+
+    rows, cols, vals = [], [], []
+    no_overlap = np.zeros(len(filters), dtype=bool)
+    for i,filt in enumerate(filters):
+        trans = np.interp(wave, filt.wavelength, filt.transmission, left=0., right=0.)
+        idx = np.where(trans > 0)[0]
+        no_overlap[i] = (idx.size == 0)
+        rows.append(np.full(idx.size, i, dtype=int))
+        cols.append(idx)
+        vals.append(trans[idx]*wave[idx]*weights[idx]/filt.ab_zero_counts)
+
+    matrix = csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                        shape=(len(filters), wave.shape[0]))
+    matrix.no_overlap = no_overlap
+
+    _phot_matrices[key] = matrix
+    if len(_phot_matrices) > _phot_cache_size:
+        _phot_matrices.popitem(last=False)
+
+    return matrix
+
+def observed_photometry(wave, spec, filters):
+    """ drop-in replacement for 10**(-0.4*observate.getSED(wave, spec, filters)):
+    maggies in each filter for an observed-frame spectrum in erg/s/cm^2/AA.
+    spec can be (nwave,) or a batch (nspec, nwave), giving (nfilter,) or (nspec, nfilter).
+    agrees with getSED to floating-point precision (fractional differences < 1e-10).
+    """
+    matrix = photometry_matrix(filters, wave)
+    spec = np.asarray(spec, dtype=float)
+    maggies = matrix.dot(spec.T).T
+    maggies[..., matrix.no_overlap] = np.nan
+
+    return maggies
+
+class SpectrumCacheMixin(object):
+    """ mixin for the FastStepBasis subclasses in the parameter files, with two optional
+    caches for nonparametric SFHs. both are off by default.
+
+    cache_spectra = True memoizes the restframe galaxy spectrum (with its stellar mass, Lbol
+    and emission-line luminosities) in a bounded LRU, keyed on the bin masses, agebins and
+    FSPS parameters. re-evaluating the same physical spectrum -- e.g. the same draw at
+    zred=0, or through a different filter set -- then skips FSPS; redshifting, smoothing
+    and photometry are redone from the cached spectrum. hits and misses are counted in
+    sps.cache_stats.
+
+    cache_bins = True composes the spectrum as a mass-weighted sum of the unit-mass spectra
+    of each age bin, which are calculated with FSPS once per set of non-SFH parameters
+    (dust, metallicity, ...). the tabular-SFH spectrum is linear in the bin masses, so this
+    agrees with the tabular path to FSPS's (single-precision) arithmetic, ~1e-6 fractional.
+    it only pays off when many evaluations share the non-SFH parameters, since a cache miss
+    costs one FSPS call per bin.
+
+    light-weighted ages (compute_light_ages) are not linear in the bin masses, and need the
+    FSPS state afterwards, so they always go through the tabular path.
+
+    after a model call, read the bolometric and emission-line luminosities from
+    sps.log_lbol and sps.emline_luminosity (not sps.ssp), which are right in all modes.
+    """
+    cache_spectra = False
+    cache_bins = False
+    spectrum_cache_size = 32
+    bin_cache_size = 8
+    _lums = None
+
+    def get_galaxy_spectrum(self, **params):
+        self.update(**params)
+        return self.galaxy_spectrum(self.params['mass'])
+
+    def galaxy_spectrum(self, mass):
+        """ same outputs as FastStepBasis.get_galaxy_spectrum, for bin masses formed `mass`:
+        wave, spectrum per solar mass formed, surviving stellar mass fraction
+        """
+        self._lums = None
+        mass = np.asarray(mass, dtype=float)
+        if (not (self.cache_spectra or self.cache_bins)) or self.ssp.params['compute_light_ages']:
+            return self._tabular_spectrum(mass)
+
+        if not hasattr(self, '_spectra'):
+            self._spectra, self._bin_bases = OrderedDict(), OrderedDict()
+            self.cache_stats = {'hits': 0, 'misses': 0}
+        key = self._cache_key()
+
+        if self.cache_spectra:
+            mkey = (mass.tobytes(),) + key
+            if mkey in self._spectra:
+                self.cache_stats['hits'] += 1
+                self._spectra[mkey] = self._spectra.pop(mkey)
+                out, self._lums = self._spectra[mkey]
+                return out
+            self.cache_stats['misses'] += 1
+
+        if self.cache_bins:
+            out = self._binned_spectrum(mass, key)
+        else:
+            out = self._tabular_spectrum(mass)
+            self._lums = {'log_lbol': self.ssp.log_lbol,
+                          'emline_luminosity': np.array(self.ssp.emline_luminosity)}
+
+        if self.cache_spectra:
+            self._spectra[mkey] = (out, self._lums)
+            if len(self._spectra) > self.spectrum_cache_size:
+                self._spectra.popitem(last=False)
+
+        return out
+
+    def _cache_key(self):
+        """ everything except the bin masses which sets the spectrum
+        """
+        return ((np.asarray(self.params['agebins'], dtype=float).tobytes(),) +
+                tuple((k, np.asarray(self.ssp.params[k]).tobytes())
+                      for k in self.ssp.params.all_params if k not in ('sfh','tage')))
+
+    def _tabular_spectrum(self, mass):
+        mtot = mass.sum()
+        time, sfr, tmax = self.convert_sfh(self.params['agebins'], mass)
+        self.ssp.params['sfh'] = 3
+        self.ssp.set_tabular_sfh(time, sfr)
+        wave, spec = self.ssp.get_spectrum(tage=tmax, peraa=False)
+
+        return wave, spec / mtot, self.ssp.stellar_mass / mtot
+
+    def _bin_basis(self, key):
+        """ (wave, spectra, stellar mass, lbol, emission-line luminosities) for 1 Msun formed
+        in each age bin
+        """
+        if key in self._bin_bases:
+            self._bin_bases[key] = self._bin_bases.pop(key)
+            return self._bin_bases[key]
+
+        nbin = self.params['agebins'].shape[0]
+        spectra, smass, lbol, elum = [], [], [], []
+        for i in range(nbin):
+            unit_mass = np.zeros(nbin)
+            unit_mass[i] = 1.0
+            wave, spec, mfrac = self._tabular_spectrum(unit_mass)
+            spectra.append(spec)
+            smass.append(mfrac)
+            lbol.append(10**self.ssp.log_lbol)
+            elum.append(np.array(self.ssp.emline_luminosity))
+        basis = (wave, np.array(spectra), np.array(smass), np.array(lbol), np.array(elum))
+
+        self._bin_bases[key] = basis
+        if len(self._bin_bases) > self.bin_cache_size:
+            self._bin_bases.popitem(last=False)
+
+        return basis
+
+    def _binned_spectrum(self, mass, key):
+        wave, spectra, smass, lbol, elum = self._bin_basis(key)
+        mtot = mass.sum()
+        self._lums = {'log_lbol': np.log10(np.dot(mass, lbol)),
+                      'emline_luminosity': np.dot(mass, elum)}
+
+        return wave, np.dot(mass, spectra) / mtot, np.dot(mass, smass) / mtot
+
+    @property
+    def log_lbol(self):
+        if self._lums is not None:
+            return self._lums['log_lbol']
+        return self.ssp.log_lbol
+
+    @property
+    def emline_luminosity(self):
+        if self._lums is not None:
+            return self._lums['emline_luminosity']
+        return self.ssp.emline_luminosity
@@ -2,16 +2,17 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os, hickle, pickle, prosp_dutils
 from prospector_io import load_prospector_data
-from astropy.cosmology import WMAP9
+from prospector_store import load_run_store
+from cosmo_tables import age_of_universe
 from matplotlib.ticker import  FormatStrFormatter
 from dynesty.plotting import _quantile as weighted_quantile
 from collections import OrderedDict
 import td_delta_params as pfile
+from nonpar_sfh import agebins_from_redshift
 from plot_sample_selection import mass_completeness
 from integrate_sfrd import mf_phi, mf_parameters, load_zfourge_mf
 from td_io import load_fast
 from scipy.ndimage import gaussian_filter as norm_kde
-from astropy.convolution import convolve
 from scipy.interpolate import interp2d
 from scipy.io import readsav
 
@@ -105,7 +106,7 @@ def stack_sfh_fast_dm(dat,**opts):
         nmass = stack[z]['mvec'].shape[0]
 
         # generate output containers for median
-        tbins = np.linspace(0,WMAP9.age(zfloat).value*1e9, nt)
+        tbins = np.linspace(0,age_of_universe(zfloat)*1e9, nt)
         stack[z]['tbins'] = tbins
         stack[z]['sfr_med'] = np.zeros(shape=(nmass,nt)) 
 
@@ -148,7 +149,7 @@ def stack_sfh_fast_dm(dat,**opts):
 
             # weight by (t_univ(z=zgal) / t_univ(z=z_min)) to account for variation in t_univ
             # i.e. all galaxies in a given stack should have the same average sSFR
-            ssfr *= WMAP9.age(fdict['zred']).value*1e9/tbins.max()
+            ssfr *= age_of_universe(fdict['zred'])*1e9/tbins.max()
 
             # calculate median, smooth, then normalize
             median = np.median(ssfr,axis=1)
@@ -162,7 +163,7 @@ def stack_sfh_fast_dm(dat,**opts):
             for j, idx in enumerate(zidx):
 
                 # integrate all SFHs from 0 to dt to get high-res mass kernel
-                dt = (WMAP9.age(zfloat).value - WMAP9.age(opts['mf_z_mid'][idx]).value)*1e9
+                dt = (age_of_universe(zfloat) - age_of_universe(opts['mf_z_mid'][idx]))*1e9
                 t_integrate = np.clip(age-dt,0,np.inf)
                 masses = exp_sfr_t_integral(age,tau,t_integrate)
 
@@ -178,29 +179,28 @@ def stack_sfh_fast_dm(dat,**opts):
 
     return stack,fdict_full
 
-def stack_sfh_dm(data,fdict,nt=None, **opts):
+def stack_sfh_dm(data,fdict,nt=None,chunk_size=100, **opts):
     """stack in dM in narrow redshift bins
+    the sSFR and mass-kernel PDFs for all mass bins are accumulated in one pass over
+    the galaxies, streamed in blocks of chunk_size to bound memory
     """
 
     # generate output container
     stack = {str(z):{} for z in opts['zstart']}
     data['zred'] = np.array(data['zred'])
-    nsamps = 3000 # number of samples in posterior files
 
     ssfrmin, ssfrmax, nssfr = -14, -7.5, 201 # intermediate interpolation onto regular sSFR grid
     ssfr_arr = 10**np.linspace(ssfrmin,ssfrmax,nssfr)
     ssfr_mid = (ssfr_arr[1:]+ssfr_arr[:-1])/2.
     stack['ssfr_arr'] = ssfr_arr
+    mchange_bins = opts['xkernel_edge']
 
     for zfloat in opts['zstart']:
 
         # load time bins at central redshift
         z = str(zfloat)
-        pfile.run_params['zred'] = zfloat
-        mod = pfile.load_model(**pfile.run_params)
-        stack[z]['agebins'] = mod.params['agebins']
+        stack[z]['agebins'] = agebins_from_redshift(zfloat, pfile.run_params['agelims'], pfile.run_params['nbins_sfh'])
         nt = stack[z]['agebins'].shape[0]
-        tbins = np.mean(10**stack[z]['agebins'], axis=1)/1e9
         agediff = np.diff(10**stack[z]['agebins'],axis=1).flatten()
         agebins = 10**stack[z]['agebins']
 
@@ -209,22 +209,19 @@ def stack_sfh_dm(data,fdict,nt=None, **opts):
         mcomplete = mass_completeness(zfloat+opts['dz'])
         stack[z]['mvec'] = np.arange(mcomplete,opts['high_mass_cutoff'],opts['dm'])
         nmass = stack[z]['mvec'].shape[0]
-        for name in ['sfr_med', 'sfr_eup', 'sfr_edo']: stack[z][name] = np.zeros(shape=(nmass,nt))
-        stack[z]['full_pdf'] = np.zeros(shape=(nmass,nt,nssfr-1))
 
-        # generate output containers for kernel
+        # time integrated over each SFH bin between 0 and dt, for each kernel redshift
+        # full bins contribute their width, the bin containing dt contributes dt - t_start
+        # output is (NZ,NBINS)
         zidx = np.where(opts['mf_z_mid'] > zfloat)[0]
-        nz = zidx.shape[0]
-        stack[z]['kernel'] = np.zeros(shape=(opts['nkernel'],nmass,nz))
+        dt = (age_of_universe(zfloat) - age_of_universe(opts['mf_z_mid'][zidx]))*1e9
+        t_multiply = np.clip(np.atleast_1d(dt)[:,None] - agebins[None,:,0], 0, agediff[None,:])
 
-        # for each bin in mass, stack SFH
+        # define galaxies in each redshift/mass bin
+        # use FAST mass for this selection
+        gal_idx, gal_zred, gal_group = [], [], []
         for i, mass in enumerate(stack[z]['mvec']):
-
-            # bookkeeping
             print 'z={0}+/-{1}, m={2}-{3}'.format(z,opts['dz'],mass,mass+opts['dm'])
-
-            # define galaxies in redshift/mass bin
-            # use FAST mass for this selection
             fmatches = np.where((np.abs(np.array(fdict[z]['zred'])-zfloat) < opts['dz']) & (np.abs(fdict[z]['mass']-mass+opts['dm']/2.) < opts['dm']/2.))[0]
             ids = np.array(fdict[z]['id'])[fmatches]
             indexes = np.where(np.in1d(data['objname'],ids))[0]
@@ -232,73 +229,54 @@ def stack_sfh_dm(data,fdict,nt=None, **opts):
             # measure redshifts for matches
             # go backwards
             f_idx = np.in1d(ids,np.array(data['objname'])[indexes])
-            zred = (np.array(fdict[z]['zred'])[fmatches])[f_idx]
-
-            # calculate (SFR / M) chains assuming central redshift
-            # return sSFR(NSAMPLE,NBINS,NGAL) vector with WEIGHTS(NSAMPLE,NGAL)
-            ngal = indexes.shape[0]
-            print '\t{0} galaxies in bin'.format(ngal)
-            ssfr,weights = np.empty(shape=(nsamps,nt,ngal)), np.empty(shape=(nsamps,ngal))
-
-            for m, idx in enumerate(indexes):
-
-                # calculate time weighting
-                pfile.run_params['zred'] = zred[m]
-                mod = pfile.load_model(**pfile.run_params)
-                t_factor = agediff / np.diff(10**mod.params['agebins'],axis=1).flatten()
-                sfh = data['ssfh'][idx]
-                ssfr[:,:,m] = sfh[:,::2] * t_factor
-                weights[:,m] = data['weights'][idx]
-
-            # now create stacked sSFR
-            # this returns weighted sSFR median + quantiles for each bin
-            for j in range(nt):
-                # construct empty sSFR PDF and determine which galaxies contribute
-                in_samp = np.where(np.isfinite(ssfr[0,j,:]))[0]
-                hist = np.zeros(shape=ssfr_arr.shape[0]-1)
-
-                # for each object in sample, add to sSFR PDF
-                for idx in in_samp:
-                    ssfr_in_hist = np.clip(ssfr[:,j,idx],10**ssfrmin,10**ssfrmax)
-                    g1,_ = np.histogram(ssfr_in_hist, density=False,weights=weights[:,idx], bins=ssfr_arr)
-                    hist += g1
-
-                # calculate weighted quantiles from sSFR PDF at fixed time
-                median, errup, errdown = weighted_quantile(ssfr_mid, [0.5,.84,.16],weights=hist)
-
-                stack[z]['sfr_med'][i,j] = median
-                stack[z]['sfr_eup'][i,j] = errup
-                stack[z]['sfr_edo'][i,j] = errdown
-                stack[z]['full_pdf'][i,j,:] = hist
-
-            # normalize
-            norm = (stack[z]['sfr_med'][i,:]*agediff).sum()
-            stack[z]['sfr_med'][i,:] /= norm
-            stack[z]['sfr_eup'][i,:] /= norm
-            stack[z]['sfr_edo'][i,:] /= norm
-
-            # also use all SFHs to generate convolution kernel
-            for j, idx in enumerate(zidx):
-
-                # integrate SFHs from 0 to dt to get high-res mass kernel
-                # use sSFR(NSAMPLE,NBINS,NGAL) vector with WEIGHTS(NSAMPLE,NGAL)
-                dt = (WMAP9.age(zfloat).value - WMAP9.age(opts['mf_z_mid'][idx]).value)*1e9
-                
-                # first figure out which bins are contributing, and calculate time vectors
-                idx_sfr = (agebins < dt)
-                full_idx, partial_idx = idx_sfr.sum(axis=1) == 2, idx_sfr.sum(axis=1) == 1
-                partial_tvec = dt - agebins[partial_idx,0]
-                t_multiply = np.concatenate((agediff[full_idx],np.atleast_1d(partial_tvec)))
-
-                # now multiply sSFR values by time grids, and sum
-                # output should be (NSAMPLE,NGAL)
-                mfrac_matrix = ssfr[:,full_idx | partial_idx, :] * t_multiply[None, :, None]
-                mfrac = mfrac_matrix.sum(axis=1)
-                mchange_dex = np.clip(np.log10(1-np.clip(mfrac,0,1-1e-9)),opts['xkernel_edge'][0]+1e-6,opts['xkernel_edge'][-1]-1e-6)
-
-                # create kernel with a weighted histogram
-                mchange_bins = opts['xkernel_edge']
-                stack[z]['kernel'][:,i,j], _ = np.histogram(mchange_dex.flatten(), bins=mchange_bins, weights=weights.flatten(),density=True)
+            gal_zred.append((np.array(fdict[z]['zred'])[fmatches])[f_idx])
+            gal_idx.append(indexes)
+            gal_group.append(np.full(indexes.shape[0], i, dtype=int))
+            print '\t{0} galaxies in bin'.format(indexes.shape[0])
+        gal_idx, gal_zred, gal_group = np.concatenate(gal_idx), np.concatenate(gal_zred), np.concatenate(gal_group)
+
+        # time weighting for all galaxies at once: (NGAL,NBINS)
+        gal_agebins = agebins_from_redshift(gal_zred, pfile.run_params['agelims'], pfile.run_params['nbins_sfh'])
+        t_factor = agediff / np.diff(10**gal_agebins,axis=-1)[...,0]
+
+        def ssfr_chunks():
+            """ (SFR / M) chains assuming central redshift, sSFR(NGAL,NSAMPLE,NBINS) with
+            WEIGHTS(NGAL,NSAMPLE), for chunk_size galaxies at a time
+            """
+            for start in range(0, gal_idx.shape[0], chunk_size):
+                sl = slice(start, start+chunk_size)
+                ssfr = np.array([data['ssfh'][idx][:,::2] for idx in gal_idx[sl]]) * t_factor[sl,None,:]
+                weights = np.array([data['weights'][idx] for idx in gal_idx[sl]])
+                yield ssfr, weights, gal_group[sl]
+
+        def kernel_chunks():
+            """ integrate SFHs from 0 to dt to get high-res mass kernel, (NGAL,NSAMPLE,NZ)
+            """
+            for ssfr, weights, group in ssfr_chunks():
+                finite = np.isfinite(ssfr)
+                mfrac = np.dot(np.where(finite, ssfr, 0.0), t_multiply.T)
+                mfrac[np.dot(~finite, (t_multiply > 0).T)] = np.nan
+                mchange_dex = np.clip(np.log10(1-np.clip(mfrac,0,1-1e-9)),mchange_bins[0]+1e-6,mchange_bins[-1]-1e-6)
+                yield mchange_dex, weights, group
+
+        # now create stacked sSFR
+        # this returns weighted sSFR median + quantiles for each (mass, time) bin
+        hist = prosp_dutils.stack_histograms(ssfr_chunks(), ssfr_arr, nmass, ncol=nt)
+        qtiles = prosp_dutils.histogram_quantiles(ssfr_mid, hist, [0.5,.84,.16])
+        stack[z]['full_pdf'] = hist
+
+        # normalize
+        norm = (qtiles[:,:,0]*agediff).sum(axis=1)[:,None]
+        stack[z]['sfr_med'] = qtiles[:,:,0] / norm
+        stack[z]['sfr_eup'] = qtiles[:,:,1] / norm
+        stack[z]['sfr_edo'] = qtiles[:,:,2] / norm
+
+        # also use all SFHs to generate convolution kernel
+        # weighted histogram, normalized to a density
+        khist = prosp_dutils.stack_histograms(kernel_chunks(), mchange_bins, nmass, ncol=zidx.shape[0])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            khist /= khist.sum(axis=-1)[:,:,None] * np.diff(mchange_bins)
+        stack[z]['kernel'] = np.transpose(khist, (2,0,1))
 
     return stack
 
@@ -385,12 +363,13 @@ def apply_mergers_to_mf(mass,ndens,z1,z2):
     # modify number density and mass accordingly
     ngrid_z = 20
     zgrid = np.linspace(z1,z2,ngrid_z+1)
+    dts = -np.diff(age_of_universe(zgrid))
 
     growth, destruction = np.zeros(nmass), np.ones(nmass)
     for i in range(ngrid_z):
         zcenter = (zgrid[i]+zgrid[i+1])/2.
         
-        dt = (WMAP9.age(zgrid[i]) - WMAP9.age(zgrid[i+1])).value
+        dt = dts[i]
         growth += (10**grate(zcenter,mass).flatten())*dt*1e9
         destruction *= (1-drate(zcenter,mass).flatten()*dt)
 
@@ -399,6 +378,42 @@ def apply_mergers_to_mf(mass,ndens,z1,z2):
 
     return ndens_out,mass_out
 
+def mf_transfer_matrices(kernel, smoothing=None):
+    """turn stacked mass-change kernels into linear operators on the mass function.
+    kernel is (..., NKERNEL, NMASS, NZ) as stored by the stacks (kernel pixels are dM wide,
+    centered on zero), optionally smoothed in mass by a gaussian of width `smoothing` bins.
+    returns T (..., NZ, NMASS, NMASS), where T[...,j,:,k] is the normalized kernel of mass
+    bin k shifted to be centered on k, so that the MF evolved over window j is T[...,j,:,:].dot(ndens).
+    this is the same as summing the convolution of each one-hot mass bin with its kernel
+    (zero-filled edges, so that mass leaving the grid is lost). mass bins whose kernel is empty
+    (e.g. no galaxies were stacked there) get a zero column, i.e. they contribute nothing.
+    """
+    kernel = np.asarray(kernel, dtype=float)
+    nkernel, nmass = kernel.shape[-3], kernel.shape[-2]
+    if smoothing is not None:
+        sigma = [0]*kernel.ndim
+        sigma[-2] = smoothing
+        kernel = norm_kde(kernel, sigma, mode='nearest')
+
+    # (..., NZ, NMASS, NKERNEL), normalized, with empty kernels left at zero
+    kernel = np.swapaxes(kernel, -3, -1)
+    norm = kernel.sum(axis=-1)[...,None]
+    kernel = kernel / np.where(norm > 0, norm, 1.0)
+
+    # kernel pixel which moves mass from bin k into bin i
+    out_idx, in_idx = np.meshgrid(np.arange(nmass), np.arange(nmass), indexing='ij')
+    kidx = out_idx - in_idx + nkernel//2
+    valid = (kidx >= 0) & (kidx < nkernel)
+
+    return np.where(valid, kernel[...,in_idx,np.clip(kidx,0,nkernel-1)], 0.0)
+
+def evolve_mf(transfer, ndens):
+    """apply transfer matrices (..., NMASS, NMASS) to mass functions ndens (..., NMASS),
+    in linear number density, e.g. all windows to many bootstrap realizations at once:
+    evolve_mf(T, ndens[:,None,:]) with T (NZ,NMASS,NMASS), ndens (NREAL,NMASS) -> (NREAL,NZ,NMASS)
+    """
+    return np.matmul(transfer, np.asarray(ndens, dtype=float)[...,None])[...,0]
+
 def evolve_mf_backwards(dat,fdat,outfolder,mf,mf_z,use_median=False,smooth_kernels=True,apply_mergers=True,**opts):
     """includes effects of scatter in SFHs, and a simple merger model
     """
@@ -433,6 +448,12 @@ def evolve_mf_backwards(dat,fdat,outfolder,mf,mf_z,use_median=False,smooth_kerne
         # units of SFR / Mpc^-3 / dex
         ndens_start = np.log10(mf_phi(mf_parameters(zfloat),central_mass))
 
+        # transfer matrices for all prediction windows at once
+        # smooth the kernels?
+        ksmooth = smoothing if smooth_kernels else None
+        transfer = mf_transfer_matrices(dat[z]['kernel'], smoothing=ksmooth)
+        transfer_fast = mf_transfer_matrices(fdat[z]['kernel'], smoothing=ksmooth)
+
         # extract mean and PDF for sSFR
         median_ssfr = dat[z]['sfr_med']
         median_ssfr_fast = fdat[z]['sfr_med']
@@ -446,7 +467,7 @@ def evolve_mf_backwards(dat,fdat,outfolder,mf,mf_z,use_median=False,smooth_kerne
             ax = axes[j,i+(nz_window-predict_idx.shape[0])]
 
             # calculate and display delta(t)
-            dt = (WMAP9.age(zfloat).value - WMAP9.age(opts['mf_z_mid'][idx]).value)*1e9
+            dt = (age_of_universe(zfloat) - age_of_universe(opts['mf_z_mid'][idx]))*1e9
             if np.log10(dt) > 9:
                 dt_display = "{0:.1f}".format(dt/1e9)+' Gyr'
             else:
@@ -473,24 +494,9 @@ def evolve_mf_backwards(dat,fdat,outfolder,mf,mf_z,use_median=False,smooth_kerne
                 mplot = np.log10(10**central_mass*(1-mdiff))
                 ndens_plot = ndens_start
             else:  
-                # the hard way. we convolve the MF with the growth kernels.
-                # smooth the kernels?
-                kernel = dat[z]['kernel'][:,:,i]
-                skernel = kernel.copy()
-                if smooth_kernels:
-                    skernel = np.zeros(shape=(nmass,opts['nkernel']))
-                    for k in range(opts['nkernel']): skernel[:,k] = norm_kde(kernel[k,:],smoothing,mode='nearest')
-
-                # convolve mass function by mass-dependent kernel
-                ndens = 10**ndens_start.copy()
-                ndens_out = np.zeros_like(ndens)
-                for k in range(nmass): 
-                    ndens_convolve = np.zeros(nmass)
-                    ndens_convolve[k] = ndens[k]
-                    ndens_out += convolve(ndens_convolve,skernel[k,:],normalize_kernel=True)
-                
-                # set plotting quantities
-                ndens_plot = np.log10(ndens_out)
+                # the hard way. we convolve the MF with the growth kernels,
+                # i.e. multiply by the (banded) transfer matrix
+                ndens_plot = np.log10(evolve_mf(transfer[i], 10**ndens_start))
                 mplot = central_mass
 
             # calculate predictions for FAST
@@ -499,23 +505,8 @@ def evolve_mf_backwards(dat,fdat,outfolder,mf,mf_z,use_median=False,smooth_kerne
                 mplot_fast = np.log10(10**central_mass*(1-mdiff_fast))
                 ndens_plot_fast = ndens_start
             else:
-                # smooth kernels?
-                kernel = fdat[z]['kernel'][:,:,i]
-                if smooth_kernels:
-                    skernel = np.zeros(shape=(nmass,opts['nkernel']))
-                    for k in range(opts['nkernel']): skernel[:,k] = norm_kde(kernel[k,:],smoothing,mode='nearest')
-                else:
-                    skernel = kernel.copy()
-
-                # convolve mass function by mass-dependent kernel
-                ndens_out = np.zeros_like(ndens)
-                for k in range(nmass): 
-                    ndens_convolve = np.zeros(nmass)
-                    ndens_convolve[k] = ndens[k]
-                    ndens_out += convolve(ndens_convolve,skernel[k,:]/skernel[k,:].sum(),normalize_kernel=True)
-
                 mplot_fast = central_mass
-                ndens_plot_fast = np.log10(ndens_out)
+                ndens_plot_fast = np.log10(evolve_mf(transfer_fast[i], 10**ndens_start))
 
             if apply_mergers:
                 ndens_plot, mplot = apply_mergers_to_mf(mplot,ndens_plot,zfloat,opts['mf_z_mid'][idx])
@@ -631,11 +622,12 @@ def do_all(runname='td_delta', outfolder=None, regenerate=False, regenerate_stac
     plot_stacked_sfh(stack,stack_fast,outfolder, **stack_opts)
 
 
-def collate_data(runname, filename=None, regenerate=False, **opts):
+def collate_data(runname, filename=None, regenerate=False, from_store=False, **opts):
     """ pull out all of the necessary information from the individual data files
     this takes awhile, so this data is saved to disk.
     currently this saves point estimates for objname, stellar mass, SFR (30,100), avg_age, zred
     and chains for SFR(t), t, weight
+    from_store: read from the run store (see prospector_store.py) instead of the individual files
     """
 
     # if it's already made, load it and give it back
@@ -652,24 +644,44 @@ def collate_data(runname, filename=None, regenerate=False, **opts):
     outdict = {q: {f: [] for f in ['q50','q84','q16']} for q in outvar}
     for f in ['objname','sfh_t', 'weights', 'ssfh', 'zred']: outdict[f] = [] 
 
+    if from_store:
+        store = load_run_store(runname, columns=['zred','weights','sfh','chains/thetas/massmet_1'] + \
+                               ['thetas/'+v for v in outvar] + ['extras/'+v for v in outvar])
+        if 'sfh/sfh' not in store:
+            raise KeyError('the store for '+runname+' has no per-draw SFHs: re-ingest it with '+\
+                           'python prospector_store.py '+runname+' --force --full_sfh')
+        outdict['objname'] = list(store['objname'])
+        outdict['sfh_t'] = list(store['sfh/t'][:,0])
+        outdict['ssfh'] = list(store['sfh/sfh']/10**store['chains/thetas/massmet_1'][:,:,None])
+        outdict['weights'] = list(store['weights'])
+        outdict['zred'] = list(store['zred'])
+        for v in outvar:
+            key = 'thetas/'+v if ('thetas/'+v+'/q50' in store) else 'extras/'+v
+            for f in ['q50','q84','q16']: outdict[v][f] = list(store[key+'/'+f])
+        hickle.dump(outdict,open(filename, "w"))
+        return outdict
+
     basenames,_,_ = prosp_dutils.generate_basenames(runname)
     for i, name in enumerate(basenames):
 
         # load output from fit
         try:
-            res, _, model, eout = load_prospector_data(name)
+            res, _, model, eout = load_prospector_data(name,lazy=True)
         except:
             print name.split('/')[-1]+' failed to load. skipping.'
             continue
-        if (res is None) or (eout is None):
+        if res is None:
             continue
+        with res:
+            if eout is None:
+                continue
+            tm_chain = res.take('chain',eout['sample_idx'])[:,res['theta_labels'].index('massmet_1')]
 
         outdict['objname'] += [name.split('/')[-1]]
         print 'loaded ' + outdict['objname'][-1]
 
         # agebins (and generate model)
         outdict['sfh_t'] += [eout['sfh']['t'][0]]
-        tm_chain = res['chain'][eout['sample_idx'],res['theta_labels'].index('massmet_1')]
         outdict['ssfh'] += [eout['sfh']['sfh']/10**tm_chain[:,None]]
         outdict['weights'] += [eout['weights']]
 
@@ -714,7 +726,7 @@ def stack_sfh_fast(data,nt=None, **opts):
         zstr = "{:.2f}".format(zavg)
 
         # setup time vector and outputs
-        tuniv = WMAP9.age(zavg).value*1e9
+        tuniv = age_of_universe(zavg)*1e9
         tbins = np.logspace(7,np.log10(tuniv),nt)
         stack['hor'][zstr], stack['vert'][zstr] = {'t':tbins}, {'t':tbins}
 
@@ -763,7 +775,7 @@ def stack_sfh_fast(data,nt=None, **opts):
             
             # weight by (t_univ(z=zgal) / t_univ(z=z_min)) to account for variation in t_univ
             # i.e. all galaxies in a given stack should have the same average sSFR
-            ssfr *= WMAP9.age(fdict['zred']).value*1e9/tbins.max()
+            ssfr *= age_of_universe(fdict['zred'])*1e9/tbins.max()
 
             # calculate percentiles, smooth, normalize
             median, eup, edown = np.percentile(ssfr,[50,84,16],axis=1)
@@ -825,7 +837,7 @@ def stack_sfh_fast(data,nt=None, **opts):
             
             # weight by (t_univ(z=zgal) / t_univ(z=z_min)) to account for variation in t_univ
             # i.e. all galaxies in a given stack should have the same average sSFR
-            ssfr *= WMAP9.age(fdict['zred']).value*1e9/tbins.max()
+            ssfr *= age_of_universe(fdict['zred'])*1e9/tbins.max()
 
             # calculate percentiles, smooth, normalize
             median, eup, edown = np.percentile(ssfr,[50,84,16],axis=1)
@@ -866,9 +878,7 @@ def stack_sfh(data,nt=None, **opts):
 
         # setup time bins
         # here we fuse the two youngest bins into one
-        pfile.run_params['zred'] = zavg
-        mod = pfile.load_model(**pfile.run_params)
-        agebins = mod.params['agebins'][1:,:]
+        agebins = agebins_from_redshift(zavg, pfile.run_params['agelims'], pfile.run_params['nbins_sfh'])[1:,:]
         agediff = np.diff(10**agebins,axis=1).flatten()
 
         agebins[0,0] = 7
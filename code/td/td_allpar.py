@@ -6,14 +6,21 @@ from matplotlib.ticker import MaxNLocator
 import copy, os, pickle
 import matplotlib as mpl
 from prospector_io import load_prospector_extra
+from prospector_store import load_run_store, row_quantiles
 
 mpl.rcParams.update({'font.size': 18})
 mpl.rcParams.update({'font.weight': 500})
 mpl.rcParams.update({'axes.labelweight': 500})
 
-def load_alldata(runname,filename,regenerate=False):
+def load_alldata(runname,filename,regenerate=False,from_store=False):
+    """ from_store: read from the run store (see prospector_store.py) instead of the individual files
+    """
 
-    if regenerate or not os.path.isfile(filename):
+    if (regenerate or not os.path.isfile(filename)) and from_store:
+        store = load_run_store(runname)
+        alldata = [row_quantiles(store, i) for i in range(len(store['objname']))]
+        pickle.dump(alldata,open(filename, "w"))
+    elif regenerate or not os.path.isfile(filename):
         basenames, _, _ = prosp_dutils.generate_basenames(runname)
         alldata = []
         for i, name in enumerate(basenames):
@@ -98,7 +105,7 @@ def arrange_data(alldata):
 
     return out
     
-def allpar_plot(runname='td_massive',outfolder=None,lowmet=True,regenerate=False):
+def allpar_plot(runname='td_massive',outfolder=None,lowmet=True,regenerate=False,from_store=False):
 
     ### I/O stuff
     if outfolder is None:
@@ -109,7 +116,7 @@ def allpar_plot(runname='td_massive',outfolder=None,lowmet=True,regenerate=False
     filename=outfolder+'data/allpar_plot.h5'
 
     ### load data
-    alldata = load_alldata(runname,filename,regenerate=regenerate)
+    alldata = load_alldata(runname,filename,regenerate=regenerate,from_store=from_store)
     dat = arrange_data(alldata)
     npars = len(dat['parlabels'].keys())
 
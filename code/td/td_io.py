@@ -54,13 +54,92 @@ def load_mips_data(field,objnum=None,zbest=True,process=True):
 
     return dat
 
+# parsed catalogs, zeropoints, and filters, shared by load_obs / load_model in the parameter files
+# so that a worker fitting many objects only parses each of them once.
+# parsed catalogs are also saved next to the original as <catalog>.<settings hash>.npy,
+# so the catalog directory (datdir in the parameter files) must be writeable to benefit;
+# these files can be deleted at any time, and are remade when the catalog changes.
+_catalog_cache, _zp_cache, _filter_cache = {}, {}, {}
+
+def _cached_catalog(filename, reader, idcol, idtype, settings=()):
+    """returns (structured array, {id: row}) for a catalog file.
+    settings identify everything that changes what reader returns (e.g. the reader itself and
+    its delimiter), and are part of the cache key together with filename and idcol.
+    the parsed catalog is saved next to the original (see above), and used
+    as long as it is newer than the original. both are also kept in memory.
+    """
+    import hashlib
+
+    key = (filename, idcol) + tuple(settings)
+    mtime = os.path.getmtime(filename)
+    if (key in _catalog_cache) and (_catalog_cache[key][0] == mtime):
+        return _catalog_cache[key][1:]
+
+    npyname = filename+'.'+hashlib.md5(repr(tuple(settings))).hexdigest()[:8]+'.npy'
+    if os.path.isfile(npyname) and (os.path.getmtime(npyname) >= mtime):
+        dat = np.load(npyname)
+    else:
+        dat = reader(filename)
+        try:
+            np.save(npyname, dat)
+        except IOError:
+            pass
+
+    rows = {idtype(id): i for i, id in enumerate(dat[idcol])}
+    _catalog_cache[key] = (mtime, dat, rows)
+    return dat, rows
+
+def _read_phot_cat(photname, delimiter=' '):
+    with open(photname, 'r') as f:
+        hdr = f.readline().split()
+    dtype = np.dtype([(hdr[1],'S20')] + [(n, np.float) for n in hdr[2:]])
+    return np.loadtxt(photname, comments = '#', delimiter=delimiter, dtype = dtype)
+
+def load_phot_cat(photname, idcol='id', delimiter=' '):
+    """ returns the photometric catalog made by select_td_sample
+    (or any catalog with the same header format) and a dictionary of {id: row}
+    """
+    return _cached_catalog(photname, lambda x: _read_phot_cat(x, delimiter=delimiter), idcol, str,
+                           settings=('phot', delimiter))
+
+def load_ancil_cat(datname):
+    """ returns the ancillary data (.dat) made by select_td_sample
+    and a dictionary of {phot_id: row}
+    """
+    return _cached_catalog(datname, lambda x: np.asarray(ascii.read(x).as_array()), 'phot_id', int,
+                           settings=('ascii',))
+
+def load_fits_cat(filename, idcol, ext=1):
+    """ returns a FITS table HDU and a dictionary of {id: row}.
+    these are too large to duplicate on disk, so they're only kept in memory
+    """
+    key = (filename, idcol, 'fits', ext)
+    mtime = os.path.getmtime(filename)
+    if (key not in _catalog_cache) or (_catalog_cache[key][0] != mtime):
+        hdu = fits.open(filename)[ext]
+        rows = {int(id): i for i, id in enumerate(hdu.data[idcol])}
+        _catalog_cache[key] = (mtime, hdu, rows)
+    return _catalog_cache[key][1:]
+
+def load_cached_filters(filters):
+    """ sedpy filters, only loaded once per set of filter names
+    """
+    from sedpy import observate
+
+    key = tuple(filters)
+    if key not in _filter_cache:
+        _filter_cache[key] = observate.load_filters(filters)
+    return list(_filter_cache[key])
+
 def load_zp_offsets(field):
 
     filename = os.getenv('APPS')+'/prospector_alpha/data/3dhst/zp_offsets_tbl11_skel14.txt'
-    with open(filename, 'r') as f:
-        for jj in range(1): hdr = f.readline().split()
-    dtype = [np.dtype((str, 35)),np.dtype((str, 35)),np.float,np.float]
-    dat = np.loadtxt(filename, comments = '#',dtype = np.dtype([(hdr[n+1], dtype[n]) for n in xrange(len(hdr)-1)]))
+    if filename not in _zp_cache:
+        with open(filename, 'r') as f:
+            for jj in range(1): hdr = f.readline().split()
+        dtype = [np.dtype((str, 35)),np.dtype((str, 35)),np.float,np.float]
+        _zp_cache[filename] = np.loadtxt(filename, comments = '#',dtype = np.dtype([(hdr[n+1], dtype[n]) for n in xrange(len(hdr)-1)]))
+    dat = _zp_cache[filename]
 
     if field is not None:
         good = dat['Field'] == field
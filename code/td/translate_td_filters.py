@@ -1,5 +1,6 @@
-import os
+import os, sys
 import numpy as np
+from prosp_dutils import filter_registry, load_filter_response
 
 APPS = os.getenv('APPS')
 
@@ -62,80 +63,12 @@ def read_threedhst_filters(filtnum):
 		
 	filter_response_curve = APPS+'/prospector_alpha/filters/FILTER.RES.latest'
 
-	# initialize output arrays
-	lam,res = (np.zeros(0) for i in range(2))
-
-	# open file
-	with open(filter_response_curve, 'r') as f:
-
-    	# skip to correct filter
-		for jj in xrange(filtnum-1):
-    		
-			# find how many lines are next
-			line = f.readline()
-			data = line.split()
-			nlines = data[0]
-
-			# skip that many lines
-			for kk in xrange(int(nlines)): f.readline()
-    	
-    	# how many lines long is the filter definition?
-		line = f.readline()
-		data = line.split()
-		nlines = data[0]
-    	
-		# Reads text until we hit the next filter
-		for kk in xrange(int(nlines)):
-			
-			# read line, extract data
-			line = f.readline()
-			data_inloop = line.split()
-			lam = np.append(lam,float(data_inloop[1]))
-			res = np.append(res,float(data_inloop[2]))
-
-	return lam, res
+	return filter_registry(filter_response_curve, int(filtnum), fmt='eazy')
 
 def load_fsps_filter(filter, alt_file=None):
 	'''READS FILTER RESPONSE CURVES FOR FSPS'''
-		
-	if not alt_file:
-		filter_response_curve = os.getenv('SPS_HOME')+'/data/allfilters.dat'
-	else:
-		filter_response_curve = alt_file
-
-	# initialize output arrays
-	lam,res = (np.zeros(0) for i in range(2))
-
-	# upper case?
-	if filter.lower() == filter:
-		lower_case = True
-	else:
-		lower_case = False
-
-	# open file
-	with open(filter_response_curve, 'r') as f:
-    	# Skips text until we find the correct filter
-		for line in f:
-			if lower_case:
-				if line.lower().find(filter) != -1:
-					break
-			else:
-				if line.find(filter) != -1:
-					break
-		# Reads text until we hit the next filter
-		for line in f:  # This keeps reading the file
-			if line.find('#') != -1:
-				break
-			# read line, extract data
-			data = line.split()
-			lam = np.append(lam,float(data[0]))
-			res = np.append(res,float(data[1]))
-
-	if len(lam) == 0:
-		print "Couldn't find filter " + filter + ': STOPPING'
-		print 1/0
-
-	return lam, res
+
+	return load_filter_response(filter, alt_file=alt_file)
 
 def translate_txt_to_sedpy(txt_name,sedpy_filtname,
 					       outfolder='/Users/joel/code/python/sedpy/sedpy/data/filters'):
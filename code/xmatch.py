@@ -0,0 +1,115 @@
+"""
+positional cross-matching of coordinate lists against source catalogs.
+
+catalog tables are parsed once per process, and also saved next to the original table in
+numpy's binary format (rebuilt whenever the table is newer), so later processes skip the
+text parsing. positions are matched with a KD-tree built on unit vectors: two points are
+within an angle theta of each other iff the chord between them is shorter than
+2 sin(theta/2), so a radius query on the tree is an exact cone search, done for any
+number of input coordinates at once.
+
+    tree = SkyTree(cat['ra_deg'], cat['dec_deg'])
+    idx_in, idx_cat, sep = tree.query_radius(ra, dec, 30.)
+    best = brightest_match(idx_in, idx_cat, cat['flux'], len(ra))
+"""
+import numpy as np
+import os
+
+_tables = {}
+
+def radec_to_xyz(ra, dec):
+    """ (..., 3) unit vectors for ra, dec in degrees
+    """
+    ra, dec = np.radians(np.asarray(ra, dtype=float)), np.radians(np.asarray(dec, dtype=float))
+    return np.stack((np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)), axis=-1)
+
+def parse_coordinate(values, hours=False):
+    """ degrees from a column of strings, either decimal degrees or sexagesimal
+    ('12 34 56.7' or '+45:12:33'); sexagesimal is in hours if hours=True (i.e. for RA)
+    """
+    out = np.zeros(len(values))
+    for i, v in enumerate(values):
+        v = v.decode() if isinstance(v, bytes) else str(v)
+        fields = v.replace(':',' ').split()
+        if len(fields) == 1:
+            out[i] = float(fields[0])
+            continue
+        sign = -1. if fields[0].strip().startswith('-') else 1.
+        deg = sum(abs(float(f))/60.**n for n, f in enumerate(fields))
+        out[i] = sign*deg*(15. if hours else 1.)
+    return out
+
+def cached_table(location, reader):
+    """ the table at location, as returned by reader(location) (a structured array),
+    read once per process and cached in binary form in <location>.npy
+    """
+    mtime = os.path.getmtime(location)
+    if (location in _tables) and (_tables[location][0] >= mtime):
+        return _tables[location][1]
+
+    cachename = location+'.npy'
+    if os.path.isfile(cachename) and (os.path.getmtime(cachename) >= mtime):
+        dat = np.load(cachename)
+    else:
+        dat = reader(location)
+        try:
+            with open(cachename, 'wb') as f:
+                np.save(f, dat)
+        except (IOError, OSError):
+            pass
+    _tables[location] = (mtime, dat)
+
+    return dat
+
+class SkyTree(object):
+    """ KD-tree over unit vectors for a list of positions (degrees)
+    """
+    def __init__(self, ra, dec):
+        from scipy.spatial import cKDTree
+        self.xyz = radec_to_xyz(ra, dec).reshape(-1,3)
+        self.tree = cKDTree(self.xyz)
+
+    def query_radius(self, ra, dec, radius):
+        """ every (input, catalog) pair closer than radius (arcsec), for all inputs at once.
+        returns input index, catalog index, separation in arcsec, sorted by input index
+        (then catalog index)
+        """
+        xyz = radec_to_xyz(ra, dec).reshape(-1,3)
+        chord = 2*np.sin(np.radians(radius/3600.)/2.)
+        neighbours = self.tree.query_ball_point(xyz, chord)
+
+        counts = np.array([len(n) for n in neighbours], dtype=int)
+        idx_in = np.repeat(np.arange(xyz.shape[0]), counts)
+        idx_cat = np.array([j for n in neighbours for j in sorted(n)], dtype=int)
+        if idx_cat.size == 0:
+            return idx_in, idx_cat, np.zeros(0)
+
+        dist = np.sqrt(((xyz[idx_in] - self.xyz[idx_cat])**2).sum(axis=-1))
+        sep = np.degrees(2*np.arcsin(np.clip(dist/2.,0,1)))*3600.
+
+        return idx_in, idx_cat, sep
+
+def brightest_match(idx_in, idx_cat, flux, nin):
+    """ for each of nin inputs, the catalog index of the brightest of its matches
+    (the first if tied), or -1 if there are none
+    """
+    best = np.full(nin, -1, dtype=int)
+    if idx_in.size == 0:
+        return best
+    order = np.lexsort((-np.asarray(flux, dtype=float)[idx_cat], idx_in))
+    idx_in, idx_cat = idx_in[order], idx_cat[order]
+    first = np.concatenate(([True], idx_in[1:] != idx_in[:-1]))
+    best[idx_in[first]] = idx_cat[first]
+
+    return best
+
+def prioritized_match(best):
+    """ best is a list of (nin,) matched-index arrays (-1 for no match), in order of preference.
+    returns which of them to use for each input (-1 if none match), and the matched index
+    """
+    best = np.array(best, dtype=int).reshape(len(best),-1)
+    matched = best >= 0
+    which = np.where(matched.any(axis=0), matched.argmax(axis=0), -1)
+    index = np.where(which >= 0, best[np.clip(which,0,None), np.arange(best.shape[1])], -1)
+
+    return which, index
@@ -3,9 +3,12 @@ import os
 from prospect.models import priors, sedmodel
 from prospect.sources import FastStepBasis
 from sedpy import observate
-from astropy.cosmology import WMAP9
+from nonpar_sfh import agebins_from_redshift
+from cosmo_tables import luminosity_distance
 from astropy.io import fits
 from scipy.stats import truncnorm
+from massmet_prior import massmet_loc_scale, massmet_lnpdf, massmet_unit_transform
+from sps_cache import nebline_filter_matrix, observed_photometry, SpectrumCacheMixin
 
 lsun = 3.846e33
 pc = 3.085677581467192e18  # in cm
@@ -392,15 +395,12 @@ class MassMet(priors.Prior):
 
     prior_params = ['mass_mini', 'mass_maxi', 'z_mini', 'z_maxi']
     distribution = truncnorm
-    massmet = np.loadtxt(os.getenv('APPS')+'/prospector_alpha/data/gallazzi_05_massmet.txt')
 
     def scale(self,mass):
-        upper_84 = np.interp(mass, self.massmet[:,0], self.massmet[:,3]) 
-        lower_16 = np.interp(mass, self.massmet[:,0], self.massmet[:,2])
-        return (upper_84-lower_16)
+        return massmet_loc_scale(mass)[1]
 
     def loc(self,mass):
-        return np.interp(mass, self.massmet[:,0], self.massmet[:,1])
+        return massmet_loc_scale(mass)[0]
 
     def get_args(self,mass):
         a = (self.params['z_mini'] - self.loc(mass)) / self.scale(mass)
@@ -434,10 +434,7 @@ class MassMet(priors.Prior):
         if len(kwargs) > 0:
             self.update(**kwargs)
         p = np.atleast_2d(np.zeros_like(x))
-        a, b = self.get_args(x[...,0])
-        p[...,1] = self.distribution.pdf(x[...,1], a, b, loc=self.loc(x[...,0]), scale=self.scale(x[...,0]))
-        with np.errstate(invalid='ignore'):
-            p[...,1] = np.log(p[...,1])
+        p[...,1] = massmet_lnpdf(x[...,0], x[...,1], self.params['z_mini'], self.params['z_maxi'])
         return p
 
     def sample(self, nsample=None, **kwargs):
@@ -460,6 +457,7 @@ class MassMet(priors.Prior):
         :param x:
             A scalar or vector of same length as the Prior with values between
             zero and one corresponding to the value of the CDF.
+            can also be (npoint, 2), to transform many points at once.
 
         :returns theta:
             The parameter value corresponding to the value of the CDF given by
@@ -467,12 +465,10 @@ class MassMet(priors.Prior):
         """
         if len(kwargs) > 0:
             self.update(**kwargs)
-        mass = x[0]*(self.params['mass_maxi'] - self.params['mass_mini']) + self.params['mass_mini']
-        a, b = self.get_args(mass)
-        met = self.distribution.ppf(x[1], a, b, loc=self.loc(mass), scale=self.scale(mass))
-        return np.array([mass,met])
+        return massmet_unit_transform(x, self.params['mass_mini'], self.params['mass_maxi'],
+                                      self.params['z_mini'], self.params['z_maxi'])
 
-class NebSFH(FastStepBasis):
+class NebSFH(SpectrumCacheMixin, FastStepBasis):
     
     @property
     def emline_wavelengths(self):
@@ -482,23 +478,14 @@ class NebSFH(FastStepBasis):
     def get_nebline_luminosity(self):
         """Emission line luminosities in units of Lsun per solar mass formed
         """
-        return self.ssp.emline_luminosity/self.params['mass'].sum()
+        return self.emline_luminosity/self.params['mass'].sum()
 
     def nebline_photometry(self,filters,z):
         """analytically calculate emission line contribution to photometry
+        the line -> filter matrix is fixed for a given set of filters and redshift, so it is cached
         """
-        emlams = self.emline_wavelengths * (1+z)
         elums = self.get_nebline_luminosity # Lsun / solar mass formed
-        flux = np.empty(len(filters))
-        for i,filt in enumerate(filters):
-            # calculate transmission at nebular emission
-            trans = np.interp(emlams, filt.wavelength, filt.transmission, left=0., right=0.)
-            idx = (trans > 0)
-            if True in idx:
-                flux[i] = (trans[idx]*emlams[idx]*elums[idx]).sum()/filt.ab_zero_counts
-            else:
-                flux[i] = 0.0
-        return flux
+        return np.dot(nebline_filter_matrix(filters, self.emline_wavelengths, z), elums)
 
     def get_spectrum(self, outwave=None, filters=None, peraa=False, **params):
         """Get a spectrum and SED for the given params.
@@ -530,8 +517,7 @@ class NebSFH(FastStepBasis):
         spec_aa = lightspeed/wa**2 * sa # convert to perAA
         # Observed frame photometry, as absolute maggies
         if filters is not None:
-            mags = observate.getSED(wa, spec_aa * to_cgs, filters)
-            phot = np.atleast_1d(10**(-0.4 * mags))
+            phot = np.atleast_1d(observed_photometry(wa, spec_aa * to_cgs, filters))
         else:
             phot = 0.0
 
@@ -560,7 +546,7 @@ class NebSFH(FastStepBasis):
             # provided in the dist key in units of Mpc)
             dfactor = (self.params.get('lumdist', 1e-5) * 1e5)**2
         else:
-            lumdist = WMAP9.luminosity_distance(zred).value
+            lumdist = luminosity_distance(zred)
             dfactor = (lumdist * 1e5)**2
         if peraa:
             # spectrum will be in erg/s/cm^2/AA
@@ -590,18 +576,15 @@ def load_model(agelims=[],nbins_sfh=13, sigma=0.3, df=2, **extras):
     #### CALCULATE TUNIV #####
     n = [p['name'] for p in model_params]
     zred = model_params[n.index('zred')]['init']
-    tuniv = WMAP9.age(zred).value*1e9
 
     # now construct the nonparametric SFH
     # current scheme:  last bin is 15% age of the Universe, first two are 0-30, 30-100
     # remaining N-3 bins spaced equally in logarithmic space
-    tbinmax = (tuniv*0.85)
-    agelims = agelims[:2] + np.linspace(agelims[2],np.log10(tbinmax),nbins_sfh-2).tolist() + [np.log10(tuniv)]
-    agebins = np.array([agelims[:-1], agelims[1:]])
+    agebins = agebins_from_redshift(zred, agelims, nbins_sfh)
 
     # load nvariables and agebins
     model_params[n.index('agebins')]['N'] = nbins_sfh
-    model_params[n.index('agebins')]['init'] = agebins.T
+    model_params[n.index('agebins')]['init'] = agebins
     model_params[n.index('mass')]['N'] = nbins_sfh
     model_params[n.index('logsfr_ratios')]['N'] = nbins_sfh-1
     model_params[n.index('logsfr_ratios')]['init'] = np.full(nbins_sfh-1,0.0) # constant SFH
@@ -3,11 +3,14 @@ import os
 from prospect.models import priors, sedmodel
 from prospect.sources import FastStepBasis
 from sedpy import observate
-from astropy.cosmology import WMAP9
+from nonpar_sfh import agebins_from_redshift
+from cosmo_tables import age_of_universe, luminosity_distance
 from astropy import constants
 from scipy.stats import truncnorm
+from massmet_prior import massmet_loc_scale, massmet_lnpdf, massmet_unit_transform
 from astropy.io import ascii
 from astropy.io import fits
+from sps_cache import nebline_filter_matrix, observed_photometry, SpectrumCacheMixin
 
 #############
 # RUN_PARAMS
@@ -548,7 +551,6 @@ class MassMet(priors.Prior):
 
     prior_params = ['mass_mini', 'mass_maxi', 'z_mini', 'z_maxi']
     distribution = truncnorm
-    massmet = np.loadtxt(os.getenv('APPS')+'/prospector_alpha/data/gallazzi_05_massmet.txt')
 
     def __len__(self):
         """ Hack to work with Prospector 0.3
@@ -556,12 +558,10 @@ class MassMet(priors.Prior):
         return 2
 
     def scale(self,mass):
-        upper_84 = np.interp(mass, self.massmet[:,0], self.massmet[:,3]) 
-        lower_16 = np.interp(mass, self.massmet[:,0], self.massmet[:,2])
-        return (upper_84-lower_16)
+        return massmet_loc_scale(mass)[1]
 
     def loc(self,mass):
-        return np.interp(mass, self.massmet[:,0], self.massmet[:,1])
+        return massmet_loc_scale(mass)[0]
 
     def get_args(self,mass):
         a = (self.params['z_mini'] - self.loc(mass)) / self.scale(mass)
@@ -595,10 +595,7 @@ class MassMet(priors.Prior):
         if len(kwargs) > 0:
             self.update(**kwargs)
         p = np.atleast_2d(np.zeros_like(x))
-        a, b = self.get_args(x[...,0])
-        p[...,1] = self.distribution.pdf(x[...,1], a, b, loc=self.loc(x[...,0]), scale=self.scale(x[...,0]))
-        with np.errstate(invalid='ignore'):
-            p[...,1] = np.log(p[...,1])
+        p[...,1] = massmet_lnpdf(x[...,0], x[...,1], self.params['z_mini'], self.params['z_maxi'])
         return p
 
     def sample(self, nsample=None, **kwargs):
@@ -621,6 +618,7 @@ class MassMet(priors.Prior):
         :param x:
             A scalar or vector of same length as the Prior with values between
             zero and one corresponding to the value of the CDF.
+            can also be (npoint, 2), to transform many points at once.
 
         :returns theta:
             The parameter value corresponding to the value of the CDF given by
@@ -628,13 +626,11 @@ class MassMet(priors.Prior):
         """
         if len(kwargs) > 0:
             self.update(**kwargs)
-        mass = x[0]*(self.params['mass_maxi'] - self.params['mass_mini']) + self.params['mass_mini']
-        a, b = self.get_args(mass)
-        met = self.distribution.ppf(x[1], a, b, loc=self.loc(mass), scale=self.scale(mass))
-        return np.array([mass,met])
+        return massmet_unit_transform(x, self.params['mass_mini'], self.params['mass_maxi'],
+                                      self.params['z_mini'], self.params['z_maxi'])
 
 ###### Redefine SPS ######
-class NebSFH(FastStepBasis):
+class NebSFH(SpectrumCacheMixin, FastStepBasis):
     
     @property
     def emline_wavelengths(self):
@@ -644,23 +640,14 @@ class NebSFH(FastStepBasis):
     def get_nebline_luminosity(self):
         """Emission line luminosities in units of Lsun per solar mass formed
         """
-        return self.ssp.emline_luminosity/self.params['mass'].sum()
+        return self.emline_luminosity/self.params['mass'].sum()
 
     def nebline_photometry(self,filters,z):
         """analytically calculate emission line contribution to photometry
+        the line -> filter matrix is fixed for a given set of filters and redshift, so it is cached
         """
-        emlams = self.emline_wavelengths * (1+z)
         elums = self.get_nebline_luminosity # Lsun / solar mass formed
-        flux = np.empty(len(filters))
-        for i,filt in enumerate(filters):
-            # calculate transmission at nebular emission
-            trans = np.interp(emlams, filt.wavelength, filt.transmission, left=0., right=0.)
-            idx = (trans > 0)
-            if True in idx:
-                flux[i] = (trans[idx]*emlams[idx]*elums[idx]).sum()/filt.ab_zero_counts
-            else:
-                flux[i] = 0.0
-        return flux
+        return np.dot(nebline_filter_matrix(filters, self.emline_wavelengths, z), elums)
 
     def get_spectrum(self, outwave=None, filters=None, peraa=False, **params):
         """Get a spectrum and SED for the given params.
@@ -699,8 +686,7 @@ class NebSFH(FastStepBasis):
         spec_aa = lightspeed/wa**2 * sa # convert to perAA
         # Observed frame photometry, as absolute maggies
         if filters is not None:
-            mags = observate.getSED(wa, spec_aa * to_cgs, filters)
-            phot = np.atleast_1d(10**(-0.4 * mags))
+            phot = np.atleast_1d(observed_photometry(wa, spec_aa * to_cgs, filters))
         else:
             phot = 0.0
 
@@ -729,7 +715,7 @@ class NebSFH(FastStepBasis):
             # provided in the dist key in units of Mpc)
             dfactor = (self.params.get('lumdist', 1e-5) * 1e5)**2
         else:
-            lumdist = WMAP9.luminosity_distance(zred).value
+            lumdist = luminosity_distance(zred)
             dfactor = (lumdist * 1e5)**2
         if peraa:
             # spectrum will be in erg/s/cm^2/AA
@@ -763,20 +749,18 @@ def load_model(objname='',datname='', agelims=[], nbins_sfh=7, sigma=0.3, df=2,
     hdulist = fits.open(datname)
     idx = hdulist[1].data['Name'] == objname
     zred =  hdulist[1].data['cz'][idx][0] / 3e5
-    tuniv = WMAP9.age(zred).value*1e9
+    tuniv = age_of_universe(zred)*1e9
     lumdist = hdulist[1].data['Dist'][idx][0]
     hdulist.close()
 
     # now construct the nonparametric SFH
     # current scheme:  last bin is 15% age of the Universe, first two are 0-30, 30-100
     # remaining N-3 bins spaced equally in logarithmic space
-    tbinmax = (tuniv*0.85)
-    agelims = agelims[:2] + np.linspace(agelims[2],np.log10(tbinmax),nbins_sfh-2).tolist() + [np.log10(tuniv)]
-    agebins = np.array([agelims[:-1], agelims[1:]])
+    agebins = agebins_from_redshift(zred, agelims, nbins_sfh)
 
     # load nvariables and agebins
     model_params[n.index('agebins')]['N'] = nbins_sfh
-    model_params[n.index('agebins')]['init'] = agebins.T
+    model_params[n.index('agebins')]['init'] = agebins
     model_params[n.index('mass')]['N'] = nbins_sfh
     model_params[n.index('logsfr_ratios')]['N'] = nbins_sfh-1
     model_params[n.index('logsfr_ratios')]['init'] = np.full(nbins_sfh-1,0.0) # constant SFH
@@ -3,7 +3,8 @@ import os
 from prospect.models import priors, sedmodel
 from prospect.sources import FastStepBasis
 from sedpy import observate
-from astropy.cosmology import WMAP9
+from sps_cache import observed_photometry, SpectrumCacheMixin
+from cosmo_tables import age_of_universe, luminosity_distance
 from astropy.io import fits
 
 lsun = 3.846e33
@@ -509,7 +510,7 @@ for param in model_params:
         tparams.append(param)
 model_params = tparams
 
-class FracSFH(FastStepBasis):
+class FracSFH(SpectrumCacheMixin, FastStepBasis):
     
     @property
     def emline_wavelengths(self):
@@ -519,7 +520,7 @@ class FracSFH(FastStepBasis):
     def get_nebline_luminosity(self):
         """Emission line luminosities in units of Lsun per solar mass formed
         """
-        return self.ssp.emline_luminosity/self.params['mass'].sum()
+        return self.emline_luminosity/self.params['mass'].sum()
 
     def nebline_photometry(self,filters,z):
         """analytically calculate emission line contribution to photometry
@@ -549,14 +550,8 @@ class FracSFH(FastStepBasis):
         bin_fractions /= bin_fractions.sum()
         
         mass = bin_fractions*self.params['mass']
-        mtot = self.params['mass'].sum()
-
-        time, sfr, tmax = self.convert_sfh(self.params['agebins'], mass)
-        self.ssp.params["sfh"] = 3 #Hack to avoid rewriting the superclass
-        self.ssp.set_tabular_sfh(time, sfr)
-        wave, spec = self.ssp.get_spectrum(tage=tmax, peraa=False)
-
-        return wave, spec / mtot, self.ssp.stellar_mass / mtot
+        # tabular SFH, or through the spectrum / bin caches
+        return self.galaxy_spectrum(mass)
 
     def get_spectrum(self, outwave=None, filters=None, peraa=False, **params):
         """Get a spectrum and SED for the given params.
@@ -588,8 +583,7 @@ class FracSFH(FastStepBasis):
         spec_aa = lightspeed/wa**2 * sa # convert to perAA
         # Observed frame photometry, as absolute maggies
         if filters is not None:
-            mags = observate.getSED(wa, spec_aa * to_cgs, filters)
-            phot = np.atleast_1d(10**(-0.4 * mags))
+            phot = np.atleast_1d(observed_photometry(wa, spec_aa * to_cgs, filters))
         else:
             phot = 0.0
 
@@ -618,7 +612,7 @@ class FracSFH(FastStepBasis):
             # provided in the dist key in units of Mpc)
             dfactor = (self.params.get('lumdist', 1e-5) * 1e5)**2
         else:
-            lumdist = WMAP9.luminosity_distance(zred).value
+            lumdist = luminosity_distance(zred)
             dfactor = (lumdist * 1e5)**2
         if peraa:
             # spectrum will be in erg/s/cm^2/AA
@@ -653,7 +647,7 @@ def load_model(objname='',datname='', agelims=[], **extras):
     hdulist.close()
 
     #### CALCULATE TUNIV #####
-    tuniv = WMAP9.age(zred).value
+    tuniv = age_of_universe(zred)
 
     #### NONPARAMETRIC SFH ######
     agelims[-1] = np.log10(tuniv*1e9)
@@ -2,11 +2,13 @@ import numpy as np
 import os
 from prospect.models import priors, sedmodel
 from prospect.sources import FastStepBasis
-from sedpy import observate
-from astropy.cosmology import WMAP9
-from td_io import load_zp_offsets
+from cosmo_tables import age_of_universe, luminosity_distance
+from td_io import load_zp_offsets, load_phot_cat, load_cached_filters
+from nonpar_sfh import zfrac_to_masses
 from scipy.stats import truncnorm
+from massmet_prior import massmet_loc_scale, massmet_lnpdf, massmet_unit_transform
 from astropy.io import ascii
+from sps_cache import nebline_filter_matrix, observed_photometry, SpectrumCacheMixin
 
 lsun = 3.846e33
 pc = 3.085677581467192e18  # in cm
@@ -38,6 +40,7 @@ run_params = {'verbose':True,
               'interp_type': 'logarithmic',
               'agelims': [0.0,7.4772,8.0,8.5,9.0,9.5,9.8,10.0],
               # Data info (phot = .cat, dat = .dat, fast = .fout)
+              # (td_io saves parsed copies of the .cat and .dat next to them as .npy files, see td_io._cached_catalog)
               'datloc':APPS+'/prospector_alpha/data/CANDELS_GDSS_workshop.dat',
               'runname': 'candels',
               'objname':'00449'
@@ -55,14 +58,11 @@ def load_obs(objname=None, datloc=None, err_floor=0.05, **extras):
     '''
 
     ### open file, load data
-    with open(datloc, 'r') as f:
-        hdr = f.readline().split()
-    dtype = np.dtype([(hdr[1],'S20')] + [(n, np.float) for n in hdr[2:]])
-    dat = np.loadtxt(datloc, comments = '#', dtype = dtype)
+    dat, rows = load_phot_cat(datloc, idcol='ID', delimiter=None)
 
     ### extract filters, fluxes, errors for object
     # from ReadMe: "All fluxes are normalized to an AB zeropoint of 25, such that: magAB = 25.0-2.5*log10(flux)
-    obj_idx = (dat['ID'] == objname)
+    obj_idx = rows[objname]
     filters = np.array([f[1:] for f in dat.dtype.names if f[0] == 'e'])
     flux = np.squeeze([dat[obj_idx][f] for f in filters])
     unc = np.squeeze([dat[obj_idx]['e'+f] for f in filters])
@@ -77,7 +77,7 @@ def load_obs(objname=None, datloc=None, err_floor=0.05, **extras):
 
     ### mask anything touching or bluewards of Ly-a
     zred = dat['zz'][obj_idx]
-    ofilters = observate.load_filters([f+'_candels' for f in filters])
+    ofilters = load_cached_filters([f+'_candels' for f in filters])
 
     wavemax = np.array([f.wavelength[f.transmission > (f.transmission.max()*0.1)].max() for f in ofilters]) / (1+zred)
     wavemin = np.array([f.wavelength[f.transmission > (f.transmission.max()*0.1)].min() for f in ofilters]) / (1+zred)
@@ -126,51 +126,6 @@ def massmet_to_logmass(massmet=None,**extras):
 def massmet_to_logzsol(massmet=None,**extras):
     return massmet[1]
 
-def zfrac_to_sfrac(z_fraction=None, **extras):
-    """This transforms from latent, independent `z` variables to sfr
-    fractions. The transformation is such that sfr fractions are drawn from a
-    Dirichlet prior.  See Betancourt et al. 2010
-    """
-    sfr_fraction = np.zeros(len(z_fraction) + 1)
-    sfr_fraction[0] = 1.0 - z_fraction[0]
-    for i in range(1, len(z_fraction)):
-        sfr_fraction[i] = np.prod(z_fraction[:i]) * (1.0 - z_fraction[i])
-    sfr_fraction[-1] = 1 - np.sum(sfr_fraction[:-1])
-
-    return sfr_fraction
-
-def zfrac_to_masses(logmass=None, z_fraction=None, agebins=None, **extras):
-    """This transforms from latent, independent `z` variables to sfr fractions
-    and then to bin mass fractions. The transformation is such that sfr
-    fractions are drawn from a Dirichlet prior.  See Betancourt et al. 2010
-    :returns masses:
-        The stellar mass formed in each age bin.
-    """
-    # sfr fractions (e.g. Leja 2017)
-    sfr_fraction = zfrac_to_sfrac(z_fraction)
-    # convert to mass fractions
-    time_per_bin = np.diff(10**agebins, axis=-1)[:,0]
-    sfr_fraction *= np.array(time_per_bin)
-    sfr_fraction /= sfr_fraction.sum()
-    masses = 10**logmass * sfr_fraction
-
-    return masses
-
-def masses_to_zfrac(mass=None, agebins=None, **extras):
-    """The inverse of zfrac_to_masses, for setting mock parameters based on
-    real bin masses.
-    """
-    total_mass = mass.sum()
-    time_per_bin = np.diff(10**agebins, axis=-1)[:,0]
-    sfr_fraction = mass / time_per_bin
-    sfr_fraction /= sfr_fraction.sum()
-    z_fraction = np.zeros(len(sfr_fraction) - 1)
-    z_fraction[0] = 1 - sfr_fraction[0]
-    for i in range(1, len(z_fraction)):
-        z_fraction[i] = 1.0 - sfr_fraction[i] / np.prod(z_fraction[:i])
-
-    return total_mass, z_fraction
-
 #############
 # MODEL_PARAMS
 #############
@@ -428,15 +383,12 @@ class MassMet(priors.Prior):
 
     prior_params = ['mass_mini', 'mass_maxi', 'z_mini', 'z_maxi']
     distribution = truncnorm
-    massmet = np.loadtxt(os.getenv('APPS')+'/prospector_alpha/data/gallazzi_05_massmet.txt')
 
     def scale(self,mass):
-        upper_84 = np.interp(mass, self.massmet[:,0], self.massmet[:,3]) 
-        lower_16 = np.interp(mass, self.massmet[:,0], self.massmet[:,2])
-        return (upper_84-lower_16)
+        return massmet_loc_scale(mass)[1]
 
     def loc(self,mass):
-        return np.interp(mass, self.massmet[:,0], self.massmet[:,1])
+        return massmet_loc_scale(mass)[0]
 
     def get_args(self,mass):
         a = (self.params['z_mini'] - self.loc(mass)) / self.scale(mass)
@@ -470,10 +422,7 @@ class MassMet(priors.Prior):
         if len(kwargs) > 0:
             self.update(**kwargs)
         p = np.atleast_2d(np.zeros_like(x))
-        a, b = self.get_args(x[...,0])
-        p[...,1] = self.distribution.pdf(x[...,1], a, b, loc=self.loc(x[...,0]), scale=self.scale(x[...,0]))
-        with np.errstate(invalid='ignore'):
-            p[...,1] = np.log(p[...,1])
+        p[...,1] = massmet_lnpdf(x[...,0], x[...,1], self.params['z_mini'], self.params['z_maxi'])
         return p
 
     def sample(self, nsample=None, **kwargs):
@@ -496,6 +445,7 @@ class MassMet(priors.Prior):
         :param x:
             A scalar or vector of same length as the Prior with values between
             zero and one corresponding to the value of the CDF.
+            can also be (npoint, 2), to transform many points at once.
 
         :returns theta:
             The parameter value corresponding to the value of the CDF given by
@@ -503,13 +453,11 @@ class MassMet(priors.Prior):
         """
         if len(kwargs) > 0:
             self.update(**kwargs)
-        mass = x[0]*(self.params['mass_maxi'] - self.params['mass_mini']) + self.params['mass_mini']
-        a, b = self.get_args(mass)
-        met = self.distribution.ppf(x[1], a, b, loc=self.loc(mass), scale=self.scale(mass))
-        return np.array([mass,met])
+        return massmet_unit_transform(x, self.params['mass_mini'], self.params['mass_maxi'],
+                                      self.params['z_mini'], self.params['z_maxi'])
 
 ###### Redefine SPS ######
-class NebSFH(FastStepBasis):
+class NebSFH(SpectrumCacheMixin, FastStepBasis):
     
     @property
     def emline_wavelengths(self):
@@ -519,23 +467,14 @@ class NebSFH(FastStepBasis):
     def get_nebline_luminosity(self):
         """Emission line luminosities in units of Lsun per solar mass formed
         """
-        return self.ssp.emline_luminosity/self.params['mass'].sum()
+        return self.emline_luminosity/self.params['mass'].sum()
 
     def nebline_photometry(self,filters,z):
         """analytically calculate emission line contribution to photometry
+        the line -> filter matrix is fixed for a given set of filters and redshift, so it is cached
         """
-        emlams = self.emline_wavelengths * (1+z)
         elums = self.get_nebline_luminosity # Lsun / solar mass formed
-        flux = np.empty(len(filters))
-        for i,filt in enumerate(filters):
-            # calculate transmission at nebular emission
-            trans = np.interp(emlams, filt.wavelength, filt.transmission, left=0., right=0.)
-            idx = (trans > 0)
-            if True in idx:
-                flux[i] = (trans[idx]*emlams[idx]*elums[idx]).sum()/filt.ab_zero_counts
-            else:
-                flux[i] = 0.0
-        return flux
+        return np.dot(nebline_filter_matrix(filters, self.emline_wavelengths, z), elums)
 
     def get_spectrum(self, outwave=None, filters=None, peraa=False, **params):
         """Get a spectrum and SED for the given params.
@@ -567,8 +506,7 @@ class NebSFH(FastStepBasis):
         spec_aa = lightspeed/wa**2 * sa # convert to perAA
         # Observed frame photometry, as absolute maggies
         if filters is not None:
-            mags = observate.getSED(wa, spec_aa * to_cgs, filters)
-            phot = np.atleast_1d(10**(-0.4 * mags))
+            phot = np.atleast_1d(observed_photometry(wa, spec_aa * to_cgs, filters))
         else:
             phot = 0.0
 
@@ -597,7 +535,7 @@ class NebSFH(FastStepBasis):
             # provided in the dist key in units of Mpc)
             dfactor = (self.params.get('lumdist', 1e-5) * 1e5)**2
         else:
-            lumdist = WMAP9.luminosity_distance(zred).value
+            lumdist = luminosity_distance(zred)
             dfactor = (lumdist * 1e5)**2
         if peraa:
             # spectrum will be in erg/s/cm^2/AA
@@ -631,13 +569,9 @@ def load_model(objname=None, datloc=None, agelims=[], zred=None, alpha_sfh=0.2,
     # if no redshift is specified, read from file
     if zred is None:
         ### open file, load data
-        with open(datloc, 'r') as f:
-            hdr = f.readline().split()
-        dtype = np.dtype([(hdr[1],'S20')] + [(nam, np.float) for nam in hdr[2:]])
-        dat = np.loadtxt(datloc, comments = '#', dtype = dtype)
-        obj_idx = (dat['ID'] == objname)
-        zred = dat['zz'][obj_idx]
-    tuniv = WMAP9.age(zred).value
+        dat, rows = load_phot_cat(datloc, idcol='ID', delimiter=None)
+        zred = dat['zz'][rows[objname]]
+    tuniv = age_of_universe(zred)
 
     # now construct the nonparametric SFH
     # current scheme: six bins, four spaced equally in logarithmic 
@@ -2,10 +2,8 @@ import numpy as np
 import os
 from prospect.models import priors, sedmodel
 from prospect.sources import CSPSpecBasis
-from sedpy import observate
-from astropy.cosmology import WMAP9
-from td_io import load_zp_offsets
-from astropy.io import ascii
+from cosmo_tables import age_of_universe
+from td_io import load_zp_offsets, load_phot_cat, load_ancil_cat, load_cached_filters
 APPS = os.getenv('APPS')
 
 #############
@@ -30,6 +28,7 @@ run_params = {'verbose':True,
               'initial_disp':0.1,
               'interp_type': 'logarithmic',
               # Data info (phot = .cat, dat = .dat, fast = .fout)
+              # (td_io saves parsed copies of the .cat and .dat next to them as .npy files, see td_io._cached_catalog)
               'datdir':APPS+'/prospector_alpha/data/3dhst/',
               'runname': 'td_new',
               'objname':'AEGIS_13'
@@ -48,14 +47,11 @@ def load_obs(objname=None, datdir=None, runname=None, err_floor=0.05, zperr=True
 
     ### open file, load data
     photname = datdir + objname.split('_')[0] + '_' + runname + '.cat'
-    with open(photname, 'r') as f:
-        hdr = f.readline().split()
-    dtype = np.dtype([(hdr[1],'S20')] + [(n, np.float) for n in hdr[2:]])
-    dat = np.loadtxt(photname, comments = '#', delimiter=' ', dtype = dtype)
+    dat, rows = load_phot_cat(photname)
 
     ### extract filters, fluxes, errors for object
     # from ReadMe: "All fluxes are normalized to an AB zeropoint of 25, such that: magAB = 25.0-2.5*log10(flux)
-    obj_idx = (dat['id'] == objname.split('_')[-1])
+    obj_idx = rows[objname.split('_')[-1]]
     filters = np.array([f[2:] for f in dat.dtype.names if f[0:2] == 'f_'])
     flux = np.squeeze([dat[obj_idx]['f_'+f] for f in filters])
     unc = np.squeeze([dat[obj_idx]['e_'+f] for f in filters])
@@ -105,10 +101,10 @@ def load_obs(objname=None, datdir=None, runname=None, err_floor=0.05, zperr=True
     ### mask anything touching or bluewards of Ly-a
     ### or redwards of 3um
     datname = datdir + objname.split('_')[0] + '_' + runname + '.dat'
-    dat = ascii.read(datname)
-    idx = dat['phot_id'] == int(objname.split('_')[-1])
+    dat, rows = load_ancil_cat(datname)
+    idx = rows[int(objname.split('_')[-1])]
     zred = float(dat['z_best'][idx])
-    ofilters = observate.load_filters(filters)
+    ofilters = load_cached_filters(filters)
 
     wavemax = np.array([f.wavelength[f.transmission > (f.transmission.max()*0.1)].max() for f in ofilters]) / (1+zred)
     wavemin = np.array([f.wavelength[f.transmission > (f.transmission.max()*0.1)].min() for f in ofilters]) / (1+zred)
@@ -318,10 +314,10 @@ def load_model(objname=None, datdir=None, agelims=[], runname=None, zred=None, *
     # if no redshift is specified, read from file
     if zred is None:
         datname = datdir + objname.split('_')[0] + '_' + runname + '.dat'
-        dat = ascii.read(datname)
-        idx = dat['phot_id'] == int(objname.split('_')[-1])
+        dat, rows = load_ancil_cat(datname)
+        idx = rows[int(objname.split('_')[-1])]
         zred = float(dat['z_best'][idx])
-    tuniv = WMAP9.age(zred).value
+    tuniv = age_of_universe(zred)
 
 
     # Update parameters
@@ -2,10 +2,8 @@ import numpy as np
 import os
 from prospect.models import priors, sedmodel
 from prospect.sources import FastStepBasis
-from sedpy import observate
-from astropy.cosmology import WMAP9
-from td_io import load_zp_offsets
-from astropy.io import ascii
+from nonpar_sfh import agebins_from_redshift
+from td_io import load_zp_offsets, load_phot_cat, load_ancil_cat, load_cached_filters
 
 APPS = os.getenv('APPS')
 
@@ -35,6 +33,7 @@ run_params = {'verbose':True,
               'df': 2,
               'agelims': [0.0,7.4772,8.0,8.5,9.0,9.5,9.8,10.0],
               # Data info (phot = .cat, dat = .dat, fast = .fout)
+              # (td_io saves parsed copies of the .cat and .dat next to them as .npy files, see td_io._cached_catalog)
               'datdir':APPS+'/prospector_alpha/data/3dhst/',
               'runname': 'td_new',
               'objname':'AEGIS_13'
@@ -53,14 +52,11 @@ def load_obs(objname=None, datdir=None, runname=None, err_floor=0.05, zperr=True
 
     ### open file, load data
     photname = datdir + objname.split('_')[0] + '_' + runname + '.cat'
-    with open(photname, 'r') as f:
-        hdr = f.readline().split()
-    dtype = np.dtype([(hdr[1],'S20')] + [(n, np.float) for n in hdr[2:]])
-    dat = np.loadtxt(photname, comments = '#', delimiter=' ', dtype = dtype)
+    dat, rows = load_phot_cat(photname)
 
     ### extract filters, fluxes, errors for object
     # from ReadMe: "All fluxes are normalized to an AB zeropoint of 25, such that: magAB = 25.0-2.5*log10(flux)
-    obj_idx = (dat['id'] == objname.split('_')[-1])
+    obj_idx = rows[objname.split('_')[-1]]
     filters = np.array([f[2:] for f in dat.dtype.names if f[0:2] == 'f_'])
     flux = np.squeeze([dat[obj_idx]['f_'+f] for f in filters])
     unc = np.squeeze([dat[obj_idx]['e_'+f] for f in filters])
@@ -110,10 +106,10 @@ def load_obs(objname=None, datdir=None, runname=None, err_floor=0.05, zperr=True
     ### mask anything touching or bluewards of Ly-a
     ### or redwards of 3um
     datname = datdir + objname.split('_')[0] + '_' + runname + '.dat'
-    dat = ascii.read(datname)
-    idx = dat['phot_id'] == int(objname.split('_')[-1])
+    dat, rows = load_ancil_cat(datname)
+    idx = rows[int(objname.split('_')[-1])]
     zred = float(dat['z_best'][idx])
-    ofilters = observate.load_filters(filters)
+    ofilters = load_cached_filters(filters)
 
     wavemax = np.array([f.wavelength[f.transmission > (f.transmission.max()*0.1)].max() for f in ofilters]) / (1+zred)
     wavemin = np.array([f.wavelength[f.transmission > (f.transmission.max()*0.1)].min() for f in ofilters]) / (1+zred)
@@ -288,22 +284,19 @@ def load_model(objname=None, datdir=None, nbins_sfh=7, sigma=0.3, df=2, agelims=
     # if no redshift is specified, read from file
     if zred is None:
         datname = datdir + objname.split('_')[0] + '_' + runname + '.dat'
-        dat = ascii.read(datname)
-        idx = dat['phot_id'] == int(objname.split('_')[-1])
+        dat, rows = load_ancil_cat(datname)
+        idx = rows[int(objname.split('_')[-1])]
         zred = float(dat['z_best'][idx])
-    tuniv = WMAP9.age(zred).value*1e9
     model_params[n.index('zred')]['init'] = zred
 
     # now construct the nonparametric SFH
     # current scheme: last bin is 15% age of the Universe, first two are 0-30, 30-100
     # remaining N-3 bins spaced equally in logarithmic space
-    tbinmax = (tuniv*0.85)
-    agelims = agelims[:2] + np.linspace(agelims[2],np.log10(tbinmax),nbins_sfh-2).tolist() + [np.log10(tuniv)]
-    agebins = np.array([agelims[:-1], agelims[1:]])
+    agebins = agebins_from_redshift(zred, agelims, nbins_sfh)
 
     # load nvariables and agebins
     model_params[n.index('agebins')]['N'] = nbins_sfh
-    model_params[n.index('agebins')]['init'] = agebins.T
+    model_params[n.index('agebins')]['init'] = agebins
     model_params[n.index('mass')]['N'] = nbins_sfh
     model_params[n.index('logsfr_ratios')]['N'] = nbins_sfh-1
     model_params[n.index('logsfr_ratios')]['init'] = np.full(nbins_sfh-1,0.0) # constant SFH
@@ -2,11 +2,12 @@ import numpy as np
 import os
 from prospect.models import priors, sedmodel
 from prospect.sources import FastStepBasis
-from sedpy import observate
-from astropy.cosmology import WMAP9
+from cosmo_tables import age_of_universe, luminosity_distance
 from td_io import load_zp_offsets
+from nonpar_sfh import zfrac_to_masses
 from scipy.stats import truncnorm
 from astropy.io import ascii
+from sps_cache import nebline_filter_matrix, observed_photometry, SpectrumCacheMixin
 
 lsun = 3.846e33
 pc = 3.085677581467192e18  # in cm
@@ -72,50 +73,6 @@ def tie_gas_logz(logzsol=None, **extras):
 def to_dust1(dust1_fraction=None, dust1=None, dust2=None, **extras):
     return dust1_fraction*dust2
 
-def zfrac_to_sfrac(z_fraction=None, **extras):
-    """This transforms from latent, independent `z` variables to sfr
-    fractions. The transformation is such that sfr fractions are drawn from a
-    Dirichlet prior.  See Betancourt et al. 2010
-    """
-    sfr_fraction = np.zeros(len(z_fraction) + 1)
-    sfr_fraction[0] = 1.0 - z_fraction[0]
-    for i in range(1, len(z_fraction)): sfr_fraction[i] = np.prod(z_fraction[:i]) * (1.0 - z_fraction[i])
-    sfr_fraction[-1] = np.clip(1 - np.sum(sfr_fraction[:-1]),0,1)
-
-    return sfr_fraction
-
-def zfrac_to_masses(logmass=None, z_fraction=None, agebins=None, **extras):
-    """This transforms from latent, independent `z` variables to sfr fractions
-    and then to bin mass fractions. The transformation is such that sfr
-    fractions are drawn from a Dirichlet prior.  See Betancourt et al. 2010
-    :returns masses:
-        The stellar mass formed in each age bin.
-    """
-    # sfr fractions (e.g. Leja 2017)
-    sfr_fraction = zfrac_to_sfrac(z_fraction)
-    # convert to mass fractions
-    time_per_bin = np.diff(10**agebins, axis=-1)[:,0]
-    sfr_fraction *= np.array(time_per_bin)
-    sfr_fraction /= sfr_fraction.sum()
-    masses = 10**logmass * sfr_fraction
-
-    return masses
-
-def masses_to_zfrac(mass=None, agebins=None, **extras):
-    """The inverse of zfrac_to_masses, for setting mock parameters based on
-    real bin masses.
-    """
-    total_mass = mass.sum()
-    time_per_bin = np.diff(10**agebins, axis=-1)[:,0]
-    sfr_fraction = mass / time_per_bin
-    sfr_fraction /= sfr_fraction.sum()
-    z_fraction = np.zeros(len(sfr_fraction) - 1)
-    z_fraction[0] = 1 - sfr_fraction[0]
-    for i in range(1, len(z_fraction)):
-        z_fraction[i] = 1.0 - sfr_fraction[i] / np.prod(z_fraction[:i])
-
-    return total_mass, z_fraction
-
 #############
 # MODEL_PARAMS
 #############
@@ -343,7 +300,7 @@ for param in model_params:
 model_params = tparams
 
 ###### Redefine SPS ######
-class NebSFH(FastStepBasis):
+class NebSFH(SpectrumCacheMixin, FastStepBasis):
     
     @property
     def emline_wavelengths(self):
@@ -353,23 +310,14 @@ class NebSFH(FastStepBasis):
     def get_nebline_luminosity(self):
         """Emission line luminosities in units of Lsun per solar mass formed
         """
-        return self.ssp.emline_luminosity/self.params['mass'].sum()
+        return self.emline_luminosity/self.params['mass'].sum()
 
     def nebline_photometry(self,filters,z):
         """analytically calculate emission line contribution to photometry
+        the line -> filter matrix is fixed for a given set of filters and redshift, so it is cached
         """
-        emlams = self.emline_wavelengths * (1+z)
         elums = self.get_nebline_luminosity # Lsun / solar mass formed
-        flux = np.empty(len(filters))
-        for i,filt in enumerate(filters):
-            # calculate transmission at nebular emission
-            trans = np.interp(emlams, filt.wavelength, filt.transmission, left=0., right=0.)
-            idx = (trans > 0)
-            if True in idx:
-                flux[i] = (trans[idx]*emlams[idx]*elums[idx]).sum()/filt.ab_zero_counts
-            else:
-                flux[i] = 0.0
-        return flux
+        return np.dot(nebline_filter_matrix(filters, self.emline_wavelengths, z), elums)
 
     def get_spectrum(self, outwave=None, filters=None, peraa=False, **params):
         """Get a spectrum and SED for the given params.
@@ -401,8 +349,7 @@ class NebSFH(FastStepBasis):
         spec_aa = lightspeed/wa**2 * sa # convert to perAA
         # Observed frame photometry, as absolute maggies
         if filters is not None:
-            mags = observate.getSED(wa, spec_aa * to_cgs, filters)
-            phot = np.atleast_1d(10**(-0.4 * mags))
+            phot = np.atleast_1d(observed_photometry(wa, spec_aa * to_cgs, filters))
         else:
             phot = 0.0
 
@@ -431,7 +378,7 @@ class NebSFH(FastStepBasis):
             # provided in the dist key in units of Mpc)
             dfactor = (self.params.get('lumdist', 1e-5) * 1e5)**2
         else:
-            lumdist = WMAP9.luminosity_distance(zred).value
+            lumdist = luminosity_distance(zred)
             dfactor = (lumdist * 1e5)**2
         if peraa:
             # spectrum will be in erg/s/cm^2/AA
@@ -463,7 +410,7 @@ def load_model(alpha_sfh=0.2,agelims=None, **extras):
 
     # create SFH bins
     zred = model_params[n.index('zred')]['init']
-    tuniv = WMAP9.age(zred).value
+    tuniv = age_of_universe(zred)
 
     # now construct the nonparametric SFH
     # current scheme: six bins, four spaced equally in logarithmic 
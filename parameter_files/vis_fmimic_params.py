@@ -3,7 +3,7 @@ import os
 from prospect.models import priors, sedmodel
 from prospect.sources import CSPSpecBasis
 from sedpy import observate
-from astropy.cosmology import WMAP9
+from cosmo_tables import age_of_universe
 from td_io import load_zp_offsets
 from scipy.stats import truncnorm
 from astropy.io import ascii
@@ -229,7 +229,7 @@ def load_model(**extras):
     # set tage_max, fix redshift
     n = [p['name'] for p in model_params]
     zred = 0.0001
-    tuniv = WMAP9.age(zred).value
+    tuniv = age_of_universe(zred)
     model_params[n.index('tage')]['prior'].update(maxi=tuniv)
 
     return sedmodel.SedModel(model_params)
@@ -0,0 +1,40 @@
+""" checks the batched SFH post-processing (calc_extra_quantities with batch_sfh=True)
+against the draw-by-draw functions, both with their default arguments
+"""
+import numpy as np
+import prosp_dutils
+
+def random_draws(ndraw=50, seed=1):
+    """ nonparametric SFH draws on the td_delta agebins, with no star formation in the
+    youngest bin for some of them, so that the minimum-SFR clip is used
+    """
+    agelims = [0.0,7.4772,8.0,8.5,9.0,9.5,9.8,10.0]
+    agebins = np.array([agelims[:-1], agelims[1:]]).T
+    rng = np.random.RandomState(seed)
+    mass = 10**rng.uniform(8,11,size=(ndraw,agebins.shape[0]))
+    mass[::5,0] = 0.0
+    mfrac = rng.uniform(0.5,0.9,size=ndraw)
+    return agebins, mass, mfrac
+
+def test_batch_sfh(ndraw=50):
+
+    agebins, mass, mfrac = random_draws(ndraw)
+    t = np.concatenate((np.linspace(0,0.2,50), np.linspace(0.2,12,200)))
+    batch = prosp_dutils.batch_sfh_quantities(t, mass, agebins, mfrac)
+
+    for i in range(ndraw):
+        sfh_params = {'sfh': 3, 'agebins': agebins, 'mformed': np.atleast_1d(mass[i].sum()),
+                      'mass_fraction': mass[i]/mass[i].sum(), 'mass': mass[i].sum()*mfrac[i]}
+        assert np.allclose(batch['sfh'][i], prosp_dutils.return_full_sfh(t, sfh_params), rtol=1e-10, atol=0)
+        assert np.allclose(batch['stellar_mass'][i], sfh_params['mass'], rtol=1e-12)
+        assert np.allclose(batch['half_time'][i], prosp_dutils.halfmass_assembly_time(sfh_params), rtol=1e-10)
+        for tstr, timescale in zip(['30','100','300'],[0.03, 0.1, 0.3]):
+            sfr = prosp_dutils.calculate_sfr(sfh_params, timescale, minsfr=-np.inf, maxsfr=np.inf)
+            assert np.allclose(batch['sfr_'+tstr][i], sfr, rtol=1e-10)
+
+    # the clip is in use
+    assert (batch['sfh'][::5,0] > 0).all()
+
+if __name__ == "__main__":
+    test_batch_sfh()
+    print 'batch and draw-by-draw SFH quantities agree'
@@ -0,0 +1,36 @@
+""" checks smooth_spectrum(fast=True) against the pixel-by-pixel smooth_spectrum
+on an FSPS-like (non-uniform) wavelength grid, with absorption lines and noise
+"""
+import numpy as np
+import prosp_dutils
+
+def fsps_like_grid():
+    """ coarse in the UV and IR, 0.9 AA sampling over the MILES range, as in FSPS
+    """
+    return np.concatenate((np.logspace(np.log10(91.),np.log10(3525.),600,endpoint=False),
+                           np.arange(3525.,7500.,0.9),
+                           np.logspace(np.log10(7500.),8,1000)))
+
+def noisy_spectrum(lam, nspec=3, seed=2):
+    rng = np.random.RandomState(seed)
+    spec = (lam/5000.)**-2 * np.exp(-(lam/1e6))
+    for center, depth, width in [(3934.,0.6,3.),(3969.,0.5,3.),(4102.,0.3,8.),(4861.,0.3,8.),
+                                 (5175.,0.2,5.),(6563.,0.4,10.)]:
+        spec = spec*(1-depth*np.exp(-(lam-center)**2/2./width**2))
+    return spec * (1 + 0.05*rng.randn(nspec,lam.size))
+
+def test_smooth_fast(sigmas=[100.,250.]):
+
+    lam = fsps_like_grid()
+    spec = noisy_spectrum(lam)
+    for sigma in sigmas:
+        for minlam, maxlam in [(0.0,1e50),(3e3,7e3)]:
+            fast = prosp_dutils.smooth_spectrum(lam,spec,sigma,minlam=minlam,maxlam=maxlam,fast=True)
+            for i in range(spec.shape[0]):
+                exact = prosp_dutils.smooth_spectrum(lam,spec[i],sigma,minlam=minlam,maxlam=maxlam)
+                assert np.allclose(fast[i], exact, rtol=1e-10, atol=0), \
+                       'sigma={0}: max fractional difference {1}'.format(sigma,np.abs(fast[i]/exact-1).max())
+
+if __name__ == "__main__":
+    test_smooth_fast()
+    print 'smooth_spectrum(fast=True) matches smooth_spectrum'